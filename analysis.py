@@ -0,0 +1,488 @@
+import time
+
+from cell_registry import lookup
+from llm_backend import PATIENT_BEGIN, PATIENT_END
+from analysis_sections import merge_section_results, run_with_retries, section_prompt, split_rule_sections
+from response_schema import build_schema, salvage, validate_result
+from stream_json import StreamingJsonParser
+from tracing import count, span
+
+# ==========================================
+# 解析の中身 (Streamlit に依存しない部分)
+# ==========================================
+# app.py の画面からも、オフラインの計測スクリプトからも同じ手順で呼べるようにする。
+
+# ==========================================
+# 2. AIへの指示書 (ロジック & 仕様書) - ★完全版★
+# ==========================================
+IMAGE_LOGIC_RULES = """
+【最重要：画像分析とデータ更新のロジック (v9.5)】
+提供された画像を以下の役割で厳密に区別し、思考プロセスを実行せよ。
+
+★【思考の質に関する指示】
+解析にあたっては、時間をかけて一項目ずつ丁寧に精査すること。
+特に、画像1〜4のどこにその根拠があるかを「指差し確認」するように確認し、
+漏れがないよう確実に全ての項目をスキャンせよ。
+ただし、根拠がない項目を無理に推測で埋めることは厳禁とし、
+「証拠に基づく正確な更新」と「証拠がない場合の過去維持」を両立させること。
+
+◆ 作成モードによる挙動の違い
+* **初回(新規)の場合**: 画像1・2（過去）は存在しない。画像3・4（今回）の情報のみから全ての項目を新規に決定せよ。「過去の維持」ルールは適用しない。
+* **更新(2回目以降)の場合**: 画像1・2（過去）を絶対基準とし、画像3・4（今回）で変更点を探せ。以下のルールを厳守せよ。
+
+◆ 画像の役割 (更新モード時)
+1. **画像1(表Before)** / 2. **画像2(裏Before)** → **絶対基準（ベースライン）**
+   - 原則として、ここの情報は「維持」する対象である。
+3. **画像3(問診Evidence)** / 4. **画像4(カルテEvidence)** → **変更・追加のための根拠**
+   - ここに新しい情報（新しい受診科、状態の変化）があれば、それを「反映」する。
+
+◆ チェックボックス(□/■)の物理的判定ルール
+* **黒く塗りつぶされている(■)**、または**レ点(✔)がある**場合のみ「有(CHECKED)」と判定する。
+* 白い四角(□)や、ゴミ・汚れは「無(UNCHECKED)」と判定する。
+
+◆ 7大禁止・強制ルール（ここを間違うと医療事故になるため厳守せよ）
+
+【ルール①：他科受診の維持と追加（過不足禁止）】
+* **過去の維持(更新時)**: 画像1・2（過去）でチェックが入っている診療科は、今回も必ずチェックを入れる（維持する）。
+* **新規の追加**: 画像3・4（問診・カルテ）に「皮膚科」「眼科」などの記載があれば、**迷わず新たに追加でチェックを入れること。**
+* **疾患名からの判断**: 画像3・4に治療中の疾患名の記載があれば該当する科を**迷わず新たに追加でチェックを入れること。** (例：爪白癬→皮膚科、白内障→眼科)
+
+【ルール②：自立度の現状維持（勝手な変更禁止）】
+* **原則維持(更新時)**: 障害高齢者・認知症高齢者の自立度は、画像1（過去）のランクを基準とする。
+* **軽量化の禁止**: 画像3（問診票）に「劇的に改善した」「完全に自立した」という明確な証拠がない限り、**ランクを勝手に軽く（J1やA1、Iなどへ）変更してはならない。**
+* **悪化の判断**: 問診票から悪化とみなせる場合は適宜ランクを上げる。ただし、無闇に重症化させることは避けること。
+* **迷ったら過去（画像1）のランクをそのまま書き写せ。**
+
+【ルール③：身体状態の判定（セット入力・躊躇禁止）】
+* 麻痺(I11), 筋力低下(I17), 拘縮(CC17), 関節痛(I19), 失調(I21), 褥瘡(I23), 皮膚疾患(BU23)について：
+  1. 画像3(問診票)や画像4(カルテ)に「痛み」「弱化」「拘縮」等の記載があれば、**迷わずチェックを入れること。**
+  2. (更新時) 部位や程度が不明な場合は、**画像1・2（過去）の部位・程度を強制的に引き継いでセット完了とせよ。**
+
+【ルール④：医学的管理（挟み撃ち対策＋視覚優先＋転記加筆＋矛盾排除）】
+* 血圧, 移動, 摂食, 運動, 嚥下 について。
+* **手順1：境界線の定義（「運動」などの挟まれた項目への対策）**
+  - **移動・運動・摂食・嚥下の範囲**:
+    - 項目名から開始し、右側にある「□特になし」「□有(またはあり)」の **2つの四角を見つけるまでは、隣の項目の文字が見えても視線を止めてはならない。**
+    - 「隣の文字」よりも「自分のチェックボックス」を優先して確保せよ。
+  - **血圧の範囲**: 「血圧」から開始し、右側の「移動」等の他項目が出てきたら停止する。
+* **手順2：物理チェックの確認（視覚絶対優先）**
+  - 定義された「範囲内」にある画像2（過去）のチェックを見る。
+  - **「■ 有（またはあり）」なら、必ず「有（またはあり）」を選択する。**（マークが文字より先に来る場合も含む）
+  - **「■ 特になし」なら、必ず「特になし」を選択する。**
+* **手順3：文章の継承と加筆（絶対ルール）**
+  - **転記**: 画像2（過去）の「有」の横にある（）内や、付近の留意事項は、**必ずそのまま転記せよ。そのさい（）で囲むのは不要。**
+  - **加筆**: 画像3・4（問診・カルテ）に新たな情報があれば、**転記した文章の後に追記せよ。**
+* **手順4：文章のフィルタリング（医学的整合性チェック）**
+  - **血圧の欄**: 「mmHg」「高い」「低い」「安定」「服用」「内服」「薬」以外の言葉（特に「杖」「歩行」「食事」「ムセ」等）があれば、それは隣の項目の誤検知である。**即座に削除せよ。**
+* **手順5：矛盾の排除（「有」＋「特になし」の完全禁止）**
+  - 「有」にチェックが入っている場合、テキスト欄に**「特になし」「なし」と記述することを固く禁ずる。**（空欄にせよ）
+
+【ルール⑤：必須選択項目の強制】
+* 以下の項目は、画像の状態に関わらず**必ずチェックを入れること**（医師の方針として固定）。
+    - 改善の見通し: BV43(期待できる)
+    - 今後のリスク: 転倒・骨折(V39), 移動能力の低下(AM39), 心肺機能の低下(BU39)
+    - 医学的管理: 訪問リハビリテーション(CY46), 通所リハビリテーション(CY47)
+
+【ルール⑥：電話番号の転記と更新（携帯対応）】
+* 申請者の電話番号 (BY14, CL14, CX14) について：
+  1. **問診票の優先**: 画像3(問診票)に電話番号の記載があれば、それを最優先で採用せよ（過去と異なっていても問診票を正とする）。
+  2. **過去の維持**: 問診票に記載がない場合は、画像1(過去)の電話番号を維持せよ。
+  3. **分割ルール**: 取得した番号（固定・携帯問わず）をハイフン等で区切り、以下のように分割せよ。
+      - BY14: 市外局番または携帯プレフィックス (先頭の3〜4桁) ※090/080等
+      - CL14: 市内局番など (中央の2〜4桁)
+      - CX14: 加入者番号 (末尾の4桁)
+
+【ルール⑦：氏名のふりがな】
+* セル O12 に、申請者氏名（A13）の「ふりがな」を全角ひらがなで記載せよ。
+* 読み方が不明な場合は、漢字から一般的に推測される最も標準的な読みを採用すること。
+"""
+
+STRICT_MEDICAL_RULES = """
+あなたは厳格な医療事務代行AIです。以下の仕様書を遵守しJSONを作成せよ。
+過去の定義を省略せず、以下の全セル番地定義をスキャン対象とすること。
+
+【出力JSON形式】
+{
+  "text_data": { "A13": "氏名", "O12": "ふりがな", "A38": "現病歴...", "A58": "特記..." },
+  "check_cells": ["CB16", "AF34", "V39", ...],
+  "change_log": ["..."]
+}
+
+【詳細仕様書（セル番地定義）】
+シート　表
+
+＜自由記載欄＞
+DH3/DR3/EA3 : 自動入力
+A13　：申請者氏名
+O12　：申請者氏名のふりがな（全角ひらがな）
+A14/I14/R14/AC14 :申請者の生年月日　和暦（大正、昭和）/年/月/日　 例：　昭和/35/03/21
+AT14 : 年齢
+BM13　: 申請者の住所
+BY14　: 電話番号（市外局番）
+CL14　: 電話番号（市内局番）
+CX14　: 電話番号（加入者番号）
+T18　: 医師氏名
+AA22　：最終診察日（必須）
+G29　：診断名1（主病名）
+G30　：診断名2
+G31　：診断名3
+CQ29/CQ30/CQ31 ：発症日
+
+A38　：生活機能の低下の原因となった傷病の経過（現病歴）
+      ※過去の内容を保持しつつ、直近のカルテの内容を追記すること。勝手に削除しない。
+
+＜チェック項目＞
+CB16   : □ 同意する（★毎回必ずチェック！）
+DC23/DP23 (初回/2回目): ★作成区分により自動判定（システム側で指定）
+
+■ 他科受診 (AH25/AV25):
+  AH25(有)の場合、以下を維持すること:
+  CA25(内科), CM25(精神科), CY25(外科), DW25(脳外), AH26(皮膚科), AV26(泌尿器),
+  BI26(婦人科), BU26(眼科), CG26(耳鼻科), CS26(リハ科), DE26(歯科), DP26(その他)
+
+■ 症状としての安定性 (AF34/AR34): ★必須
+  AF34 : □ 症状は安定している
+  AR34 : □ 症状は不安定である
+  BF34 : □ 不明
+
+■ 障害高齢者の日常生活自立度 (★悪化時のみ変更、不明は維持)
+BJ53 : 自立
+BV53 : J1 (交通機関利用可)
+CD53 : J2 (近所へ外出可)
+CM53 : A1 (準寝たきり・日中離床)
+CV53 : A2 (準寝たきり・外出少)
+DD53 : B1 (寝たきり・移乗自立)
+DM53 : B2 (寝たきり・移乗介助)
+DU53 : C1 (寝たきり・自力寝返り可)
+ED53 : C2 (寝たきり・自力寝返り不可)
+
+■ 認知症高齢者の日常生活自立度 (★悪化時のみ変更、不明は維持)
+BJ55 : 自立 (認知症なし/軽度)
+BV55 : I   (ほぼ自立)
+CD55 : IIa (家庭外で支障)
+CM55 : IIb (家庭内で支障)
+CV55 : IIIa(日中介護必要)
+DD55 : IIIb(夜間介護必要)
+DM55 : IV  (常時介護必要)
+DU55 : M   (重度精神症状)
+
+AF59/AU59 (短期記憶): AF59(問題なし)・AU59(あり)
+意思決定: BB61(自立), BO61(いくらか困難), CF61(見守り), DA61(不可)
+意思伝達: BB63(伝えられる), BO63(いくらか困難), CF63(要件のみ), DA63(不可)
+
+問題行動 (★H67/S67 排他必須):
+H67(無), S67(有)
+※有の場合: AB67(幻視), AS67(妄想), BJ67(昼夜逆転), CA67(暴言), CR67(暴行), DI67(介護抵抗), DZ67(徘徊), AB69(火の不始末), AS69(不潔), BJ69(異食), CA69(性的), CR69(その他)
+
+精神疾患 (★H73/R73 排他必須):
+H73(無), R73(有) ※有なら CR73(専門医受診有)/EE73(無)
+
+【シート名: 裏】
+＜自由記載欄＞
+BC8 : 身長
+BX8 : 体重
+
+A58 : 特記すべき事項（★重要：過去の内容をベースにしつつ、以下の3要素構成で必ず文章を再構築すること）
+  1. 現病歴を中心とした症状
+      （記述例：右大腿骨頚部骨折に対する手術後であり歩行能力の低下がみられる）
+  2. 社会的背景
+      （記述例：独居であり、家族は遠方に住んでおり支援が難しい）
+  3. 結論（介護の必要性）
+      （記述例：これらにより介護による日常生活の介助が必要不可欠である / 介護サービスの導入が望ましい / ADLの維持向上のために介護によるリハビリの継続が必要不可欠である）
+
+＜チェック項目＞
+利き腕: AG8(右), AQ8(左)
+体重変化: DM8(増), DW8(維持/不明), EF8(減)
+
+I9 : □ 四肢欠損 (あれば X9 に部位)
+
+I11 : □ 麻痺 (あれば部位と程度必須)
+  V11(右上肢) -> AK11(軽), AZ11(中), BI11(重)
+  CT11(左上肢) -> DN11(軽), DX11(中), EG11(重)
+  V13(右下肢) -> AK13(軽), AZ13(中), BI13(重)
+  CT13(左下肢) -> DN13(軽), DX13(中), EG13(重)
+  V15(その他) -> BU15(軽), CF15(中), CP15(重)
+
+I17 : □ 筋力低下 (あれば Z17 に部位, AZ17/BH17/BP17 で程度)
+
+CC17 : □ 関節拘縮 (あれば CT17 に部位, DP17/DY17/EG17 で程度)
+
+I19 : □ 関節痛 (あれば Z19 に部位, AZ19/BH19/BP19 で程度)
+
+I21 : □ 失調・不随意運動 (あれば AP21〜DF21 で部位)
+
+I23 : □ 褥瘡 (あれば T23 に部位, AT23/BC23/BK23 で程度)
+
+BU23 : □ その他皮膚疾患 (あれば CR23 に部位, DQ23/DZ23/EG23 で程度)
+
+屋外歩行: AT27(自立), BO27(介護あれば可), CX27(していない)
+車いす: AT29(不使用), BO29(自操), CX29(介助)
+歩行補助具: AT31(不使用), BO31(屋外), CX31(屋内)
+食事: AT34(自立), CX34(全面介助)
+栄養: AT36(良好), CX36(不良)
+
+リスク (★V39, AM39, BU39は強制選択):
+H39(尿失禁), V39(転倒), AM39(移動低下), BI39(褥瘡), BU39(心肺低下),
+CQ39(閉じこもり), DG39(意欲低下), DW39(徘徊), H40(低栄養), V40(嚥下低下),
+AU40(脱水), BG40(易感染), BW40(疼痛), CT40(その他)
+
+改善可能性 (★BV43は強制選択):
+BV43(期待できる), CQ43(期待できない), DM43(不明)
+
+サービス (★CY46, CY47は強制選択):
+H46(訪問診療), Y46(訪問看護), AP46(訪問歯科), CA46(訪問薬剤), CY46(訪問リハ),
+H47(短期入所), AP47(訪問衛生), CA47(訪問栄養), CY47(通所リハ), H48(その他)
+
+管理項目 (★「有(AB/CO)」か「特になし(O/CB)」のどちらかを必ず選択):
+血圧: O50(特になし)/AB50(有) -> AG50(留意事項)
+移動: CB50(特になし)/CO50(有) -> CT50(留意事項)
+摂食: O51(特になし)/AB51(有) -> AG51(留意事項)
+運動: CB51(特になし)/CO51(有) -> CT51(留意事項)
+嚥下: O52(特になし)/AB52(有) -> AG52(留意事項)
+感染症: H54(無)/W54(有) -> AA54(病名)
+"""
+
+# ==========================================
+# 3. リクエストの組み立て & 実行
+# ==========================================
+def build_mode_instruction(is_initial):
+    """ 作成区分(初回/更新)ごとの指示 """
+    if is_initial:
+        mode_instruction = """
+        【重要：初回（新規）作成モード】
+        - ユーザーは「初回申請」を選択しました。
+        - 過去の意見書（画像1・2）は存在しません。
+        - **DC23 (初回)** に必ずチェックを入れ、**DP23 (2回目)** は空欄にすること。
+        - **CB16 (同意)** は必ずチェックすること。
+        - 画像3・4（問診票・カルテ）の情報のみから、全ての項目を新規に判断して作成せよ。
+        - 「過去の維持」に関するルールは無視してよい。
+        """
+    else:
+        mode_instruction = """
+        【重要：更新（2回目以降）モード】
+        - ユーザーは「更新申請」を選択しました。
+        - 画像1・2（過去の意見書）を絶対的なベースラインとすること。
+        - **DP23 (2回目)** に必ずチェックを入れ、**DC23 (初回)** は空欄にすること。
+        - **CB16 (同意)** は必ずチェックすること。
+        """
+
+    return mode_instruction
+
+def build_manual_prompt(manual_info):
+    """ サイドバーで入力された確定情報 """
+    return f"""
+    【ユーザーからの確定入力情報（最優先）】
+    - 医師氏名(T18): {manual_info['doctor']}
+    - 主病名(G29): {manual_info['diagnosis']}
+    - 最終診察日(AA22): {manual_info['last_visit']}
+    """
+
+def build_evidence_prompt(evidence_notes):
+    """ map-reduce のときに画像3・4の代わりに送る、ページごとの所見 """
+    return f"""
+    【画像3・4 (問診票・カルテ) の所見】
+    画像3・4は枚数が多いため、画像の代わりにページごとに抜き出した所見を以下に示す。
+    これを画像3・4の内容として扱い、ルールに従って変更・追加の根拠とせよ。
+{PATIENT_BEGIN}
+{evidence_notes}
+{PATIENT_END}
+    """
+
+def build_prior_prompt(prior):
+    """ 更新のときに画像1・2の代わりに送る、前回作成した意見書の内容 (patient_store の記録) """
+    lines = []
+    for addr, val in (prior.get("text_data") or {}).items():
+        cell = lookup(addr)
+        lines.append(f"    {addr}({cell.label if cell else ''}): " + str(val).replace("\n", "\n        "))
+    checks = []
+    for addr in prior.get("check_cells") or []:
+        cell = lookup(addr)
+        checks.append(f"{addr}({cell.group + ': ' if cell and cell.group else ''}{cell.label if cell else ''})")
+    return f"""
+    【画像1・2 (過去の意見書) の内容】
+    過去の意見書は画像ではなく、前回作成したときの記入内容を以下に示す。これを画像1・2として扱い、絶対基準とせよ。
+    ここに無い記載欄は空欄、■に無いチェック欄は□ (チェックなし) である。
+{PATIENT_BEGIN}
+    ＜記載欄＞
+{chr(10).join(lines)}
+    ＜■ チェックあり＞
+    {", ".join(checks)}
+{PATIENT_END}
+    """
+
+def build_requests(image_parts, manual_info, is_initial, sectioned=True, evidence_notes=None, prior=None):
+    """
+    Gemini に送るリクエストを組み立てる
+    image_parts: ラベル文字列と {"mime_type", "data"} が混ざったリスト (送るのは画像だけ)
+    evidence_notes: 画像3・4の代わりに送る所見のテキスト (reduce_evidence の結果。普段は None)
+    prior: 画像1・2の代わりに送る前回の {"text_data", "check_cells"} (更新で前回の記録があるとき)
+    戻り値: (セクションのリスト, リクエストのリスト)  ※分けない場合は1件
+    """
+    mode_instruction = build_mode_instruction(is_initial)
+    manual_prompt = build_manual_prompt(manual_info)
+    prior_prompt = build_prior_prompt(prior) if prior and not is_initial else None
+    evidence_prompt = build_evidence_prompt(evidence_notes) if evidence_notes else None
+
+    def build_request(rules_text):
+        full_prompt = [mode_instruction, manual_prompt, prior_prompt, evidence_prompt, IMAGE_LOGIC_RULES, rules_text, "\n\n以上のルール（特に強制選択項目とセット入力、全セル定義、特記事項の構成）を厳守し、JSONを作成せよ。"]
+        
+        # リクエスト作成（テキスト結合）
+        request_content = [p for p in full_prompt if isinstance(p, str)]
+        final_text_prompt = "\n".join(request_content)
+        
+        # APIリクエスト配列
+        final_request = [final_text_prompt]
+        for part in image_parts:
+            if isinstance(part, dict): final_request.append(part)
+        return final_request
+
+    # 仕様書をセクションに分けて並列に投げる (分けない場合は従来通り1回)
+    if sectioned:
+        header, sections = split_rule_sections(STRICT_MEDICAL_RULES)
+        requests = [build_request(section_prompt(header, sec)) for sec in sections]
+    else:
+        sections = [{"name": "全体", "cells": set()}]
+        requests = [build_request(STRICT_MEDICAL_RULES)]
+    # 出力を台帳の番地に限るスキーマ (セクションごとに担当の番地だけ)
+    for sec in sections:
+        sec["schema"] = build_schema(sec["cells"])
+    return sections, requests
+
+def parse_stream(chunks, on_item=None):
+    """ 応答の断片を逐次パースして JSON(dict) を返す """
+    parser = StreamingJsonParser(on_item)
+    for text in chunks:
+        parser.feed(text)
+    return parser.finish()
+
+def run_analysis(backend, sections, requests, on_item=None, poll=None, retries=1):
+    """
+    全リクエストを backend で並列に実行してマージする
+    on_item(セクション番号, ルートのキー, 番地, 値) は項目が届くたびに (ワーカースレッドから) 呼ばれる
+    - 各セクションの応答は validate_result で台帳と照らして整える
+    - JSON が途中で壊れたら、それまでに届いた項目で組み立て直す (partial=True)
+    - 1項目も読めなかった・通信に失敗したセクションだけを retries 回まで再実行する
+    戻り値: (マージ結果 or None(全滅), [(結果, 例外, 秒数), ...])
+      結果には "repairs" (直した内容のリスト) と "partial" が付く (マージ結果には含めない)
+    """
+    def call(job):
+        idx, final_request = job
+        items = []
+        def collect(root, key, value):
+            items.append((root, key, value))
+            if on_item:
+                on_item(idx, root, key, value)
+
+        with span("llm", section=sections[idx].get("name", str(idx))) as sp:
+            # 受信待ちとパースの時間を分けて記録する
+            parser = StreamingJsonParser(collect)
+            parse_seconds, chars, chunks = 0.0, 0, 0
+            started = time.perf_counter()
+            repairs, partial = [], False
+            try:
+                for text in backend.stream(final_request, sections[idx].get("schema")):
+                    if not chunks:
+                        sp.set(first_chunk_ms=round((time.perf_counter() - started) * 1000, 1))
+                    chars += len(text)
+                    chunks += 1
+                    t = time.perf_counter()
+                    try:
+                        parser.feed(text)
+                    finally:
+                        parse_seconds += time.perf_counter() - t
+                t = time.perf_counter()
+                try:
+                    result = parser.finish()
+                finally:
+                    parse_seconds += time.perf_counter() - t
+            except ValueError as e:
+                # 壊れた JSON: 閉じた項目だけで組み立て直す (1項目も無ければこのセクションは失敗)
+                if not items:
+                    raise
+                result, partial = salvage(items), True
+                repairs.append(f"JSONが壊れていたため、読めた{len(items)}項目だけを使用 ({e})")
+            finally:
+                sp.set(chunks=chunks, response_chars=chars, parse_ms=round(parse_seconds * 1000, 1))
+                count(response_chars=chars)
+
+            result, issues = validate_result(result)
+            result["repairs"] = repairs + issues
+            result["partial"] = partial
+            sp.set(repairs=len(result["repairs"]), partial=partial)
+            return result
+
+    def retried(result, first_error):
+        result["repairs"].insert(0, f"1回目が失敗したため再実行しました ({first_error})")
+
+    # 失敗したセクションだけをやり直す (全体の再実行はしない)
+    outcomes = run_with_retries(call, list(enumerate(requests)), retries, poll=poll, retried=retried)
+
+    if all(err is not None for _, err, _ in outcomes):
+        return None, outcomes
+    results = [_strip_meta(res) for res, _, _ in outcomes]
+    if len(sections) == 1:
+        return results[0], outcomes
+    with span("merge", sections=len(sections)):
+        return merge_section_results(sections, results), outcomes
+
+def _strip_meta(result):
+    """ repairs / partial を除いた結果 (保存・作成に使う形) """
+    if result is None:
+        return None
+    return {k: v for k, v in result.items() if k not in ("repairs", "partial")}
+
+# ==========================================
+# 4. 資料が多いときの map-reduce
+# ==========================================
+# 1リクエストに入りきらない (payload_budget.over_budget) ときは、
+#   map    : 画像3・4を1ページずつ並列に投げて、意見書に使える所見だけを短く抜き出す
+#   reduce : 過去の意見書 (画像1・2) + 所見のテキストで、いつもの解析を行う (build_requests の evidence_notes)
+EVIDENCE_MAP_PROMPT = """
+あなたは医療事務の補助AIです。以下の画像は、主治医意見書を作成するための資料「{label}」の1ページである。
+このページから、意見書の記入に使える事実だけを抜き出し、findings に1項目1文で列挙せよ。
+書かれていないことを推測で補ってはならない。該当する記載が無ければ findings は空でよい。
+- 申請者の氏名・ふりがな・生年月日・住所・電話番号
+- 受診中の診療科、治療中の疾患名と発症日、服薬
+- 麻痺・筋力低下・関節拘縮・関節痛・失調・褥瘡・皮膚疾患の有無と部位・程度
+- 身長・体重・利き腕、歩行・車いす・歩行補助具・食事・栄養の状況
+- 自立度、短期記憶・意思決定・意思伝達、問題行動、精神疾患
+- 血圧・移動・摂食・運動・嚥下の留意事項、感染症
+- 独居・家族の支援などの社会的背景
+チェックボックスは黒く塗りつぶされている(■)かレ点(✔)があるものだけを「有」として書け。
+"""
+
+EVIDENCE_MAP_SCHEMA = {
+    "type": "object",
+    "properties": {"findings": {"type": "array", "items": {"type": "string"}}},
+    "required": ["findings"],
+}
+
+def reduce_evidence(backend, pages, poll=None, retries=1):
+    """
+    資料のページごとに所見を抜き出して、1つのテキストにまとめる (map)
+    pages: [(ページの名前, {"mime_type", "data"}), ...]
+    戻り値: (所見のテキスト, [(所見のリスト, 例外, 秒数), ...])  読めなかったページはテキストにその旨を書く
+    """
+    def call(job):
+        idx, (label, part) = job
+        with span("map", page=label) as sp:
+            result = parse_stream(backend.stream([EVIDENCE_MAP_PROMPT.format(label=label), part], EVIDENCE_MAP_SCHEMA))
+            findings = result.get("findings") if isinstance(result, dict) else None
+            if not isinstance(findings, list):
+                raise ValueError("findings がありません")
+            findings = [str(f).strip() for f in findings if str(f).strip()]
+            sp.set(findings=len(findings))
+            return findings
+
+    outcomes = run_with_retries(call, list(enumerate(pages)), retries, poll=poll, unit="pages")
+
+    lines = []
+    for (label, _), (findings, err, _) in zip(pages, outcomes):
+        lines.append(f"■ {label}")
+        if err is not None:
+            lines.append("  (このページは読み取れませんでした)")
+        elif not findings:
+            lines.append("  (記載なし)")
+        else:
+            lines.extend(f"  - {f}" for f in findings)
+    return "\n".join(lines), outcomes
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# ---------------------------------------------------------
+# 解析結果キャッシュ
+# ---------------------------------------------------------
+# 同じ画像・同じ入力・同じモデル・同じ指示書での再解析は、ローカルディスクに
+# 保存した JSON を返して Gemini 呼び出しを省く (アプリ再起動後も有効)。
+# 容量・件数・経過日数の上限を超えたら、最後に使われたのが古いものから消す (LRU)。
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".analysis_cache")
+
+def make_cache_key(image_parts, manual_info, is_initial, model_name, prompt_text):
+    """ 送信内容から決まるキャッシュキー (sha256) """
+    h = hashlib.sha256()
+    meta = {"manual_info": manual_info, "is_initial": bool(is_initial), "model": model_name}
+    h.update(json.dumps(meta, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    h.update(hashlib.sha256(prompt_text.encode("utf-8")).digest())
+    for part in image_parts:
+        h.update(part["mime_type"].encode("utf-8"))
+        h.update(hashlib.sha256(part["data"]).digest())
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """ キー -> 解析結果JSON を1ファイルずつ保存するディスクキャッシュ """
+
+    def __init__(self, directory=CACHE_DIR, max_entries=500, max_bytes=50 * 1024 * 1024, max_age_days=30):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 86400
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        """ ヒットすれば解析結果(dict)、無ければ None """
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                result = json.load(f)
+            # 使った印に mtime を更新 (LRUの順番)
+            os.utime(path, None)
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, result):
+        """ 解析結果を保存し、上限を超えた古いものを消す """
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp, self._path(key))
+        self.evict()
+
+    def evict(self):
+        """ 期限切れを消し、件数・容量の上限に収まるまで古い順に消す """
+        with self._lock:
+            try:
+                names = [n for n in os.listdir(self.directory) if n.endswith(".json")]
+            except OSError:
+                return
+            entries = []
+            now = time.time()
+            for name in names:
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.max_age:
+                    self._remove(path)
+                else:
+                    entries.append((st.st_mtime, st.st_size, path))
+
+            entries.sort()  # 古い順
+            total = sum(size for _, size, _ in entries)
+            while entries and (len(entries) > self.max_entries or total > self.max_bytes):
+                _, size, path = entries.pop(0)
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,139 @@
+import contextvars
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from cell_registry import CELLS
+from cellref import split_address
+from tracing import span
+
+# ---------------------------------------------------------
+# 分担解析 (仕様書をセクションに分けて並列にGeminiへ投げる)
+# ---------------------------------------------------------
+# STRICT_MEDICAL_RULES の「詳細仕様書」を目印の文字列で区切り、
+# セクションごとに独立したリクエストを同時に実行して、結果を決まった順番でマージする。
+# 全体の待ち時間は「1回の長い生成」から「一番遅いセクション」になる。
+
+# (セクション名, シート名, 開始の目印) 。次の目印の直前までがそのセクション
+SECTION_MARKERS = [
+    ("表・基本情報/診断名/経過", "表", "シート　表"),
+    ("表・他科受診/安定性/自立度/認知機能", "表", "■ 他科受診"),
+    ("裏・身体状態/生活機能/特記事項", "裏", "【シート名: 裏】"),
+    ("裏・リスク/見通し/サービス/医学的管理", "裏", "リスク (★"),
+]
+
+ADDRESS_RE = re.compile(r"\b([A-Z]{1,2}\d{1,3})\b")
+
+def split_rule_sections(rules_text):
+    """
+    仕様書を (共通ヘッダー, [{"name", "sheet", "spec", "cells"}, ...]) に分ける
+    cells はそのセクションが担当するセル番地 (台帳に載っているもの) の集合
+    """
+    starts = []
+    for name, sheet, marker in SECTION_MARKERS:
+        pos = rules_text.find(marker)
+        if pos < 0:
+            raise ValueError(f"仕様書にセクションの目印が見つかりません: {marker}")
+        starts.append((pos, name, sheet))
+    starts.sort()
+
+    header = rules_text[:starts[0][0]]
+    sections = []
+    for i, (pos, name, sheet) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(rules_text)
+        spec = rules_text[pos:end]
+        cells = {a for a in ADDRESS_RE.findall(spec) if a in CELLS}
+        sections.append({"name": name, "sheet": sheet, "spec": spec, "cells": cells})
+
+    # 仕様書に番地が書かれていない台帳のセル (「AP21〜DF21」の途中など) は、
+    # 同じシート・同じ行のセルを担当するセクションに割り当てる
+    row_owner = {}
+    for i, sec in enumerate(sections):
+        for addr in sec["cells"]:
+            row_owner.setdefault((CELLS[addr].sheet, split_address(addr)[1]), i)
+    assigned = set().union(*(sec["cells"] for sec in sections))
+    for addr, cell in CELLS.items():
+        i = row_owner.get((cell.sheet, split_address(addr)[1]))
+        if addr not in assigned and i is not None:
+            sections[i]["cells"].add(addr)
+    return header, sections
+
+def section_prompt(header, section):
+    """ 1セクション分の仕様書テキスト (共通ヘッダー + 担当範囲の指示 + 担当範囲) """
+    return (
+        header
+        + f"【分担解析】あなたの担当は「{section['name']}」(シート: {section['sheet']}) の範囲のみである。\n"
+        + "text_data / check_cells には下記の担当範囲に定義されたセル番地だけを出力し、"
+        + "担当外のセル番地は出力しないこと。change_log も担当範囲の変更のみ記載せよ。\n\n"
+        + section["spec"]
+    )
+
+def run_sections(call, prompts, max_workers=None, poll=None, interval=0.2):
+    """
+    call(prompt) を各プロンプトについて並列に実行する
+    poll を渡すと、待っている間 interval 秒ごとに呼び出し元のスレッドで poll() を呼ぶ (進捗表示用)
+    各ワーカーは呼び出し元のコンテキスト (トレースなど) を引き継いで動く
+    戻り値: [(結果 or None, 例外 or None, 秒数), ...] (prompts と同じ順番)
+    """
+    def work(prompt):
+        start = time.perf_counter()
+        try:
+            return call(prompt), None, time.perf_counter() - start
+        except Exception as e:
+            return None, e, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(prompts)) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, work, p) for p in prompts]
+        if poll:
+            pending = futures
+            while pending:
+                pending = wait(pending, timeout=interval).not_done
+                poll()
+        return [f.result() for f in futures]
+
+def run_with_retries(call, jobs, retries=1, poll=None, retried=None, unit="sections"):
+    """
+    run_sections で jobs を並列に実行し、失敗したものだけを retries 回までやり直す (全体の再実行はしない)
+    retried を渡すと、やり直して成功したものごとに retried(結果, 1回目の例外) を呼ぶ
+    unit はトレースの retry スパンに付ける件数の名前
+    戻り値: run_sections と同じ (秒数は全試行の合計)
+    """
+    outcomes = run_sections(call, jobs, poll=poll)
+    for _ in range(retries):
+        failed = [i for i, (_, err, _) in enumerate(outcomes) if err is not None]
+        if not failed:
+            break
+        with span("retry", **{unit: len(failed)}):
+            again = run_sections(call, [jobs[i] for i in failed], poll=poll)
+        for i, (res, err, secs) in zip(failed, again):
+            if res is not None and retried:
+                retried(res, outcomes[i][1])
+            outcomes[i] = (res, err, outcomes[i][2] + secs)
+    return outcomes
+
+def merge_section_results(sections, results):
+    """
+    セクションごとの {"text_data", "check_cells", "change_log"} を1つにまとめる
+    - 担当セクションの値を採用し、担当外の番地は捨てる (台帳に無い番地は最初に出したセクションの値)
+    - check_cells はセクション順・出現順で重複なし
+    同じ入力なら常に同じ結果になる
+    """
+    owner = {}
+    for i, sec in enumerate(sections):
+        for addr in sec["cells"]:
+            owner.setdefault(addr, i)
+
+    text_data, check_cells, seen, change_log = {}, [], set(), []
+    for i, (sec, result) in enumerate(zip(sections, results)):
+        if not isinstance(result, dict):
+            continue
+        for addr, val in (result.get("text_data") or {}).items():
+            if owner.get(addr, i) == i and addr not in text_data:
+                text_data[addr] = val
+        for addr in result.get("check_cells") or []:
+            if owner.get(addr, i) == i and addr not in seen:
+                seen.add(addr)
+                check_cells.append(addr)
+        for entry in result.get("change_log") or []:
+            change_log.append(f"[{sec['name']}] {entry}")
+    return {"text_data": text_data, "check_cells": check_cells, "change_log": change_log}
@@ -1,8 +1,33 @@
+import time
+SCRIPT_STARTED = time.perf_counter()  # 起動時間の計測用 (どの import よりも前)
 import streamlit as st
-import json
-import google.generativeai as genai
+import io
+import os
+import queue
+import uuid
+# 重いライブラリ (google.generativeai / openpyxl) はここでは import しない。
+# 解析・作成のときか、ログイン後の暖機 (warmup.py) で初めて読み込まれる。
 # main.py が同じフォルダにある前提です
-from main import update_opinion_form 
+from main import LiveForm
+from analysis import build_requests, reduce_evidence, run_analysis
+from cell_registry import lookup as lookup_cell
+from check_state import CheckState
+from panel_options import (ADLS, ATAXIA, DEPTS, J_OPTS, LEVELS, MANAGEMENT, N_OPTS, PARALYSIS_PARTS,
+                           PRESSURE_SORE, PROBLEMS, RISKS, SERVICES, STABILITY, SYMPTOMS, option_for)
+from llm_backend import make_backend
+from analysis_cache import AnalysisCache, make_cache_key
+from image_prep import DEFAULT_OPTIONS as IMAGE_PREP_DEFAULTS, UploadedImage, find_duplicates, format_bytes, prepare_uploads
+from jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue
+from patient_store import PatientStore
+from payload_budget import DEFAULT_BUDGET, estimate_requests, over_budget
+from template_cache import get_compiled_template
+from template_map import TemplateMap
+from tracing import Trace, span, trace, write_log
+from warmup import Warmup, import_module
+from xlsx_import import read_form
+from xlsx_patch import CompiledXlsx
+
+IMPORT_SECONDS = time.perf_counter() - SCRIPT_STARTED
 
 # ==========================================
 # 0. ページ設定 (★これが最優先！一番上に書く)
@@ -38,9 +63,27 @@ def check_password():
         # 正解
         return True
 
+@st.cache_resource
+def startup_stats():
+    """ プロセスで最初に画面を出したときの時間 (import / 最初の画面まで) """
+    return {}
+
+def report_startup(screen):
+    """ 初回だけ起動時間を記録する (診断情報と .traces/trace.jsonl) """
+    stats = startup_stats()
+    if stats:
+        return
+    stats.update(screen=screen, imports_ms=round(IMPORT_SECONDS * 1000, 1),
+                 first_screen_ms=round((time.perf_counter() - SCRIPT_STARTED) * 1000, 1))
+    tr = Trace("startup", **stats)
+    tr.seconds = stats["first_screen_ms"] / 1000
+    write_log(tr)
+
 # 認証チェック実行。失敗ならここでアプリを強制停止。
 if not check_password():
+    report_startup("login")
     st.stop()
+report_startup("main")
 
 # ==========================================
 # 0.2 セッション初期化 & タイトル表示
@@ -49,6 +92,23 @@ if "json_data" not in st.session_state:
     st.session_state.json_data = None
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
+if "xlsx_bytes" not in st.session_state:
+    st.session_state.xlsx_bytes = None  # 完成版エクセル (セッションごとにメモリで保持)
+if "live_form" not in st.session_state:
+    st.session_state.live_form = None  # 作成済みの書類 (修正の反映は前回との差分だけ)
+if "checks" not in st.session_state:
+    st.session_state.checks = None  # 修正パネルのチェック欄 (CheckState)
+if "traces" not in st.session_state:
+    st.session_state.traces = []  # 直近の処理時間の内訳 (診断情報)
+if "open_job" not in st.session_state:
+    st.session_state.open_job = None  # 修正パネルに読み込んでいるジョブの ID
+if "waiting" not in st.session_state:
+    st.session_state.waiting = set()  # このセッションで投入し、終わるのを待っているジョブの ID
+
+# ブラウザのタブごとの ID。URL に載せておき、再読み込みしても自分のジョブ (jobs.py) を見つけられるようにする
+if "desk" not in st.query_params:
+    st.query_params["desk"] = uuid.uuid4().hex[:12]
+DESK_ID = st.query_params["desk"]
 
 # タイトル表示 (パスワード突破後に1回だけ表示)
 st.title("🏥 主治医意見書 自動作成アプリ v9.9.1 (精度完全復旧版)")
@@ -61,312 +121,246 @@ if "MY_API_KEY" in st.secrets:
 else:
     MY_API_KEY = None
 
-if MY_API_KEY:
-    genai.configure(api_key=MY_API_KEY)
-
 MODEL_NAME = "gemini-3-flash-preview" # 最新モデル推奨
+
+# 再実行のたびに作り直さないよう、プロセス全体で1つだけ作って使い回す
+@st.cache_resource
+def get_backend(model_name, api_key):
+    # LLM_BACKEND=replay などで Gemini を使わずに動かせる (llm_backend.py 参照)
+    return make_backend(model_name, api_key=api_key)
+
+@st.cache_resource
+def get_analysis_cache():
+    return AnalysisCache()
+
+@st.cache_resource
+def get_job_queue():
+    # 解析ジョブの同時実行数 (それ以上は順番待ち)。JOB_WORKERS で変えられる
+    return JobQueue(max_workers=int(os.environ.get("JOB_WORKERS", "2")))
+
+@st.cache_resource
+def get_patient_store():
+    # 作成した意見書の記録 (患者 × 日付)。更新のときに前回の内容として使う
+    return PatientStore()
+
 TEMPLATE_FILE = "主治医意見書_テンプレート.xlsx"
-OUTPUT_FILE = "主治医意見書_完成版.xlsx"
+OUTPUT_FILE = "主治医意見書_完成版.xlsx"  # ダウンロード時のファイル名
+
+@st.cache_resource
+def check_template_map():
+    # テンプレートの番地マップ (template_map.py) を読み、台帳の番地と照合しておく (ブックは開かない)
+    tmap = get_compiled_template(TEMPLATE_FILE, kind=TemplateMap)
+    return tmap, tmap.check_registry()
+
+ANALYSIS_CACHE = get_analysis_cache()
+JOBS = get_job_queue()
+PATIENTS = get_patient_store()
+TEMPLATE_MAP, TEMPLATE_PROBLEMS = check_template_map()
+# 台帳の番地がテンプレートの □ とずれていると、その欄は作成時に黙って空のままになる
+if TEMPLATE_PROBLEMS:
+    with st.expander(f"⚠️ セル番地の台帳がテンプレートと合いません ({len(TEMPLATE_PROBLEMS)}件)。python template_map.py で確認してください"):
+        st.markdown("\n".join(f"- {p}" for p in TEMPLATE_PROBLEMS))
+
+# ログイン後に SDK の import とテンプレートのコンパイルを裏で済ませておく (APP_WARMUP=0 で無効)
+@st.cache_resource
+def start_warmup():
+    tasks = []
+    if os.environ.get("LLM_BACKEND", "gemini").lower() != "replay":
+        tasks.append(("gemini_sdk", import_module("google.generativeai")))
+    tasks.append(("template", lambda: get_compiled_template(TEMPLATE_FILE, kind=CompiledXlsx)))
+    return Warmup(tasks).start()
+
+WARMUP = start_warmup() if os.environ.get("APP_WARMUP", "1") != "0" else None
 
 # ==========================================
-# 2. AIへの指示書 (ロジック & 仕様書) - ★完全版★
+# 2. AIへの指示書 -> analysis.py (IMAGE_LOGIC_RULES / STRICT_MEDICAL_RULES)
 # ==========================================
-IMAGE_LOGIC_RULES = """
-【最重要：画像分析とデータ更新のロジック (v9.5)】
-提供された画像を以下の役割で厳密に区別し、思考プロセスを実行せよ。
-
-★【思考の質に関する指示】
-解析にあたっては、時間をかけて一項目ずつ丁寧に精査すること。
-特に、画像1〜4のどこにその根拠があるかを「指差し確認」するように確認し、
-漏れがないよう確実に全ての項目をスキャンせよ。
-ただし、根拠がない項目を無理に推測で埋めることは厳禁とし、
-「証拠に基づく正確な更新」と「証拠がない場合の過去維持」を両立させること。
-
-◆ 作成モードによる挙動の違い
-* **初回(新規)の場合**: 画像1・2（過去）は存在しない。画像3・4（今回）の情報のみから全ての項目を新規に決定せよ。「過去の維持」ルールは適用しない。
-* **更新(2回目以降)の場合**: 画像1・2（過去）を絶対基準とし、画像3・4（今回）で変更点を探せ。以下のルールを厳守せよ。
-
-◆ 画像の役割 (更新モード時)
-1. **画像1(表Before)** / 2. **画像2(裏Before)** → **絶対基準（ベースライン）**
-   - 原則として、ここの情報は「維持」する対象である。
-3. **画像3(問診Evidence)** / 4. **画像4(カルテEvidence)** → **変更・追加のための根拠**
-   - ここに新しい情報（新しい受診科、状態の変化）があれば、それを「反映」する。
-
-◆ チェックボックス(□/■)の物理的判定ルール
-* **黒く塗りつぶされている(■)**、または**レ点(✔)がある**場合のみ「有(CHECKED)」と判定する。
-* 白い四角(□)や、ゴミ・汚れは「無(UNCHECKED)」と判定する。
-
-◆ 7大禁止・強制ルール（ここを間違うと医療事故になるため厳守せよ）
-
-【ルール①：他科受診の維持と追加（過不足禁止）】
-* **過去の維持(更新時)**: 画像1・2（過去）でチェックが入っている診療科は、今回も必ずチェックを入れる（維持する）。
-* **新規の追加**: 画像3・4（問診・カルテ）に「皮膚科」「眼科」などの記載があれば、**迷わず新たに追加でチェックを入れること。**
-* **疾患名からの判断**: 画像3・4に治療中の疾患名の記載があれば該当する科を**迷わず新たに追加でチェックを入れること。** (例：爪白癬→皮膚科、白内障→眼科)
-
-【ルール②：自立度の現状維持（勝手な変更禁止）】
-* **原則維持(更新時)**: 障害高齢者・認知症高齢者の自立度は、画像1（過去）のランクを基準とする。
-* **軽量化の禁止**: 画像3（問診票）に「劇的に改善した」「完全に自立した」という明確な証拠がない限り、**ランクを勝手に軽く（J1やA1、Iなどへ）変更してはならない。**
-* **悪化の判断**: 問診票から悪化とみなせる場合は適宜ランクを上げる。ただし、無闇に重症化させることは避けること。
-* **迷ったら過去（画像1）のランクをそのまま書き写せ。**
-
-【ルール③：身体状態の判定（セット入力・躊躇禁止）】
-* 麻痺(I11), 筋力低下(I17), 拘縮(CC17), 関節痛(I19), 失調(I21), 褥瘡(I23), 皮膚疾患(BU23)について：
-  1. 画像3(問診票)や画像4(カルテ)に「痛み」「弱化」「拘縮」等の記載があれば、**迷わずチェックを入れること。**
-  2. (更新時) 部位や程度が不明な場合は、**画像1・2（過去）の部位・程度を強制的に引き継いでセット完了とせよ。**
-
-【ルール④：医学的管理（挟み撃ち対策＋視覚優先＋転記加筆＋矛盾排除）】
-* 血圧, 移動, 摂食, 運動, 嚥下 について。
-* **手順1：境界線の定義（「運動」などの挟まれた項目への対策）**
-  - **移動・運動・摂食・嚥下の範囲**:
-    - 項目名から開始し、右側にある「□特になし」「□有(またはあり)」の **2つの四角を見つけるまでは、隣の項目の文字が見えても視線を止めてはならない。**
-    - 「隣の文字」よりも「自分のチェックボックス」を優先して確保せよ。
-  - **血圧の範囲**: 「血圧」から開始し、右側の「移動」等の他項目が出てきたら停止する。
-* **手順2：物理チェックの確認（視覚絶対優先）**
-  - 定義された「範囲内」にある画像2（過去）のチェックを見る。
-  - **「■ 有（またはあり）」なら、必ず「有（またはあり）」を選択する。**（マークが文字より先に来る場合も含む）
-  - **「■ 特になし」なら、必ず「特になし」を選択する。**
-* **手順3：文章の継承と加筆（絶対ルール）**
-  - **転記**: 画像2（過去）の「有」の横にある（）内や、付近の留意事項は、**必ずそのまま転記せよ。そのさい（）で囲むのは不要。**
-  - **加筆**: 画像3・4（問診・カルテ）に新たな情報があれば、**転記した文章の後に追記せよ。**
-* **手順4：文章のフィルタリング（医学的整合性チェック）**
-  - **血圧の欄**: 「mmHg」「高い」「低い」「安定」「服用」「内服」「薬」以外の言葉（特に「杖」「歩行」「食事」「ムセ」等）があれば、それは隣の項目の誤検知である。**即座に削除せよ。**
-* **手順5：矛盾の排除（「有」＋「特になし」の完全禁止）**
-  - 「有」にチェックが入っている場合、テキスト欄に**「特になし」「なし」と記述することを固く禁ずる。**（空欄にせよ）
-
-【ルール⑤：必須選択項目の強制】
-* 以下の項目は、画像の状態に関わらず**必ずチェックを入れること**（医師の方針として固定）。
-    - 改善の見通し: BV43(期待できる)
-    - 今後のリスク: 転倒・骨折(V39), 移動能力の低下(AM39), 心肺機能の低下(BU39)
-    - 医学的管理: 訪問リハビリテーション(CY46), 通所リハビリテーション(CY47)
-
-【ルール⑥：電話番号の転記と更新（携帯対応）】
-* 申請者の電話番号 (BY14, CL14, CX14) について：
-  1. **問診票の優先**: 画像3(問診票)に電話番号の記載があれば、それを最優先で採用せよ（過去と異なっていても問診票を正とする）。
-  2. **過去の維持**: 問診票に記載がない場合は、画像1(過去)の電話番号を維持せよ。
-  3. **分割ルール**: 取得した番号（固定・携帯問わず）をハイフン等で区切り、以下のように分割せよ。
-      - BY14: 市外局番または携帯プレフィックス (先頭の3〜4桁) ※090/080等
-      - CL14: 市内局番など (中央の2〜4桁)
-      - CX14: 加入者番号 (末尾の4桁)
-
-【ルール⑦：氏名のふりがな】
-* セル O12 に、申請者氏名（A13）の「ふりがな」を全角ひらがなで記載せよ。
-* 読み方が不明な場合は、漢字から一般的に推測される最も標準的な読みを採用すること。
-"""
-
-STRICT_MEDICAL_RULES = """
-あなたは厳格な医療事務代行AIです。以下の仕様書を遵守しJSONを作成せよ。
-過去の定義を省略せず、以下の全セル番地定義をスキャン対象とすること。
-
-【出力JSON形式】
-{
-  "text_data": { "A13": "氏名", "O12": "ふりがな", "A38": "現病歴...", "A58": "特記..." },
-  "check_cells": ["CB16", "AF34", "V39", ...],
-  "change_log": ["..."]
-}
-
-【詳細仕様書（セル番地定義）】
-シート　表
-
-＜自由記載欄＞
-DH3/DR3/EA3 : 自動入力
-A13　：申請者氏名
-O12　：申請者氏名のふりがな（全角ひらがな）
-A14/I14/R14/AC14 :申請者の生年月日　和暦（大正、昭和）/年/月/日　 例：　昭和/35/03/21
-AT14 : 年齢
-BM13　: 申請者の住所
-BY14　: 電話番号（市外局番）
-CL14　: 電話番号（市内局番）
-CX14　: 電話番号（加入者番号）
-T18　: 医師氏名
-AA22　：最終診察日（必須）
-G29　：診断名1（主病名）
-G30　：診断名2
-G31　：診断名3
-CQ29/CQ30/CQ31 ：発症日
-
-A38　：生活機能の低下の原因となった傷病の経過（現病歴）
-      ※過去の内容を保持しつつ、直近のカルテの内容を追記すること。勝手に削除しない。
-
-＜チェック項目＞
-CB16   : □ 同意する（★毎回必ずチェック！）
-DC23/DP23 (初回/2回目): ★作成区分により自動判定（システム側で指定）
-
-■ 他科受診 (AH25/AV25):
-  AH25(有)の場合、以下を維持すること:
-  CA25(内科), CM25(精神科), CY25(外科), DW25(脳外), AH26(皮膚科), AV26(泌尿器),
-  BI26(婦人科), BU26(眼科), CG26(耳鼻科), CS26(リハ科), DE26(歯科), DP26(その他)
-
-■ 症状としての安定性 (AF34/AR34): ★必須
-  AF34 : □ 症状は安定している
-  AR34 : □ 症状は不安定である
-  BF34 : □ 不明
-
-■ 障害高齢者の日常生活自立度 (★悪化時のみ変更、不明は維持)
-BJ53 : 自立
-BV53 : J1 (交通機関利用可)
-CD53 : J2 (近所へ外出可)
-CM53 : A1 (準寝たきり・日中離床)
-CV53 : A2 (準寝たきり・外出少)
-DD53 : B1 (寝たきり・移乗自立)
-DM53 : B2 (寝たきり・移乗介助)
-DU53 : C1 (寝たきり・自力寝返り可)
-ED53 : C2 (寝たきり・自力寝返り不可)
-
-■ 認知症高齢者の日常生活自立度 (★悪化時のみ変更、不明は維持)
-BJ55 : 自立 (認知症なし/軽度)
-BV55 : I   (ほぼ自立)
-CD55 : IIa (家庭外で支障)
-CM55 : IIb (家庭内で支障)
-CV55 : IIIa(日中介護必要)
-DD55 : IIIb(夜間介護必要)
-DM55 : IV  (常時介護必要)
-DU55 : M   (重度精神症状)
-
-AF59/AU59 (短期記憶): AF59(問題なし)・AU59(あり)
-意思決定: BB61(自立), BO61(いくらか困難), CF61(見守り), DA61(不可)
-意思伝達: BB63(伝えられる), BO63(いくらか困難), CF63(要件のみ), DA63(不可)
-
-問題行動 (★H67/S67 排他必須):
-H67(無), S67(有)
-※有の場合: AB67(幻視), AS67(妄想), BJ67(昼夜逆転), CA67(暴言), CR67(暴行), DI67(介護抵抗), DZ67(徘徊), AB69(火の不始末), AS69(不潔), BJ69(異食), CA69(性的), CR69(その他)
-
-精神疾患 (★H73/R73 排他必須):
-H73(無), R73(有) ※有なら CR73(専門医受診有)/EE73(無)
-
-【シート名: 裏】
-＜自由記載欄＞
-BC8 : 身長
-BX8 : 体重
-
-A58 : 特記すべき事項（★重要：過去の内容をベースにしつつ、以下の3要素構成で必ず文章を再構築すること）
-  1. 現病歴を中心とした症状
-      （記述例：右大腿骨頚部骨折に対する手術後であり歩行能力の低下がみられる）
-  2. 社会的背景
-      （記述例：独居であり、家族は遠方に住んでおり支援が難しい）
-  3. 結論（介護の必要性）
-      （記述例：これらにより介護による日常生活の介助が必要不可欠である / 介護サービスの導入が望ましい / ADLの維持向上のために介護によるリハビリの継続が必要不可欠である）
-
-＜チェック項目＞
-利き腕: AG8(右), AQ8(左)
-体重変化: DM8(増), DW8(維持/不明), EF8(減)
-
-I9 : □ 四肢欠損 (あれば X9 に部位)
-
-I11 : □ 麻痺 (あれば部位と程度必須)
-  V11(右上肢) -> AK11(軽), AZ11(中), BI11(重)
-  CT11(左上肢) -> DN11(軽), DX11(中), EG11(重)
-  V13(右下肢) -> AK13(軽), AZ13(中), BI13(重)
-  CT13(左下肢) -> DN13(軽), DX13(中), EG13(重)
-  V15(その他) -> BU15(軽), CF15(中), CP15(重)
-
-I17 : □ 筋力低下 (あれば Z17 に部位, AZ17/BH17/BP17 で程度)
-
-CC17 : □ 関節拘縮 (あれば CT17 に部位, DP17/DY17/EG17 で程度)
-
-I19 : □ 関節痛 (あれば Z19 に部位, AZ19/BH19/BP19 で程度)
-
-I21 : □ 失調・不随意運動 (あれば AP21〜DF21 で部位)
-
-I23 : □ 褥瘡 (あれば T23 に部位, AT23/BC23/BK23 で程度)
-
-BU23 : □ その他皮膚疾患 (あれば CR23 に部位, DQ23/DZ23/EG23 で程度)
-
-屋外歩行: AT27(自立), BO27(介護あれば可), CX27(していない)
-車いす: AT29(不使用), BO29(自操), CX29(介助)
-歩行補助具: AT31(不使用), BO31(屋外), CX31(屋内)
-食事: AT34(自立), CX34(全面介助)
-栄養: AT36(良好), CX36(不良)
-
-リスク (★V39, AM39, BU39は強制選択):
-H39(尿失禁), V39(転倒), AM39(移動低下), BI39(褥瘡), BU39(心肺低下),
-CQ39(閉じこもり), DG39(意欲低下), DW39(徘徊), H40(低栄養), V40(嚥下低下),
-AU40(脱水), BG40(易感染), BW40(疼痛), CT40(その他)
-
-改善可能性 (★BV43は強制選択):
-BV43(期待できる), CQ43(期待できない), DM43(不明)
-
-サービス (★CY46, CY47は強制選択):
-H46(訪問診療), Y46(訪問看護), AP46(訪問歯科), CA46(訪問薬剤), CY46(訪問リハ),
-H47(短期入所), AP47(訪問衛生), CA47(訪問栄養), CY47(通所リハ), H48(その他)
-
-管理項目 (★「有(AB/CO)」か「特になし(O/CB)」のどちらかを必ず選択):
-血圧: O50(特になし)/AB50(有) -> AG50(留意事項)
-移動: CB50(特になし)/CO50(有) -> CT50(留意事項)
-摂食: O51(特になし)/AB51(有) -> AG51(留意事項)
-運動: CB51(特になし)/CO51(有) -> CT51(留意事項)
-嚥下: O52(特になし)/AB52(有) -> AG52(留意事項)
-感染症: H54(無)/W54(有) -> AA54(病名)
-"""
 
 # ==========================================
 # 3. アプリのロジック (解析関数)
 # ==========================================
-def analyze_4_images(img_old_f, img_old_b, img_new_q_list, img_new_c_list, manual_info, is_initial):
-    """ 4つのカテゴリーの画像をGeminiに投げてJSONを作る """
-    model = genai.GenerativeModel(MODEL_NAME)
+def analyze_4_images(job, backend, img_old_f, img_old_b, img_new_q_list, img_new_c_list, manual_info, is_initial, image_opts=None, use_cache=True, sectioned=True, budget=None, map_reduce=True, prior=None):
+    """
+    4つのカテゴリーの画像を backend (Gemini) に投げてJSONを作る
+    prior を渡すと (更新のとき)、過去の意見書は画像の代わりにその記録をテキストで送る
+    ジョブのワーカースレッドで動くので st は使わず、画面に出す内容は job.log / job.progress に書く
+    """
     image_parts = []
-    
-    # モード別の指示
-    if is_initial:
-        mode_instruction = """
-        【重要：初回（新規）作成モード】
-        - ユーザーは「初回申請」を選択しました。
-        - 過去の意見書（画像1・2）は存在しません。
-        - **DC23 (初回)** に必ずチェックを入れ、**DP23 (2回目)** は空欄にすること。
-        - **CB16 (同意)** は必ずチェックすること。
-        - 画像3・4（問診票・カルテ）の情報のみから、全ての項目を新規に判断して作成せよ。
-        - 「過去の維持」に関するルールは無視してよい。
-        """
-    else:
-        mode_instruction = """
-        【重要：更新（2回目以降）モード】
-        - ユーザーは「更新申請」を選択しました。
-        - 画像1・2（過去の意見書）を絶対的なベースラインとすること。
-        - **DP23 (2回目)** に必ずチェックを入れ、**DC23 (初回)** は空欄にすること。
-        - **CB16 (同意)** は必ずチェックすること。
-        """
-
-    # 画像のパッキング
+    img_new_q_list, img_new_c_list = list(img_new_q_list or []), list(img_new_c_list or [])
+
+    # 問診票・カルテの重複ページ (同じファイル・撮り直し・③と④の両方に入れたもの) は送らない
+    threshold = (image_opts or {}).get("dedupe_threshold", IMAGE_PREP_DEFAULTS["dedupe_threshold"])
+    if threshold is not None:
+        with span("dedupe") as sp:
+            evidence = [("③ 問診票", i, f) for i, f in enumerate(img_new_q_list, 1)] + [("④ カルテ", i, f) for i, f in enumerate(img_new_c_list, 1)]
+            kept, skipped = find_duplicates([f for _, _, f in evidence], threshold)
+            sp.set(pages=len(evidence), skipped=len(skipped))
+        if skipped:
+            where = {id(f): f"{group} {i}枚目 ({f.name})" for group, i, f in evidence}
+            kept_ids = {id(f) for f in kept}
+            img_new_q_list = [f for f in img_new_q_list if id(f) in kept_ids]
+            img_new_c_list = [f for f in img_new_c_list if id(f) in kept_ids]
+            job.log("info", f"⏭ 重複のため {len(skipped)}枚を送信から除きました\n\n"
+                    + "\n".join(f"- {where[id(dup)]} ≒ {where[id(orig)]} (類似度 {sim:.0%})" for dup, orig, sim in skipped))
+
+    # 画像のパッキング (前処理はスレッドプールでまとめて行い、順番は元のまま)
+    groups = []
+    if prior and not is_initial:
+        img_old_f = img_old_b = None
+        job.log("caption", "🗂 過去の意見書は、前回の記録をテキストで送ります (画像1・2の代わり)")
     if not is_initial and img_old_f:
-        image_parts.append("【画像1: 過去の意見書(表) - Before/絶対基準】")
-        image_parts.append({"mime_type": img_old_f.type, "data": img_old_f.getvalue()})
+        groups.append(("【画像1: 過去の意見書(表) - Before/絶対基準】", [img_old_f], None))
     if not is_initial and img_old_b:
-        image_parts.append("【画像2: 過去の意見書(裏) - Before/絶対基準】")
-        image_parts.append({"mime_type": img_old_b.type, "data": img_old_b.getvalue()})
+        groups.append(("【画像2: 過去の意見書(裏) - Before/絶対基準】", [img_old_b], None))
     if img_new_q_list:
-        image_parts.append("【画像3: 最新の問診票 - Evidence/変更根拠】")
-        for img in img_new_q_list: image_parts.append({"mime_type": img.type, "data": img.getvalue()})
+        groups.append(("【画像3: 最新の問診票 - Evidence/変更根拠】", list(img_new_q_list), "③ 問診票"))
     if img_new_c_list:
-        image_parts.append("【画像4: 直近のカルテ - Evidence/変更根拠】")
-        for img in img_new_c_list: image_parts.append({"mime_type": img.type, "data": img.getvalue()})
-
-    manual_prompt = f"""
-    【ユーザーからの確定入力情報（最優先）】
-    - 医師氏名(T18): {manual_info['doctor']}
-    - 主病名(G29): {manual_info['diagnosis']}
-    - 最終診察日(AA22): {manual_info['last_visit']}
+        groups.append(("【画像4: 直近のカルテ - Evidence/変更根拠】", list(img_new_c_list), "④ カルテ"))
+
+    job.progress = "🖼 画像を準備しています..."
+    with span("prepare_uploads") as sp:
+        prepared, size_stats = prepare_uploads([f for _, files, _ in groups for f in files], image_opts)
+        sp.set(pages=len(prepared), bytes_before=size_stats["before"], bytes_after=size_stats["after"])
+    pos = 0
+    past_parts, evidence_pages = [], []   # map-reduce 用: 過去の意見書 / ③④のページ (名前, パーツ)
+    for label, files, page_name in groups:
+        parts = prepared[pos:pos + len(files)]
+        image_parts.append(label)
+        image_parts.extend(parts)
+        if page_name:
+            evidence_pages.extend((f"{page_name} {i}枚目", part) for i, part in enumerate(parts, 1))
+        else:
+            past_parts.append(label)
+            past_parts.extend(parts)
+        pos += len(files)
+    job.log("caption", f"🖼 画像サイズ: {format_bytes(size_stats['before'])} → {format_bytes(size_stats['after'])} ({pos}枚)")
+
+    with span("build_prompt") as sp:
+        sections, requests = build_requests(image_parts, manual_info, is_initial, sectioned, prior=prior)
+        sp.set(requests=len(requests), prompt_chars=sum(len(req[0]) for req in requests))
+
+    # 同じ画像・入力・モデル・指示書なら前回の結果を返す
+    prompt_text = "\n".join(req[0] for req in requests)
+    cache_key = make_cache_key(requests[0][1:], manual_info, is_initial, MODEL_NAME, prompt_text)
+    if use_cache:
+        with span("cache_lookup") as sp:
+            cached = ANALYSIS_CACHE.get(cache_key)
+            sp.set(hit=cached is not None)
+        if cached is not None:
+            job.log("info", "♻️ 同じ内容の解析結果をキャッシュから復元しました")
+            return cached
+
+    # 1リクエストに入りきらないほど資料が多いときは、③④をページごとに所見へ要約してから解析する (map-reduce)
+    with span("estimate") as sp:
+        estimate = estimate_requests(requests)
+        over = over_budget(estimate, budget)
+        sp.set(bytes=estimate["bytes"], tokens=estimate["tokens"], over=",".join(over))
+    job.log("caption", f"📦 送信量の見積もり: 1リクエストあたり {format_bytes(estimate['bytes'])} / 約{estimate['tokens']:,}トークン × {estimate['requests']}件")
+    if over and evidence_pages and map_reduce:
+        job.log("info", f"📚 送信量が上限を超えるため、③④の{len(evidence_pages)}ページをそれぞれ要約してから解析します")
+        job.progress = f"📚 {len(evidence_pages)}ページの所見を抜き出しています..."
+        notes, page_outcomes = reduce_evidence(backend, evidence_pages)
+        unread = [name for (name, _), (_, err, _) in zip(evidence_pages, page_outcomes) if err is not None]
+        if unread:
+            job.log("warning", "⚠️ 読み取れなかったページ: " + ", ".join(unread))
+        job.log("details", f"📝 ページごとの所見 ({len(evidence_pages)}ページ)", notes)
+        with span("build_prompt", evidence_notes=True) as sp:
+            sections, requests = build_requests(past_parts, manual_info, is_initial, sectioned, evidence_notes=notes, prior=prior)
+            sp.set(requests=len(requests), prompt_chars=sum(len(req[0]) for req in requests))
+        estimate = estimate_requests(requests)
+        job.log("caption", f"📦 要約後: 1リクエストあたり {format_bytes(estimate['bytes'])} / 約{estimate['tokens']:,}トークン × {estimate['requests']}件")
+    elif over:
+        job.log("warning", "⚠️ 送信量が上限を超えています。時間がかかるか、失敗する可能性があります。")
+
+    # ストリーミングで受け取り、項目が閉じるたびにキューへ流す (進捗の文面はこのスレッドでまとめて作る)
+    events = queue.Queue()
+
+    received = {"text": {}, "check": [], "first": None}
+    started = time.perf_counter()
+    job.progress = f"🤖 {MODEL_NAME} が完全ルールで解析中... ({len(requests)}並列)"
+
+    def show_progress():
+        while not events.empty():
+            idx, root, key, value = events.get()
+            if received["first"] is None:
+                received["first"] = time.perf_counter() - started
+            if root == "text_data" and key:
+                received["text"][key] = value
+            elif root == "check_cells" and isinstance(value, str):
+                received["check"].append(value)
+        if received["first"] is None:
+            return
+        lines = [f"📥 受信中: 記載 {len(received['text'])}項目 / チェック {len(received['check'])}項目 (最初の項目まで {received['first']:.1f}秒)"]
+        for addr, val in list(received["text"].items())[-8:]:
+            cell = lookup_cell(addr)
+            lines.append(f"- {addr} {cell.label if cell else ''}: {str(val)[:40]}")
+        if received["check"]:
+            lines.append("- ■ " + ", ".join(received["check"][-15:]))
+        job.progress = "\n".join(lines)
+
+    result, outcomes = run_analysis(backend, sections, requests, on_item=lambda *ev: events.put(ev), poll=show_progress)
+
+    job.log("caption", "⏱ " + " / ".join(f"{sec['name']}: {sec_time:.1f}秒" for sec, (_, _, sec_time) in zip(sections, outcomes)))
+    failed = [(sec["name"], err) for sec, (_, err, _) in zip(sections, outcomes) if err is not None]
+    for name, err in failed:
+        job.log("error", f"解析エラー ({name}): {err}")
+    # 壊れたJSONの修復・再実行・台帳にない番地の除外など、自動で直した内容
+    partial = False
+    for sec, (res, _, _) in zip(sections, outcomes):
+        if res and res["repairs"]:
+            partial = partial or res["partial"]
+            job.log("details", f"🩹 {sec['name']}: 自動修正 {len(res['repairs'])}件", "\n".join(f"- {r}" for r in res["repairs"]))
+    if result is None:
+        return None
+
+    if failed:
+        job.log("warning", "⚠️ 一部のセクションが失敗したため、その範囲は空欄です。")
+    elif partial:
+        job.log("warning", "⚠️ 応答が途中で切れたセクションがあります。読めた範囲だけ反映しています。")
+    else:
+        ANALYSIS_CACHE.put(cache_key, result)
+    return result
+
+def save_patient_record(data, report):
+    """ 患者の記録に残す (次回の更新で前回の内容として使う)。report(種類, 本文) で結果を知らせる """
+    try:
+        saved = PATIENTS.save(data)
+    except Exception as e:
+        report("warning", f"⚠️ 患者の記録を保存できませんでした: {e}")
+        return
+    if saved:
+        name, birth, date = saved
+        report("caption", f"🗂 {name} ({birth}) の記録を保存しました ({date})")
+    else:
+        report("caption", "🗂 氏名が空欄のため、患者の記録には保存していません")
+
+def create_form_job(job, backend, uploads, manual_info, is_initial, options):
     """
-    
-    full_prompt = [mode_instruction, manual_prompt, IMAGE_LOGIC_RULES, STRICT_MEDICAL_RULES, "\n\n以上のルール（特に強制選択項目とセット入力、全セル定義、特記事項の構成）を厳守し、JSONを作成せよ。"]
-    
-    # リクエスト作成（テキスト結合）
-    request_content = [p for p in full_prompt if isinstance(p, str)]
-    final_text_prompt = "\n".join(request_content)
-    
-    # APIリクエスト配列
-    final_request = [final_text_prompt]
-    for part in image_parts:
-        if isinstance(part, dict): final_request.append(part)
-    
-    with st.spinner(f'{MODEL_NAME} が完全ルールで解析中...'):
-        try:
-            response = model.generate_content(final_request)
-            txt = response.text.replace("```json", "").replace("```", "").strip()
-            if "{" in txt: txt = txt[txt.find("{"):txt.rfind("}")+1]
-            return json.loads(txt)
-        except Exception as e:
-            st.error(f"解析エラー: {e}")
-            return None
+    解析 -> エクセル作成 までを1つのジョブとして行う (ワーカースレッドで動く)
+    戻り値: {"json_data", "live_form", "xlsx_bytes", "trace"}  1項目も解析できなければ例外 (ジョブは失敗になる)
+    """
+    with trace("analyze", job=job.id, model=MODEL_NAME, backend=backend.name, sectioned=options["sectioned"]) as tr:
+        result_json = analyze_4_images(job, backend, *uploads, manual_info, is_initial, **options)
+        live_form, xlsx_bytes = None, None
+        if result_json:
+            name = result_json.get("text_data", {}).get("A13")
+            if name:
+                job.label = f"{name[:20]} ({job.label})"
+            job.progress = "📄 エクセルを作成しています..."
+            live_form = LiveForm(TEMPLATE_FILE)
+            try:
+                xlsx_bytes, msg = live_form.render(result_json)
+                if xlsx_bytes:
+                    tr.attrs["xlsx_bytes"] = len(xlsx_bytes)
+                    job.log("success", f"作成完了！ ({msg})")
+                    save_patient_record(result_json, job.log)
+                else:
+                    job.log("error", f"Excel作成エラー: {msg}")
+            except Exception as e:
+                job.log("error", f"Excel作成エラー: {e}")
+    if result_json is None:
+        raise RuntimeError("解析結果を得られませんでした")
+    return {"json_data": result_json, "live_form": live_form, "xlsx_bytes": xlsx_bytes, "trace": tr.to_dict()}
 
 # ==========================================
 # 4. メイン画面 UI (サイドバー & 実行ボタン)
@@ -386,16 +380,66 @@ with st.sidebar:
     st.header("3. 画像のアップロード")
     if is_initial:
         st.info("🆕 初回作成モード: 過去の意見書は不要です。")
-        u_old_f, u_old_b = None, None
+        u_old_f, u_old_b, prior = None, None, None
     else:
         st.markdown("**🅰️ 過去の意見書 (Before)**")
-        u_old_f = st.file_uploader("① 表面 (1枚)", type=['jpg','png','jpeg'], key="old_f")
-        u_old_b = st.file_uploader("② 裏面 (1枚)", type=['jpg','png','jpeg'], key="old_b")
+        # このアプリで前に作った患者なら、過去の意見書の写真の代わりにその記録を使える
+        prior = None
+        query = st.text_input("🗂 前回の記録を氏名で探す", key="prior_query")
+        if query:
+            hits = PATIENTS.search(query)
+            if hits:
+                labels = ["使わない (過去の意見書の画像を送る)"] + [f"{name} ({birth}) 最新 {latest} / {n}件" for name, birth, _, latest, n in hits]
+                choice = st.selectbox("前回の記録", range(len(labels)), format_func=labels.__getitem__)
+                if choice:
+                    key = hits[choice - 1][2]
+                    date = st.selectbox("記録の日付", PATIENTS.history(key))
+                    prior = PATIENTS.load(key, date)[1]
+            else:
+                st.caption("該当する記録はありません")
+        # このアプリ (テンプレート) で作った意見書の xlsx があれば、それを読んで前回の記録にする
+        if not prior:
+            u_old_x = st.file_uploader("📄 作成済みの意見書 (xlsx) から読む", type=['xlsx'], key="old_xlsx")
+            if u_old_x:
+                try:
+                    prior, notes = read_form(io.BytesIO(u_old_x.getvalue()))
+                    for note in notes:
+                        st.caption(note)
+                except Exception as e:
+                    st.error(f"xlsx を読めませんでした: {e}")
+        if prior:
+            st.success("前回の記録を使うので、過去の意見書の画像は不要です。")
+            u_old_f, u_old_b = None, None
+        else:
+            u_old_f = st.file_uploader("① 表面 (1枚)", type=['jpg','png','jpeg'], key="old_f")
+            u_old_b = st.file_uploader("② 裏面 (1枚)", type=['jpg','png','jpeg'], key="old_b")
     
     st.markdown("**🅱️ 今回の資料 (Evidence)**")
     u_new_q = st.file_uploader("③ 最新 問診票 (複数可)", type=['jpg','png','jpeg'], accept_multiple_files=True, key="new_q")
     u_new_c = st.file_uploader("④ 直近 カルテ (複数可)", type=['jpg','png','jpeg'], accept_multiple_files=True, key="new_c")
+
+    with st.expander("⚙️ 画像の前処理 (送信サイズと精度の調整)"):
+        image_opts = {
+            "enabled": st.checkbox("前処理する", value=IMAGE_PREP_DEFAULTS["enabled"]),
+            "max_edge": st.slider("長辺の最大ピクセル", 800, 4000, IMAGE_PREP_DEFAULTS["max_edge"], step=100),
+            "grayscale": st.checkbox("グレースケール化", value=IMAGE_PREP_DEFAULTS["grayscale"]),
+            "quality": st.slider("JPEG品質", 40, 95, IMAGE_PREP_DEFAULTS["quality"]),
+        }
+        # ③④の中で同じページ (撮り直しを含む) を1枚にまとめる。1.0 にすると完全に同じ画像だけ
+        dedupe = st.checkbox("重複ページを除く (③④)", value=IMAGE_PREP_DEFAULTS["dedupe_threshold"] is not None)
+        threshold = st.slider("重複とみなす類似度", 0.80, 1.00, IMAGE_PREP_DEFAULTS["dedupe_threshold"], step=0.01, disabled=not dedupe)
+        image_opts["dedupe_threshold"] = threshold if dedupe else None
     
+    with st.expander("📦 送信量の上限 (資料が多いとき)"):
+        map_reduce = st.checkbox("上限を超えたら ③④ をページごとに要約してから解析する", value=True)
+        budget = {
+            "bytes": st.slider("1リクエストの上限 (MB)", 1, 20, DEFAULT_BUDGET["bytes"] // (1024 * 1024)) * 1024 * 1024,
+            "tokens": st.number_input("1リクエストの上限 (トークン)", 5000, 1000000, DEFAULT_BUDGET["tokens"], step=5000),
+        }
+
+    use_cache = not st.checkbox("キャッシュを使わずに再解析する", value=False)
+    sectioned = st.checkbox("セクションに分けて並列解析する", value=True)
+    show_diagnostics = st.checkbox("診断情報 (処理時間の内訳) を表示する", value=False)
     start_btn = st.button("この内容で作成開始", type="primary")
 
 # 作成ボタン押下時の処理
@@ -404,308 +448,319 @@ if start_btn:
     if is_initial and not (u_new_q or u_new_c):
         st.warning("⚠️ 初回作成には「問診票」または「カルテ」が必要です。")
         st.stop()
-    if not is_initial and not (u_old_f or u_old_b):
-        st.warning("⚠️ 更新作成には「過去の意見書」が必要です。")
+    if not is_initial and not (u_old_f or u_old_b or prior):
+        st.warning("⚠️ 更新作成には「過去の意見書」(または前回の記録) が必要です。")
         st.stop()
 
     manual_info = {"doctor": input_doctor, "diagnosis": input_diagnosis, "last_visit": input_date}
-    result_json = analyze_4_images(u_old_f, u_old_b, u_new_q, u_new_c, manual_info, is_initial)
-    
-    if result_json:
-        st.session_state.json_data = result_json
-        st.session_state.chat_history = []
-        try:
-            msg = update_opinion_form(TEMPLATE_FILE, OUTPUT_FILE, result_json)
-            st.success(f"作成完了！ ({msg})")
-        except Exception as e:
-            st.error(f"Excel作成エラー: {e}")
+    # 解析はジョブとして裏で行う (待っている間も画面は操作でき、次の患者の分も続けて投入できる)
+    # アップロードされたファイルはスクリプトの実行が終わると読めなくなることがあるので、中身を写しておく
+    uploads = (UploadedImage.copy_of(u_old_f), UploadedImage.copy_of(u_old_b),
+               [UploadedImage.copy_of(f) for f in u_new_q or []], [UploadedImage.copy_of(f) for f in u_new_c or []])
+    options = {"image_opts": image_opts, "use_cache": use_cache, "sectioned": sectioned, "budget": budget, "map_reduce": map_reduce, "prior": prior}
+    label = f"{'初回' if is_initial else '更新'} {time.strftime('%H:%M:%S')} 受付"
+    job = JOBS.submit("analyze", label, create_form_job, get_backend(MODEL_NAME, MY_API_KEY), uploads, manual_info, is_initial, options, owner=DESK_ID)
+    st.session_state.waiting.add(job.id)
+
+# ==========================================
+# 4.5 作成ジョブの一覧 (終わるまで1秒ごとに見に来る)
+# ==========================================
+JOB_STATUS = {QUEUED: "⏳ 順番待ち", RUNNING: "⚙️ 処理中", DONE: "✅ 完了", FAILED: "❌ 失敗"}
+
+def open_job(job):
+    """ 終わったジョブの結果を修正パネルに読み込む """
+    res = job.result
+    st.session_state.open_job = job.id
+    st.session_state.json_data = res["json_data"]
+    st.session_state.checks = None  # 修正パネルで json_data から作り直す
+    st.session_state.live_form = res["live_form"]
+    st.session_state.xlsx_bytes = res["xlsx_bytes"]
+    st.session_state.chat_history = []
+    st.session_state.traces = (st.session_state.traces + [res["trace"]])[-5:]
+
+def show_job_messages(job):
+    for kind, text, detail in job.messages:
+        if kind == "details":
+            with st.expander(text):
+                st.markdown(detail)
+        else:
+            getattr(st, kind)(text)
+
+def job_list():
+    jobs = JOBS.jobs(DESK_ID)[-10:]
+    if not jobs:
+        return
+    st.subheader("🗂 作成ジョブ")
+    finished = False
+    for job in reversed(jobs):
+        is_open = job.id == st.session_state.open_job
+        with st.container(border=True):
+            c1, c2 = st.columns([4, 1])
+            c1.markdown(f"**{JOB_STATUS[job.status]}** {job.label}  ({job.seconds:.0f}秒)" + ("  — 表示中" if is_open else ""))
+            if job.status == DONE and not is_open and c2.button("開く", key=f"open_{job.id}"):
+                open_job(job)
+                st.rerun()
+            # 終わって開いていないジョブは1行だけ (失敗したものは理由を出す)
+            if not job.done or is_open or job.status == FAILED or job.id in st.session_state.waiting:
+                if job.progress:
+                    st.markdown(job.progress)
+                show_job_messages(job)
+        if job.done and job.id in st.session_state.waiting:
+            st.session_state.waiting.discard(job.id)
+            # 何も開いていなければそのまま開く (編集中の患者がいるときは「開く」を押すまで待つ)
+            if st.session_state.json_data is None and job.status == DONE:
+                open_job(job)
+            finished = True
+    if finished:
+        st.rerun()  # 全体を描き直して修正パネル・ダウンロードを出す
+
+st.fragment(job_list, run_every=1.0 if JOBS.pending(DESK_ID) else None)()
 
 # ==========================================
 # 5. 全項目完全網羅パネル (v11.0)
 # ==========================================
+# 各エクスパンダーの中身は st.fragment にしてあり、入力するとそのエクスパンダーだけが再実行される。
+# text_data / checks はセッションに置いた同じオブジェクトを直接書き換える (再実行の範囲に関係なく残る)。
+
+@st.fragment
+def panel_front_basic(text_data, checks):
+    c1, c2 = st.columns(2)
+    text_data["A13"] = c1.text_input("氏名", text_data.get("A13", ""))
+    text_data["O12"] = c1.text_input("ふりがな", text_data.get("O12", ""))
+    text_data["BM13"] = c1.text_input("住所", text_data.get("BM13", ""))
+    text_data["T18"] = c2.text_input("医師名", text_data.get("T18", ""))
+    text_data["AA22"] = c2.text_input("診察日", text_data.get("AA22", ""))
+
+    c3, c4, c5 = st.columns(3)
+    text_data["BY14"] = c3.text_input("市外/090", text_data.get("BY14", ""))
+    text_data["CL14"] = c4.text_input("市内/中", text_data.get("CL14", ""))
+    text_data["CX14"] = c5.text_input("加入/下", text_data.get("CX14", ""))
+
+    text_data["A38"] = st.text_area("現病歴", text_data.get("A38", ""), height=100)
+
+@st.fragment
+def panel_front_diagnosis(text_data, checks):
+    st.markdown("**主病名 (最大3つ)**")
+    c1, c2 = st.columns([3, 1])
+    text_data["G29"] = c1.text_input("診断名1", text_data.get("G29", ""))
+    text_data["CQ29"] = c2.text_input("発症日1", text_data.get("CQ29", ""))
+    text_data["G30"] = c1.text_input("診断名2", text_data.get("G30", ""))
+    text_data["CQ30"] = c2.text_input("発症日2", text_data.get("CQ30", ""))
+    text_data["G31"] = c1.text_input("診断名3", text_data.get("G31", ""))
+    text_data["CQ31"] = c2.text_input("発症日3", text_data.get("CQ31", ""))
+
+    st.markdown("**症状の安定性**")
+    cur = checks.selected(STABILITY, "BF34")
+    stable = st.radio("安定性", list(STABILITY.values()), index=list(STABILITY).index(cur), horizontal=True)
+    checks.select_in_group("症状の安定性", option_for(STABILITY, stable))
+
+    st.markdown("**他科受診**")
+    cols = st.columns(4)
+    for i, (cell, label) in enumerate(DEPTS.items()):
+        checks.set(cell, cols[i%4].checkbox(label, value=(cell in checks), key=f"d_{cell}"))
+
+    # 連動
+    checks.select_in_group("他科受診", "AH25" if checks.any(DEPTS) else "AV25")
+
+@st.fragment
+def panel_front_cognition(text_data, checks):
+    c1, c2 = st.columns(2)
+    with c1:
+        cur_j = checks.selected(J_OPTS, "BJ53")
+        new_j = st.selectbox("障害高齢者", list(J_OPTS.values()), index=list(J_OPTS.keys()).index(cur_j))
+        checks.select_one(J_OPTS, option_for(J_OPTS, new_j))
+    with c2:
+        cur_n = checks.selected(N_OPTS, "BJ55")
+        new_n = st.selectbox("認知症高齢者", list(N_OPTS.values()), index=list(N_OPTS.keys()).index(cur_n))
+        checks.select_one(N_OPTS, option_for(N_OPTS, new_n))
+
+    st.divider()
+    st.caption("認知機能・精神・行動")
+    c1, c2 = st.columns(2)
+    # 短期記憶
+    mem_ok = c1.radio("短期記憶", ["問題なし","あり"], index=0 if "AF59" in checks else 1, horizontal=True) == "問題なし"
+    checks.select_in_group("短期記憶", "AF59" if mem_ok else "AU59")
+
+    # 問題行動
+    if st.checkbox("問題行動あり (S67)", value=("S67" in checks)):
+        checks.select_in_group("問題行動", "S67")
+        cols = st.columns(4)
+        for i, (cell, label) in enumerate(PROBLEMS.items()):
+            checks.set(cell, cols[i%4].checkbox(label, value=(cell in checks)))
+    else:
+        checks.select_in_group("問題行動", "H67")
+
+@st.fragment
+def panel_back_body(text_data, checks):
+    # 基本測定
+    c1, c2, c3, c4 = st.columns(4)
+    text_data["BC8"] = c1.text_input("身長", text_data.get("BC8", ""))
+    text_data["BX8"] = c2.text_input("体重", text_data.get("BX8", ""))
+    # 利き腕
+    hand = c3.radio("利き腕", ["右","左"], index=0 if "AG8" in checks else 1)
+    checks.select_in_group("利き腕", "AG8" if hand=="右" else "AQ8")
+
+    st.divider()
+    # 麻痺
+    if checks.set("I11", st.checkbox("麻痺あり (I11)", value=("I11" in checks))):
+        cols = st.columns(5)
+        for i, (name, p) in enumerate(PARALYSIS_PARTS.items()):
+            with cols[i]:
+                st.caption(name)
+                if checks.set(p["base"], st.checkbox("有", value=(p["base"] in checks), key=f"pc_{p['base']}")):
+                    lv_of = {c: l for l, c in p["lv"].items()}
+                    cur = lv_of[checks.selected(lv_of, p["lv"]["軽"])]
+                    new_lv = st.radio("程度", LEVELS, LEVELS.index(cur), key=f"pr_{p['base']}", label_visibility="collapsed")
+                    checks.select_one(lv_of, p["lv"][new_lv])
+
+    st.divider()
+    # その他の身体症状（ループで処理）
+    for name, s in SYMPTOMS.items():
+        c1, c2, c3 = st.columns([1, 2, 2])
+        if checks.set(s["base"], c1.checkbox(name, value=(s["base"] in checks), key=f"sc_{s['base']}")):
+            text_data[s['part']] = c2.text_input("部位", text_data.get(s['part'], ""), key=f"st_{s['base']}")
+            lv_of = {c: l for l, c in s["lv"].items()}
+            cur = lv_of[checks.selected(lv_of, s["lv"]["軽"])]
+            new_lv = c3.radio("程度", LEVELS, LEVELS.index(cur), key=f"sr_{s['base']}", horizontal=True, label_visibility="collapsed")
+            checks.select_one(lv_of, s["lv"][new_lv])
+
+    # 失調・褥瘡・皮膚
+    st.divider()
+    c1, c2, c3 = st.columns(3)
+    # 失調
+    if checks.set("I21", c1.checkbox("失調・不随意運動", value=("I21" in checks))):
+        for cell, label in ATAXIA.items():
+            checks.set(cell, c1.checkbox(label, value=(cell in checks), key=f"at_{cell}"))
+    # 褥瘡
+    if checks.set("I23", c2.checkbox("褥瘡", value=("I23" in checks))):
+        text_data["T23"] = c2.text_input("部位", text_data.get("T23",""))
+        cur_j = PRESSURE_SORE[checks.selected(PRESSURE_SORE, "AT23")]
+        new_j = c2.radio("程度", LEVELS, LEVELS.index(cur_j), horizontal=True)
+        checks.select_in_group("褥瘡 程度", option_for(PRESSURE_SORE, new_j))
+    # 皮膚
+    if checks.set("BU23", c3.checkbox("他皮膚疾患", value=("BU23" in checks))):
+        text_data["CR23"] = c3.text_input("部位・病名", text_data.get("CR23",""))
+
+@st.fragment
+def panel_back_adl(text_data, checks):
+    cols = st.columns(len(ADLS))
+    for i, (name, opts) in enumerate(ADLS.items()):
+        with cols[i]:
+            st.caption(name)
+            cur = checks.selected(opts, list(opts.keys())[0])
+            sel = st.selectbox(name, list(opts.values()), index=list(opts.keys()).index(cur), key=f"adl_{name}", label_visibility="collapsed")
+            checks.select_one(opts, option_for(opts, sel))
+
+@st.fragment
+def panel_back_management(text_data, checks):
+    # 管理項目
+    for name, m in MANAGEMENT.items():
+        c1, c2 = st.columns([1, 4])
+        if c1.toggle(name, value=(m["on"] in checks), key=f"mt_{name}"):
+            checks.select_one((m["on"], m["off"]), m["on"])
+            text_data[m["txt"]] = c2.text_input("留意事項", text_data.get(m["txt"], ""), key=f"mx_{name}")
+        else:
+            checks.select_one((m["on"], m["off"]), m["off"])
+
+    # リスク
+    st.divider()
+    st.markdown("**リスク**")
+    r_cols = st.columns(5)
+    for i, (cell, label) in enumerate(RISKS.items()):
+        checks.set(cell, r_cols[i%5].checkbox(label, value=(cell in checks), key=f"rk_{cell}"))
+
+    # サービス
+    st.divider()
+    st.markdown("**必要なサービス**")
+    s_cols = st.columns(5)
+    for i, (cell, label) in enumerate(SERVICES.items()):
+        checks.set(cell, s_cols[i%5].checkbox(label, value=(cell in checks), key=f"sv_{cell}"))
+
+@st.fragment
+def panel_back_notes(text_data, checks):
+    text_data["A58"] = st.text_area("特記事項 (A58)", text_data.get("A58", ""), height=250)
+
 if st.session_state.json_data:
     st.divider()
     st.subheader("🛠 全項目・修正パネル")
     st.caption("AI解析結果が初期値として反映されています。")
-    
+
     data = st.session_state.json_data
-    text_data = data.get("text_data", {})
-    check_cells = data.get("check_cells", [])
+    text_data = data.setdefault("text_data", {})
+    # チェック欄は順序付き集合で持つ (ウィジェットごとの in / 追加 / 削除が O(1)、重複なし)
+    if st.session_state.checks is None:
+        st.session_state.checks = CheckState(data.get("check_cells", []))
+    checks = st.session_state.checks
 
     tab_f, tab_b = st.tabs(["📄 表面 (全項目)", "📄 裏面 (全項目)"])
 
     # --- 表面 ---
     with tab_f:
-        # 1. 基本情報
         with st.expander("1. 基本情報・現病歴", expanded=True):
-            c1, c2 = st.columns(2)
-            text_data["A13"] = c1.text_input("氏名", text_data.get("A13", ""))
-            text_data["O12"] = c1.text_input("ふりがな", text_data.get("O12", ""))
-            text_data["BM13"] = c1.text_input("住所", text_data.get("BM13", ""))
-            text_data["T18"] = c2.text_input("医師名", text_data.get("T18", ""))
-            text_data["AA22"] = c2.text_input("診察日", text_data.get("AA22", ""))
-            
-            c3, c4, c5 = st.columns(3)
-            text_data["BY14"] = c3.text_input("市外/090", text_data.get("BY14", ""))
-            text_data["CL14"] = c4.text_input("市内/中", text_data.get("CL14", ""))
-            text_data["CX14"] = c5.text_input("加入/下", text_data.get("CX14", ""))
-            
-            text_data["A38"] = st.text_area("現病歴", text_data.get("A38", ""), height=100)
-
-        # 2. 診断名・他科
+            panel_front_basic(text_data, checks)
         with st.expander("2. 診断名・他科受診"):
-            st.markdown("**主病名 (最大3つ)**")
-            c1, c2 = st.columns([3, 1])
-            text_data["G29"] = c1.text_input("診断名1", text_data.get("G29", ""))
-            text_data["CQ29"] = c2.text_input("発症日1", text_data.get("CQ29", ""))
-            text_data["G30"] = c1.text_input("診断名2", text_data.get("G30", ""))
-            text_data["CQ30"] = c2.text_input("発症日2", text_data.get("CQ30", ""))
-            text_data["G31"] = c1.text_input("診断名3", text_data.get("G31", ""))
-            text_data["CQ31"] = c2.text_input("発症日3", text_data.get("CQ31", ""))
-
-            st.markdown("**症状の安定性**")
-            stable = st.radio("安定性", ["安定","不安定","不明"], index=0 if "AF34" in check_cells else 1 if "AR34" in check_cells else 2, horizontal=True)
-            if stable=="安定": 
-                if "AF34" not in check_cells: check_cells.append("AF34")
-                if "AR34" in check_cells: check_cells.remove("AR34")
-            elif stable=="不安定":
-                if "AR34" not in check_cells: check_cells.append("AR34")
-                if "AF34" in check_cells: check_cells.remove("AF34")
-
-            st.markdown("**他科受診**")
-            depts = {"CA25":"内科", "CM25":"精神科", "CY25":"外科", "DW25":"脳外", "AH26":"皮膚科", "AV26":"泌尿器", "BI26":"婦人科", "BU26":"眼科", "CG26":"耳鼻科", "CS26":"リハ科", "DE26":"歯科", "DP26":"その他"}
-            cols = st.columns(4)
-            for i, (cell, label) in enumerate(depts.items()):
-                if cols[i%4].checkbox(label, value=(cell in check_cells), key=f"d_{cell}"):
-                    if cell not in check_cells: check_cells.append(cell)
-                else:
-                    if cell in check_cells: check_cells.remove(cell)
-            
-            # 連動
-            if any(c in check_cells for c in depts.keys()):
-                if "AH25" not in check_cells: check_cells.append("AH25")
-                if "AV25" in check_cells: check_cells.remove("AV25")
-            else:
-                if "AV25" not in check_cells: check_cells.append("AV25")
-                if "AH25" in check_cells: check_cells.remove("AH25")
-
-        # 3. 自立度・認知症
+            panel_front_diagnosis(text_data, checks)
         with st.expander("3. 生活・認知機能"):
-            c1, c2 = st.columns(2)
-            with c1:
-                j_opts = {"BJ53":"自立", "BV53":"J1", "CD53":"J2", "CM53":"A1", "CV53":"A2", "DD53":"B1", "DM53":"B2", "DU53":"C1", "ED53":"C2"}
-                cur_j = next((k for k in j_opts if k in check_cells), "BJ53")
-                new_j = st.selectbox("障害高齢者", list(j_opts.values()), index=list(j_opts.keys()).index(cur_j))
-                for k in j_opts:
-                    if k in check_cells: check_cells.remove(k)
-                check_cells.append([k for k,v in j_opts.items() if v==new_j][0])
-            with c2:
-                n_opts = {"BJ55":"自立", "BV55":"I", "CD55":"IIa", "CM55":"IIb", "CV55":"IIIa", "DD55":"IIIb", "DM55":"IV", "DU55":"M"}
-                cur_n = next((k for k in n_opts if k in check_cells), "BJ55")
-                new_n = st.selectbox("認知症高齢者", list(n_opts.values()), index=list(n_opts.keys()).index(cur_n))
-                for k in n_opts:
-                    if k in check_cells: check_cells.remove(k)
-                check_cells.append([k for k,v in n_opts.items() if v==new_n][0])
-
-            st.divider()
-            st.caption("認知機能・精神・行動")
-            c1, c2 = st.columns(2)
-            # 短期記憶
-            mem_ok = "AF59" in check_cells
-            if c1.radio("短期記憶", ["問題なし","あり"], index=0 if mem_ok else 1, horizontal=True) == "問題なし":
-                if "AF59" not in check_cells: check_cells.append("AF59")
-                if "AU59" in check_cells: check_cells.remove("AU59")
-            else:
-                if "AU59" not in check_cells: check_cells.append("AU59")
-                if "AF59" in check_cells: check_cells.remove("AF59")
-            
-            # 問題行動
-            if st.checkbox("問題行動あり (S67)", value=("S67" in check_cells)):
-                if "S67" not in check_cells: check_cells.append("S67")
-                if "H67" in check_cells: check_cells.remove("H67")
-                probs = {"AB67":"幻視・幻聴", "AS67":"妄想", "BJ67":"昼夜逆転", "CA67":"暴言", "CR67":"暴行", "DI67":"介護抵抗", "DZ67":"徘徊", "AB69":"火の不始末", "AS69":"不潔行為", "BJ69":"異食", "CA69":"性的問題", "CR69":"その他"}
-                cols = st.columns(4)
-                for i, (cell, label) in enumerate(probs.items()):
-                    if cols[i%4].checkbox(label, value=(cell in check_cells)):
-                        if cell not in check_cells: check_cells.append(cell)
-                    else:
-                        if cell in check_cells: check_cells.remove(cell)
-            else:
-                if "H67" not in check_cells: check_cells.append("H67")
-                if "S67" in check_cells: check_cells.remove("S67")
+            panel_front_cognition(text_data, checks)
 
     # --- 裏面 ---
     with tab_b:
-        # 1. 身体
         with st.expander("1. 身体状態", expanded=True):
-            # 基本測定
-            c1, c2, c3, c4 = st.columns(4)
-            text_data["BC8"] = c1.text_input("身長", text_data.get("BC8", ""))
-            text_data["BX8"] = c2.text_input("体重", text_data.get("BX8", ""))
-            # 利き腕
-            hand = c3.radio("利き腕", ["右","左"], index=0 if "AG8" in check_cells else 1)
-            if hand=="右": 
-                if "AG8" not in check_cells: check_cells.append("AG8")
-                if "AQ8" in check_cells: check_cells.remove("AQ8")
-            else:
-                if "AQ8" not in check_cells: check_cells.append("AQ8")
-                if "AG8" in check_cells: check_cells.remove("AG8")
-
-            st.divider()
-            # 麻痺
-            if st.checkbox("麻痺あり (I11)", value=("I11" in check_cells)):
-                if "I11" not in check_cells: check_cells.append("I11")
-                parts = {
-                    "右上肢": {"base":"V11", "lv":{"軽":"AK11", "中":"AZ11", "重":"BI11"}},
-                    "左上肢": {"base":"CT11", "lv":{"軽":"DN11", "中":"DX11", "重":"EG11"}},
-                    "右下肢": {"base":"V13", "lv":{"軽":"AK13", "中":"AZ13", "重":"BI13"}},
-                    "左下肢": {"base":"CT13", "lv":{"軽":"DN13", "中":"DX13", "重":"EG13"}},
-                    "その他": {"base":"V15", "lv":{"軽":"BU15", "中":"CF15", "重":"CP15"}}
-                }
-                cols = st.columns(5)
-                for i, (name, p) in enumerate(parts.items()):
-                    with cols[i]:
-                        st.caption(name)
-                        if st.checkbox("有", value=(p["base"] in check_cells), key=f"pc_{p['base']}"):
-                            if p["base"] not in check_cells: check_cells.append(p["base"])
-                            cur = "軽"
-                            for l, c in p["lv"].items():
-                                if c in check_cells: cur=l
-                            new_lv = st.radio("程度", ["軽","中","重"], ["軽","中","重"].index(cur), key=f"pr_{p['base']}", label_visibility="collapsed")
-                            for c in p["lv"].values(): 
-                                if c in check_cells: check_cells.remove(c)
-                            check_cells.append(p["lv"][new_lv])
-                        else:
-                            if p["base"] in check_cells: check_cells.remove(p["base"])
-            else:
-                if "I11" in check_cells: check_cells.remove("I11")
-
-            st.divider()
-            # その他の身体症状（ループで処理）
-            s_items = {
-                "筋力低下": {"base":"I17", "part":"Z17", "lv":{"軽":"AZ17", "中":"BH17", "重":"BP17"}},
-                "関節拘縮": {"base":"CC17", "part":"CT17", "lv":{"軽":"DP17", "中":"DY17", "重":"EG17"}},
-                "関節痛": {"base":"I19", "part":"Z19", "lv":{"軽":"AZ19", "中":"BH19", "重":"BP19"}}
-            }
-            for name, s in s_items.items():
-                c1, c2, c3 = st.columns([1, 2, 2])
-                if c1.checkbox(name, value=(s["base"] in check_cells), key=f"sc_{s['base']}"):
-                    if s["base"] not in check_cells: check_cells.append(s["base"])
-                    text_data[s['part']] = c2.text_input("部位", text_data.get(s['part'], ""), key=f"st_{s['base']}")
-                    cur = "軽"
-                    for l, c in s["lv"].items():
-                        if c in check_cells: cur=l
-                    new_lv = c3.radio("程度", ["軽","中","重"], ["軽","中","重"].index(cur), key=f"sr_{s['base']}", horizontal=True, label_visibility="collapsed")
-                    for c in s["lv"].values():
-                        if c in check_cells: check_cells.remove(c)
-                    check_cells.append(s["lv"][new_lv])
-                else:
-                    if s["base"] in check_cells: check_cells.remove(s["base"])
-            
-            # 失調・褥瘡・皮膚
-            st.divider()
-            c1, c2, c3 = st.columns(3)
-            # 失調
-            if c1.checkbox("失調・不随意運動", value=("I21" in check_cells)):
-                if "I21" not in check_cells: check_cells.append("I21")
-                text_data["AP21"] = c1.text_input("部位(上肢)", text_data.get("AP21",""))
-                text_data["BF21"] = c1.text_input("部位(下肢)", text_data.get("BF21",""))
-                text_data["BW21"] = c1.text_input("部位(体幹)", text_data.get("BW21",""))
-            else:
-                if "I21" in check_cells: check_cells.remove("I21")
-            # 褥瘡
-            if c2.checkbox("褥瘡", value=("I23" in check_cells)):
-                if "I23" not in check_cells: check_cells.append("I23")
-                text_data["T23"] = c2.text_input("部位", text_data.get("T23",""))
-                cur_j = "軽" 
-                if "BC23" in check_cells: cur_j="中"
-                elif "BK23" in check_cells: cur_j="重"
-                new_j = c2.radio("程度", ["軽","中","重"], ["軽","中","重"].index(cur_j), horizontal=True)
-                if new_j=="軽": 
-                    if "AT23" not in check_cells: check_cells.append("AT23")
-                # ... (略: 褥瘡の他レベルも同様に処理可能だが長くなるため割愛。必要なら追加します)
-            else:
-                if "I23" in check_cells: check_cells.remove("I23")
-            # 皮膚
-            if c3.checkbox("他皮膚疾患", value=("BU23" in check_cells)):
-                if "BU23" not in check_cells: check_cells.append("BU23")
-                text_data["CR23"] = c3.text_input("部位・病名", text_data.get("CR23",""))
-            else:
-                if "BU23" in check_cells: check_cells.remove("BU23")
-
-        # 2. ADL
+            panel_back_body(text_data, checks)
         with st.expander("2. 生活機能 (ADL)"):
-            adls = {
-                "屋外歩行": {"AT27":"自立", "BO27":"介助あれば可", "CX27":"していない"},
-                "車いす": {"AT29":"不使用", "BO29":"自操", "CX29":"介助"},
-                "歩行補助具": {"AT31":"不使用", "BO31":"屋外", "CX31":"屋内"},
-                "食事": {"AT34":"自立", "CX34":"全面介助"},
-                "栄養": {"AT36":"良好", "CX36":"不良"}
-            }
-            cols = st.columns(len(adls))
-            for i, (name, opts) in enumerate(adls.items()):
-                with cols[i]:
-                    st.caption(name)
-                    cur = next((k for k in opts if k in check_cells), list(opts.keys())[0])
-                    sel = st.selectbox(name, list(opts.values()), index=list(opts.keys()).index(cur), key=f"adl_{name}", label_visibility="collapsed")
-                    new_cell = [k for k, v in opts.items() if v == sel][0]
-                    for k in opts:
-                        if k in check_cells: check_cells.remove(k)
-                    check_cells.append(new_cell)
-
-        # 3. 医学的管理
+            panel_back_adl(text_data, checks)
         with st.expander("3. 医学的管理・リスク・サービス"):
-            # 管理項目
-            m_items = {"血圧":{"on":"AB50","off":"O50","txt":"AG50"}, "移動":{"on":"CO50","off":"CB50","txt":"CT50"}, "摂食":{"on":"AB51","off":"O51","txt":"AG51"}, "運動":{"on":"CO51","off":"CB51","txt":"CT51"}, "嚥下":{"on":"AB52","off":"O52","txt":"AG52"}}
-            for name, m in m_items.items():
-                c1, c2 = st.columns([1, 4])
-                if c1.toggle(name, value=(m["on"] in check_cells), key=f"mt_{name}"):
-                    if m["on"] not in check_cells: check_cells.append(m["on"])
-                    if m["off"] in check_cells: check_cells.remove(m["off"])
-                    text_data[m["txt"]] = c2.text_input("留意事項", text_data.get(m["txt"], ""), key=f"mx_{name}")
-                else:
-                    if m["off"] not in check_cells: check_cells.append(m["off"])
-                    if m["on"] in check_cells: check_cells.remove(m["on"])
-            
-            # リスク
-            st.divider()
-            st.markdown("**リスク**")
-            risk_map = {"H39":"尿失禁", "BI39":"褥瘡", "CQ39":"閉じこもり", "DG39":"意欲低下", "DW39":"徘徊", "H40":"低栄養", "V40":"嚥下低下", "AU40":"脱水", "BG40":"易感染", "BW40":"疼痛"}
-            r_cols = st.columns(5)
-            for i, (cell, label) in enumerate(risk_map.items()):
-                if r_cols[i%5].checkbox(label, value=(cell in check_cells), key=f"rk_{cell}"):
-                    if cell not in check_cells: check_cells.append(cell)
-                else:
-                    if cell in check_cells: check_cells.remove(cell)
-
-            # サービス
-            st.divider()
-            st.markdown("**必要なサービス**")
-            sv_map = {"H46":"訪問診療", "Y46":"訪問看護", "AP46":"訪問歯科", "CA46":"訪問薬剤", "CY46":"訪問リハ", "H47":"短期入所", "AP47":"訪問衛生", "CA47":"訪問栄養", "CY47":"通所リハ"}
-            s_cols = st.columns(5)
-            for i, (cell, label) in enumerate(sv_map.items()):
-                if s_cols[i%5].checkbox(label, value=(cell in check_cells), key=f"sv_{cell}"):
-                    if cell not in check_cells: check_cells.append(cell)
-                else:
-                    if cell in check_cells: check_cells.remove(cell)
-
+            panel_back_management(text_data, checks)
         with st.expander("4. 特記事項", expanded=True):
-            text_data["A58"] = st.text_area("特記事項 (A58)", text_data.get("A58", ""), height=250)
+            panel_back_notes(text_data, checks)
 
-    # 保存
-    st.session_state.json_data["text_data"] = text_data
-    st.session_state.json_data["check_cells"] = list(set(check_cells))
+    # 保存 (フラグメントだけの再実行の後も、次の全体の再実行でここを通る)
+    st.session_state.json_data["check_cells"] = checks.to_list()
 
     st.divider()
     if st.button("🚀 修正内容をエクセルに反映する", type="primary", use_container_width=True):
-        try:
-            msg = update_opinion_form(TEMPLATE_FILE, OUTPUT_FILE, st.session_state.json_data)
-            st.success(f"更新完了！ {msg}")
-        except Exception as e:
-            st.error(f"エラー: {e}")
-
-    with open(OUTPUT_FILE, "rb") as f:
-        st.download_button("📥 完成版エクセルをダウンロード", data=f, file_name="主治医意見書_完成版.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
-
+        with trace("export") as tr:
+            try:
+                if st.session_state.live_form is None:
+                    st.session_state.live_form = LiveForm(TEMPLATE_FILE)
+                # 前回作成したときから変わった部分だけを反映する
+                xlsx_bytes, msg = st.session_state.live_form.render(st.session_state.json_data)
+                if xlsx_bytes:
+                    tr.attrs["xlsx_bytes"] = len(xlsx_bytes)
+                    st.session_state.xlsx_bytes = xlsx_bytes
+                    job = JOBS.get(st.session_state.open_job)
+                    if job:
+                        job.result["xlsx_bytes"] = xlsx_bytes  # 開き直したときも最新の版を出す
+                    st.success(f"更新完了！ {msg}")
+                    save_patient_record(st.session_state.json_data, lambda kind, text: getattr(st, kind)(text))
+                else:
+                    st.error(f"エラー: {msg}")
+            except Exception as e:
+                st.error(f"エラー: {e}")
+        st.session_state.traces = (st.session_state.traces + [tr.to_dict()])[-5:]
 
+    # ディスクを経由せず、このセッションの bytes をそのまま渡す
+    if st.session_state.xlsx_bytes:
+        st.download_button("📥 完成版エクセルをダウンロード", data=st.session_state.xlsx_bytes, file_name=OUTPUT_FILE, mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
 
+# ==========================================
+# 6. 診断情報 (処理時間の内訳)
+# ==========================================
+# 同じ内容は .traces/trace.jsonl にも1行ずつ残る (tracing.py 参照)
+if show_diagnostics:
+    with st.expander("🔍 診断情報 (直近の処理時間の内訳)", expanded=False):
+        stats = startup_stats()
+        if stats:
+            st.caption(f"起動: import {stats['imports_ms']:.0f}ms / 最初の画面 ({stats['screen']}) まで {stats['first_screen_ms']:.0f}ms")
+        if WARMUP:
+            st.caption(f"暖機: {WARMUP.summary()}")
+        st.caption(f"番地マップ: □ {sum(map(len, TEMPLATE_MAP.boxes))}個"
+                   + (" (テンプレートが変わったため作り直し)" if TEMPLATE_MAP.rescanned else ""))
+        limiter = getattr(get_backend(MODEL_NAME, MY_API_KEY), "limiter", None)
+        if limiter:
+            st.caption(f"Gemini: {limiter.summary()}")
+        for rec in reversed(st.session_state.traces):
+            st.markdown(f"**{rec['name']}** {rec['time']}  合計 {rec['ms'] / 1000:.2f}秒  (id: {rec['id']})")
+            if rec["counters"]:
+                st.caption(" / ".join(f"{k}: {v:,}" for k, v in rec["counters"].items()))
+            st.dataframe(rec["spans"], use_container_width=True, hide_index=True)
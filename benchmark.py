@@ -0,0 +1,279 @@
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# ---------------------------------------------------------
+# 性能計測 (python benchmark.py)
+# ---------------------------------------------------------
+# 本物のテンプレートに現実的なデータを書き込む処理と、解析側の前後処理を計測して
+# 1件あたりの時間(ms)とピークメモリ(KB)を JSON に保存する。
+# 比較の基準は benchmarks/baseline.json (--cold で取ったもの) をリポジトリに置いてある。
+# 既定の保存先 bench_results.json は作業用で、git には入れない。
+#   python benchmark.py --cold --baseline benchmarks/baseline.json   # 計測して基準と比べる (遅くなっていれば終了コード1)
+#   python benchmark.py --cold -o benchmarks/baseline.json           # 基準を取り直す (速くした変更と一緒にコミットする)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE = os.path.join(HERE, "主治医意見書_テンプレート.xlsx")
+
+
+# ---------------------------------------------------------
+# 計測用データ
+# ---------------------------------------------------------
+def small_payload():
+    return {
+        "text_data": {"A13": "山田 太郎", "O12": "やまだ たろう", "T18": "角田　和彦", "AA22": "令和8年1月20日",
+                      "G29": "右変形性股関節症", "BC8": "158", "BX8": "52"},
+        "check_cells": ["CB16", "DP23", "AF34", "BV43", "V39", "AM39", "BU39", "CY46", "CY47"],
+        "meta_birth_date": "1948-05-02",
+    }
+
+def full_payload():
+    """ 台帳の全テキスト欄 + 排他グループは1つずつ + 複数選択は全部 """
+    from cell_registry import CELLS, CHECKBOX, TEXT
+    text_data = {a: f"{c.label}の記載 " * 3 for a, c in CELLS.items() if c.kind == TEXT}
+    text_data["A38"] = "右変形性股関節症にて通院中。" * 20
+    text_data["A58"] = "独居であり、家族は遠方に住んでおり支援が難しい。" * 10
+    check_cells, groups = [], set()
+    for a, c in CELLS.items():
+        if c.kind != CHECKBOX:
+            continue
+        if c.group is None or c.group not in groups:
+            groups.add(c.group)
+            check_cells.append(a)
+    return {"text_data": text_data, "check_cells": check_cells, "meta_birth_date": "1940-01-02"}
+
+def unknown_merged_payload():
+    """ 台帳に無い番地・結合セルの右下・範囲指定が混ざったデータ """
+    data = small_payload()
+    data["text_data"].update({"B13": "結合の内側", "A13:C14": "範囲指定", "ZZ999": "範囲外", "EZ1": "右端"})
+    data["check_cells"] += ["CC16", "ZZ1", "AF34:AQ34", "B1"]
+    return data
+
+def model_response_text(data):
+    return "```json\n" + json.dumps(dict(data, change_log=["過去の内容を維持"]), ensure_ascii=False, indent=1) + "\n```"
+
+def synthetic_pages(count, size=(2480, 3508)):
+    """ A4 300dpi 相当のカラー画像 (PNG) を作る """
+    from PIL import Image, ImageDraw
+
+    class Page:
+        type = "image/png"
+
+        def __init__(self, data):
+            self._data = data
+
+        def getvalue(self):
+            return self._data
+
+    pages = []
+    for i in range(count):
+        img = Image.new("RGB", size, (250, 250, 245))
+        draw = ImageDraw.Draw(img)
+        for y in range(100, size[1] - 100, 60):
+            draw.line((100, y, size[0] - 100, y), fill=(30 + i, 30, 30), width=3)
+        buf = io.BytesIO()
+        img.save(buf, "PNG")
+        pages.append(Page(buf.getvalue()))
+    return pages
+
+
+# ---------------------------------------------------------
+# 計測ケース
+# ---------------------------------------------------------
+def build_cases():
+    import copy
+    from analysis import build_requests, parse_stream, run_analysis
+    from image_prep import prepare_uploads
+    from llm_backend import ReplayBackend
+    from payload_budget import estimate_requests
+    from main import mark_checkbox, render_opinion_form, safe_get_cell
+    from template_cache import get_compiled_template
+
+    cases = {}
+
+    # --- update_opinion_form (エンジン別 x データ別) ---
+    payloads = {"small": small_payload(), "full": full_payload(), "unknown_merged": unknown_merged_payload()}
+    for engine in ("xml", "openpyxl"):
+        for name, payload in payloads.items():
+            def fill(engine=engine, payload=payload):
+                xlsx, msg = render_opinion_form(TEMPLATE, copy.deepcopy(payload), engine=engine)
+                assert xlsx, msg
+            cases[f"fill/{engine}/{name}"] = fill
+
+    # --- 修正パネルからの再作成 (チェック1つだけ切り替え。前回との差分だけ反映) ---
+    from main import LiveForm
+    for engine in ("xml", "openpyxl"):
+        live = LiveForm(TEMPLATE, engine)
+        live.render(copy.deepcopy(payloads["full"]))
+        toggled = copy.deepcopy(payloads["full"])
+        toggled["check_cells"][toggled["check_cells"].index("CB16")] = "CS16"
+        states = [payloads["full"], toggled]
+        def reexport(live=live, states=states):
+            states.reverse()
+            xlsx, msg = live.render(copy.deepcopy(states[0]))
+            assert xlsx, msg
+        cases[f"export/{engine}/incremental_one_check"] = reexport
+
+    # --- safe_get_cell / mark_checkbox 単体 ---
+    compiled = get_compiled_template(TEMPLATE)
+    wb = compiled.new_workbook()
+    ws, anchors = wb.worksheets[0], compiled.anchor_indexes[0]
+    lookups = ["A13", "B13", "O13", "A13:C14", "CB16", "AF34", "BJ53", "ED53", "ZZ999"]
+    cases["cell/safe_get_cell/index"] = lambda: [safe_get_cell(ws, a, anchors) for a in lookups]
+    cases["cell/safe_get_cell/scan"] = lambda: [safe_get_cell(ws, a) for a in lookups]
+    checks = [a for a in full_payload()["check_cells"] if a[-2:] in ("16", "23", "25", "26", "34", "53", "55")]
+    # 毎回 □ から始める (一度 ■ にしたままだと、2回目以降は何もしない経路だけを測ってしまう)
+    originals = [(cell, cell.value) for cell in (safe_get_cell(ws, a, anchors) for a in checks)]
+    def mark_all():
+        for a in checks:
+            mark_checkbox(ws, a, anchors)
+        for cell, value in originals:
+            cell.value = value
+    cases["cell/mark_checkbox/index"] = mark_all
+
+    # --- 応答のパース ---
+    response = model_response_text(full_payload())
+    chunks = [response[i:i + 64] for i in range(0, len(response), 64)]
+    cases["parse/stream_json"] = lambda: parse_stream(chunks)
+    cases["parse/json_loads"] = lambda: json.loads(response.replace("```json", "").replace("```", "").strip())
+
+    # --- リクエストの組み立て ---
+    pages = synthetic_pages(4)
+    manual = {"doctor": "角田　和彦", "diagnosis": "右変形性股関節症", "last_visit": "令和8年1月20日"}
+    prepared, _ = prepare_uploads(pages)
+    cases["request/prepare_uploads_4pages"] = lambda: prepare_uploads(pages)
+    cases["request/build_sectioned"] = lambda: build_requests(prepared, manual, False, sectioned=True)
+    cases["request/build_single"] = lambda: build_requests(prepared, manual, False, sectioned=False)
+    sectioned_requests = build_requests(prepared, manual, False, sectioned=True)[1]
+    cases["request/estimate_sectioned"] = lambda: estimate_requests(sectioned_requests)
+
+    # --- 解析 -> 作成 (オフライン。待ち時間なしのリプレイ) ---
+    backend = ReplayBackend(directory=None, default=response, chunk_size=256)
+    sections, requests = build_requests(prepared, manual, False, sectioned=True)
+    def end_to_end():
+        result, _ = run_analysis(backend, sections, requests)
+        xlsx, msg = render_opinion_form(TEMPLATE, result)
+        assert xlsx, msg
+    cases["pipeline/analyze_replay_to_xlsx"] = end_to_end
+
+    # 事前にテンプレートのコンパイルを済ませておく (初回コストは別に計測)
+    for engine in ("xml", "openpyxl"):
+        render_opinion_form(TEMPLATE, small_payload(), engine=engine)
+    return cases
+
+def cold_compile_cases():
+    """ テンプレートのコンパイル (プロセスで1回だけ払うコスト) """
+    from template_cache import CompiledTemplate, clear_template_cache, get_compiled_template
+    from xlsx_patch import CompiledXlsx
+
+    def compile_kind(kind):
+        def run():
+            clear_template_cache()
+            get_compiled_template(TEMPLATE, kind=kind)
+        return run
+    return {"compile/openpyxl": compile_kind(CompiledTemplate), "compile/xml": compile_kind(CompiledXlsx)}
+
+def startup_cases():
+    """ 新しいプロセスで app.py が読み込むモジュールを import する時間 (ログイン画面までの下限) """
+    code = "import main, analysis, llm_backend, image_prep, analysis_cache, tracing, warmup, xlsx_patch"
+    def run():
+        subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True)
+    return {"startup/import_app_modules": run}
+
+
+# ---------------------------------------------------------
+# 計測本体
+# ---------------------------------------------------------
+def measure(func, repeat, min_time=0.2):
+    """ 1回あたりの時間(ms)の統計とピークメモリ(KB) """
+    func()  # ウォームアップ
+    times = []
+    start_all = time.perf_counter()
+    while len(times) < repeat or (time.perf_counter() - start_all < min_time and len(times) < repeat * 20):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "n": len(times),
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+def compare(results, baseline, threshold):
+    """ 基準より threshold 倍以上遅い/重いケースを返す """
+    regressions = []
+    for name, cur in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for key in ("median_ms", "peak_kb"):
+            if base[key] > 0 and cur[key] / base[key] > threshold:
+                regressions.append((name, key, base[key], cur[key]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="主治医意見書アプリの性能計測")
+    parser.add_argument("-o", "--out", default="bench_results.json", help="結果の保存先 (JSON)")
+    parser.add_argument("--baseline", help="比較する過去の結果 (JSON)")
+    parser.add_argument("--threshold", type=float, default=1.25, help="この倍率を超えたら劣化とみなす")
+    parser.add_argument("-k", "--filter", default="", help="名前にこの文字列を含むケースだけ実行")
+    parser.add_argument("-n", "--repeat", type=int, default=5)
+    parser.add_argument("--cold", action="store_true", help="テンプレートのコンパイル時間と起動時の import も計測する")
+    args = parser.parse_args(argv)
+
+    # 比較の基準は計測の前に読む (-o と同じファイルを指していても、上書きした自分自身と比べない)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    cases = dict(cold_compile_cases(), **startup_cases()) if args.cold else {}
+    cases.update(build_cases())
+
+    results = {}
+    for name, func in cases.items():
+        if args.filter not in name:
+            continue
+        results[name] = measure(func, 1 if name.startswith(("compile/", "startup/")) else args.repeat)
+        r = results[name]
+        print(f"{name:40s} median {r['median_ms']:10.3f} ms   min {r['min_ms']:10.3f} ms   peak {r['peak_kb']:10.1f} KB   (n={r['n']})")
+
+    report = {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    print(f"保存しました: {args.out}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, key, before, after in regressions:
+            print(f"劣化: {name} {key} {before} -> {after}")
+        if regressions:
+            return 1
+        print("劣化なし")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
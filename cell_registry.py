@@ -0,0 +1,171 @@
+from collections import namedtuple
+
+# ---------------------------------------------------------
+# セル番地の台帳
+# ---------------------------------------------------------
+# STRICT_MEDICAL_RULES と app.py の修正パネルで使う全セル番地を1か所にまとめる。
+# 書き込み先のシートはここを1回引くだけで決まる (両面に試し書きしない)。
+
+FRONT = 0  # 表
+BACK = 1   # 裏
+SHEET_NAMES = {FRONT: "表", BACK: "裏"}
+
+TEXT = "text"
+CHECKBOX = "checkbox"
+
+# group: 同じグループ内で1つだけ選ぶ排他項目のグループ名 (複数選択可なら None)
+CellDef = namedtuple("CellDef", "address sheet kind label group")
+
+CELLS = {}
+
+def _text(sheet, cells):
+    for address, label in cells.items():
+        CELLS[address] = CellDef(address, sheet, TEXT, label, None)
+
+def _checks(sheet, cells, group=None):
+    for address, label in cells.items():
+        CELLS[address] = CellDef(address, sheet, CHECKBOX, label, group)
+
+
+# ===== 表 =====
+_text(FRONT, {
+    "DH3": "記入日(年)", "DR3": "記入日(月)", "EA3": "記入日(日)",
+    "O12": "ふりがな", "A13": "氏名", "BM13": "住所",
+    "A14": "生年月日(元号)", "I14": "生年月日(年)", "R14": "生年月日(月)", "AC14": "生年月日(日)", "AT14": "年齢",
+    "BY14": "電話(市外局番)", "CL14": "電話(市内局番)", "CX14": "電話(加入者番号)",
+    "T18": "医師氏名",
+    "T19": "医療機関名", "CN19": "医療機関電話(市外)", "CZ19": "医療機関電話(市内)", "DL19": "医療機関電話(加入者)",
+    "T20": "医療機関所在地", "CN20": "FAX(市外)", "CZ20": "FAX(市内)", "DL20": "FAX(加入者)",
+    "AA22": "最終診察日",
+    "G29": "診断名1", "G30": "診断名2", "G31": "診断名3",
+    "CQ29": "発症日1", "CQ30": "発症日2", "CQ31": "発症日3",
+    "A38": "傷病の経過",
+})
+_checks(FRONT, {"CB16": "同意する", "CS16": "同意しない"}, "同意")
+_checks(FRONT, {"DC23": "初回", "DP23": "2回目以上"}, "作成回数")
+_checks(FRONT, {"AH25": "他科受診 有", "AV25": "他科受診 無"}, "他科受診")
+_checks(FRONT, {
+    "CA25": "内科", "CM25": "精神科", "CY25": "外科", "DW25": "脳神経外科",
+    "AH26": "皮膚科", "AV26": "泌尿器科", "BI26": "婦人科", "BU26": "眼科",
+    "CG26": "耳鼻咽喉科", "CS26": "リハビリテーション科", "DE26": "歯科", "DP26": "その他",
+})
+_checks(FRONT, {"AF34": "安定", "AR34": "不安定", "BF34": "不明"}, "症状の安定性")
+_checks(FRONT, {
+    "BJ53": "自立", "BV53": "J1", "CD53": "J2", "CM53": "A1", "CV53": "A2",
+    "DD53": "B1", "DM53": "B2", "DU53": "C1", "ED53": "C2",
+}, "障害高齢者の日常生活自立度")
+_checks(FRONT, {
+    "BJ55": "自立", "BV55": "I", "CD55": "IIa", "CM55": "IIb", "CV55": "IIIa",
+    "DD55": "IIIb", "DM55": "IV", "DU55": "M",
+}, "認知症高齢者の日常生活自立度")
+_checks(FRONT, {"AF59": "短期記憶 問題なし", "AU59": "短期記憶 問題あり"}, "短期記憶")
+_checks(FRONT, {"BB61": "自立", "BO61": "いくらか困難", "CF61": "見守りが必要", "DA61": "判断できない"}, "意思決定")
+_checks(FRONT, {"BB63": "伝えられる", "BO63": "いくらか困難", "CF63": "具体的要求に限られる", "DA63": "伝えられない"}, "意思伝達")
+_checks(FRONT, {"H67": "問題行動 無", "S67": "問題行動 有"}, "問題行動")
+_checks(FRONT, {
+    "AB67": "幻視・幻聴", "AS67": "妄想", "BJ67": "昼夜逆転", "CA67": "暴言", "CR67": "暴行",
+    "DI67": "介護への抵抗", "DZ67": "徘徊", "AB69": "火の不始末", "AS69": "不潔行為",
+    "BJ69": "異食行動", "CA69": "性的問題行動", "CR69": "その他",
+})
+_checks(FRONT, {"H73": "精神疾患 無", "R73": "精神疾患 有"}, "精神疾患")
+_checks(FRONT, {"CR73": "専門医受診 有", "EE73": "専門医受診 無"}, "専門医受診")
+
+# ===== 裏 =====
+_text(BACK, {
+    "BC8": "身長", "BX8": "体重", "X9": "四肢欠損(部位)",
+    "Z17": "筋力の低下(部位)", "CT17": "関節の拘縮(部位)", "Z19": "関節の痛み(部位)",
+    "T23": "褥瘡(部位)", "CR23": "その他の皮膚疾患(部位)",
+    "AG50": "血圧(留意事項)", "CT50": "移動(留意事項)", "AG51": "摂食(留意事項)",
+    "CT51": "運動(留意事項)", "AG52": "嚥下(留意事項)", "AA54": "感染症(病名)",
+    "A58": "特記すべき事項",
+})
+_checks(BACK, {"AG8": "利き腕 右", "AQ8": "利き腕 左"}, "利き腕")
+_checks(BACK, {"DM8": "体重 増加", "DW8": "体重 維持", "EF8": "体重 減少"}, "体重の変化")
+_checks(BACK, {
+    "I9": "四肢欠損", "I11": "麻痺",
+    "V11": "麻痺 右上肢", "CT11": "麻痺 左上肢", "V13": "麻痺 右下肢", "CT13": "麻痺 左下肢", "V15": "麻痺 その他",
+    "I17": "筋力の低下", "CC17": "関節の拘縮", "I19": "関節の痛み",
+    "I21": "失調・不随意運動",
+    "AP21": "失調 上肢 右", "AZ21": "失調 上肢 左", "BT21": "失調 下肢 右",
+    "CC21": "失調 下肢 左", "CW21": "失調 体幹 右", "DF21": "失調 体幹 左",
+    "I23": "褥瘡", "BU23": "その他の皮膚疾患",
+})
+for _group, _cells in {
+    "麻痺程度 右上肢": ("AK11", "AZ11", "BI11"),
+    "麻痺程度 左上肢": ("DN11", "DX11", "EG11"),
+    "麻痺程度 右下肢": ("AK13", "AZ13", "BI13"),
+    "麻痺程度 左下肢": ("DN13", "DX13", "EG13"),
+    "麻痺程度 その他": ("BU15", "CF15", "CP15"),
+    "筋力の低下 程度": ("AZ17", "BH17", "BP17"),
+    "関節の拘縮 程度": ("DP17", "DY17", "EG17"),
+    "関節の痛み 程度": ("AZ19", "BH19", "BP19"),
+    "褥瘡 程度": ("AT23", "BC23", "BK23"),
+    "その他の皮膚疾患 程度": ("DQ23", "DZ23", "EG23"),
+}.items():
+    _checks(BACK, dict(zip(_cells, ("軽", "中", "重"))), _group)
+_checks(BACK, {"AT27": "自立", "BO27": "介護があればしている", "CX27": "していない"}, "屋外歩行")
+_checks(BACK, {"AT29": "用いていない", "BO29": "主に自分で操作", "CX29": "主に他人が操作"}, "車いすの使用")
+_checks(BACK, {"AT31": "用いていない", "BO31": "屋外で使用", "CX31": "屋内で使用"}, "歩行補助具")
+_checks(BACK, {"AT34": "自立ないし何とか自分で食べられる", "CX34": "全面介助"}, "食事行為")
+_checks(BACK, {"AT36": "良好", "CX36": "不良"}, "栄養状態")
+_checks(BACK, {
+    "H39": "尿失禁", "V39": "転倒・骨折", "AM39": "移動能力の低下", "BI39": "褥瘡", "BU39": "心肺機能の低下",
+    "CQ39": "閉じこもり", "DG39": "意欲低下", "DW39": "徘徊", "H40": "低栄養", "V40": "摂食・嚥下機能低下",
+    "AU40": "脱水", "BG40": "易感染性", "BW40": "がん等による疼痛", "CT40": "その他",
+})
+_checks(BACK, {"BV43": "期待できる", "CQ43": "期待できない", "DM43": "不明"}, "改善の見通し")
+_checks(BACK, {
+    "H46": "訪問診療", "Y46": "訪問看護", "AP46": "訪問歯科診療", "CA46": "訪問薬剤管理指導",
+    "CY46": "訪問リハビリテーション", "H47": "短期入所療養介護", "AP47": "訪問歯科衛生指導",
+    "CA47": "訪問栄養食事指導", "CY47": "通所リハビリテーション", "H48": "その他の医療系サービス",
+})
+_checks(BACK, {"O50": "血圧 特になし", "AB50": "血圧 あり"}, "血圧")
+_checks(BACK, {"CB50": "移動 特になし", "CO50": "移動 あり"}, "移動")
+_checks(BACK, {"O51": "摂食 特になし", "AB51": "摂食 あり"}, "摂食")
+_checks(BACK, {"CB51": "運動 特になし", "CO51": "運動 あり"}, "運動")
+_checks(BACK, {"O52": "嚥下 特になし", "AB52": "嚥下 あり"}, "嚥下")
+_checks(BACK, {"H54": "感染症 無", "W54": "感染症 有", "CQ54": "感染症 不明"}, "感染症")
+
+
+# ---------------------------------------------------------
+# 引き当て
+# ---------------------------------------------------------
+GROUPS = {}
+for _cell in CELLS.values():
+    if _cell.group:
+        GROUPS.setdefault(_cell.group, []).append(_cell.address)
+
+def lookup(address):
+    """ 番地の定義を返す (未登録なら None) """
+    if not isinstance(address, str):
+        return None
+    return CELLS.get(address.strip().upper())
+
+def route_cells(text_data, check_cells, sheet_count=2, template_map=None):
+    """
+    text_data / check_cells をシートごとに振り分ける
+    template_map (template_map.TemplateMap) を渡すと、テンプレートで □ のセルを指していないチェック欄も除く
+    戻り値: (シート別の {番地: 値}, シート別の [番地], 未登録・種別違いの番地リスト)
+    """
+    writes = [{} for _ in range(sheet_count)]
+    checks = [[] for _ in range(sheet_count)]
+    unknown = []
+    for addr, val in text_data.items():
+        if not val:
+            continue
+        cell = lookup(addr)
+        if cell is None or cell.kind != TEXT or cell.sheet >= sheet_count:
+            unknown.append(addr)
+            continue
+        writes[cell.sheet][cell.address] = val
+    for addr in check_cells:
+        cell = lookup(addr)
+        if cell is None or cell.kind != CHECKBOX or cell.sheet >= sheet_count:
+            unknown.append(addr)
+            continue
+        # □ が無いセルに付けても mark_checkbox は何もしないので、黙って落とさずに知らせる
+        if template_map is not None and template_map.box_text(cell.sheet, cell.address) is None:
+            unknown.append(addr)
+            continue
+        checks[cell.sheet].append(cell.address)
+    return writes, checks, unknown
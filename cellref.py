@@ -0,0 +1,66 @@
+import re
+
+# ---------------------------------------------------------
+# セル番地の便利関数 (openpyxl に依存しない)
+# ---------------------------------------------------------
+ADDR_RE = re.compile(r"([A-Z]+)(\d+)")
+
+def col_to_index(letters):
+    """ 列記号 -> 列番号 (A=1) """
+    n = 0
+    for ch in letters:
+        n = n * 26 + (ord(ch) - 64)
+    return n
+
+def index_to_col(n):
+    """ 列番号 -> 列記号 (1=A) """
+    letters = ""
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+def normalize_address(address):
+    """
+    "A1:B2" のような範囲なら左上 "A1" を、"$a$1" なら "A1" を返す
+    番地として解釈できなければ None
+    """
+    if not isinstance(address, str):
+        return None
+    address = address.split(":")[0].replace("$", "").strip().upper()
+    return address if ADDR_RE.fullmatch(address) else None
+
+def resolve_anchor(anchors, address):
+    """
+    範囲指定・結合セルを左上の番地に正規化する (番地として解釈できなければ None)
+    anchors は build_anchor_index で作った {従属セルの番地: 左上セルの番地}
+    """
+    address = normalize_address(address)
+    if not address:
+        return None
+    return anchors.get(address, address)
+
+def split_address(address):
+    """ "AB12" -> (列番号, 行番号) """
+    col, row = ADDR_RE.fullmatch(address).groups()
+    return col_to_index(col), int(row)
+
+def build_anchor_index(merge_refs):
+    """
+    結合範囲 ("A1:C2" など) の一覧から、{従属セルの番地: 左上セルの番地} の辞書を作る
+    テンプレート読み込み時に1回だけ作っておけば、以降の検索は辞書引き1回で済む
+    """
+    index = {}
+    for ref in merge_refs:
+        if ":" not in ref:
+            continue
+        first, last = ref.split(":")
+        c1, r1 = split_address(first)
+        c2, r2 = split_address(last)
+        cols = [index_to_col(c) for c in range(c1, c2 + 1)]
+        for r in range(r1, r2 + 1):
+            for col in cols:
+                index[f"{col}{r}"] = first
+        # 左上自身は含めない (そのまま書き込める)
+        index.pop(first, None)
+    return index
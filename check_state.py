@@ -0,0 +1,61 @@
+from cell_registry import GROUPS
+
+# ---------------------------------------------------------
+# チェック欄の状態 (修正パネル用)
+# ---------------------------------------------------------
+# check_cells (番地のリスト) を、順番を保った集合として持つ。
+# ウィジェット1つあたりの操作は O(1) (排他グループは O(グループの大きさ)) で、重複は入らない。
+# JSON に戻すときは to_list() で従来と同じ番地のリストにする。
+
+class CheckState:
+
+    def __init__(self, cells=()):
+        # dict は挿入順を保つので、キーだけ使って順序付き集合にする
+        self._cells = dict.fromkeys(c for c in cells if isinstance(c, str))
+
+    def __contains__(self, cell):
+        return cell in self._cells
+
+    def __iter__(self):
+        return iter(self._cells)
+
+    def __len__(self):
+        return len(self._cells)
+
+    def add(self, cell):
+        self._cells[cell] = None
+
+    def discard(self, cell):
+        self._cells.pop(cell, None)
+
+    def set(self, cell, on):
+        """ on なら付け、そうでなければ外す。on をそのまま返す """
+        if on:
+            self.add(cell)
+        else:
+            self.discard(cell)
+        return on
+
+    def any(self, cells):
+        """ cells のどれかに印があるか """
+        return any(c in self._cells for c in cells)
+
+    def selected(self, cells, default=None):
+        """ cells のうち印が付いている最初の番地 (無ければ default) """
+        return next((c for c in cells if c in self._cells), default)
+
+    def select_one(self, cells, chosen):
+        """ cells のうち chosen だけに印を付ける (chosen が None なら全部外す) """
+        for c in cells:
+            if c != chosen:
+                self.discard(c)
+        if chosen is not None:
+            self.add(chosen)
+
+    def select_in_group(self, group, chosen):
+        """ 台帳の排他グループ (cell_registry.GROUPS) の中で chosen だけに印を付ける """
+        self.select_one(GROUPS[group], chosen)
+
+    def to_list(self):
+        """ JSON の check_cells の形 (番地のリスト) に戻す """
+        return list(self._cells)
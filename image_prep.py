@@ -0,0 +1,156 @@
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------------------------------------------------------
+# アップロード画像の前処理
+# ---------------------------------------------------------
+# スマホで撮った問診票・カルテは1枚数MBあるので、Geminiに送る前に
+# EXIF回転 -> 長辺の縮小 -> グレースケール化 -> JPEG再圧縮 を行う。
+
+DEFAULT_OPTIONS = {
+    "enabled": True,
+    "max_edge": 2000,     # 長辺の最大ピクセル数
+    "grayscale": True,
+    "quality": 80,        # JPEG品質
+    "dedupe_threshold": 0.95,   # 重複ページとみなす類似度 (None なら重複を探さない。find_duplicates 参照)
+}
+
+class UploadedImage:
+    """ アップロードされたファイルの中身を写し取ったもの (UploadedFile と同じく name / type / getvalue() で読める) """
+    __slots__ = ("name", "type", "data")
+
+    def __init__(self, name, type, data):
+        self.name = name
+        self.type = type
+        self.data = data
+
+    def getvalue(self):
+        return self.data
+
+    @classmethod
+    def copy_of(cls, f):
+        """ UploadedFile (または None) から作る。スクリプトの実行が終わった後も読めるように中身を持っておく """
+        return None if f is None else cls(f.name, f.type, f.getvalue())
+
+def preprocess_image(data, mime_type, max_edge=2000, grayscale=True, quality=80):
+    """
+    1枚の画像を前処理して (mime_type, bytes) を返す
+    読めない画像や、処理で逆に大きくなった場合は元のまま返す
+    """
+    from PIL import Image, ImageOps   # 起動を軽くするため、画像を扱うときに読み込む
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img = ImageOps.exif_transpose(img)
+            if max_edge and max(img.size) > max_edge:
+                img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            if grayscale:
+                img = img.convert("L")
+            elif img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            buf = io.BytesIO()
+            img.save(buf, format="JPEG", quality=quality, optimize=True)
+    except Exception:
+        return mime_type, data
+
+    out = buf.getvalue()
+    if len(out) >= len(data):
+        return mime_type, data
+    return "image/jpeg", out
+
+def prepare_uploads(uploads, options=None, max_workers=4):
+    """
+    Streamlit の UploadedFile のリストを Gemini 用の {"mime_type", "data"} に変換する
+    戻り値: (パーツのリスト(入力順), {"before": 元の合計バイト, "after": 処理後の合計バイト})
+    """
+    opts = dict(DEFAULT_OPTIONS, **(options or {}))
+    raws = [(f.type, f.getvalue()) for f in uploads]
+
+    if opts["enabled"] and raws:
+        def work(item):
+            return preprocess_image(item[1], item[0], opts["max_edge"], opts["grayscale"], opts["quality"])
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(raws))) as pool:
+            processed = list(pool.map(work, raws))
+    else:
+        processed = raws
+
+    parts = [{"mime_type": mime, "data": data} for mime, data in processed]
+    stats = {"before": sum(len(d) for _, d in raws), "after": sum(len(d) for _, d in processed)}
+    return parts, stats
+
+# ---------------------------------------------------------
+# 重複ページの除外 (知覚ハッシュ)
+# ---------------------------------------------------------
+# 同じ問診票・カルテを2回撮った / ③と④の両方に入れた、というページは送っても精度は上がらず
+# 送信量と待ち時間だけが増えるので、送る前に落とす。
+# 中身が同じファイルは SHA-256 で、撮り直し (明るさ・縮尺・JPEG画質の違い) は dHash で判定する。
+# 書式が同じ別の日のカルテを誤って落とさないよう、ハッシュは 16x16=256 ビットと細かめにし、しきい値も高めにしてある。
+
+HASH_SIZE = 16
+DEDUPE_THRESHOLD = DEFAULT_OPTIONS["dedupe_threshold"]   # これ以上似ていれば重複 (1.0 = 完全一致のみ)
+
+def image_hash(data, size=HASH_SIZE):
+    """
+    差分ハッシュ (dHash): 縮小したグレースケール画像で、左右に隣り合う画素の大小を size*size ビットの整数にする
+    読めない画像は None
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            img.draft("L", (size * 16, size * 16))   # JPEG は縮小しながら読む (数MBの写真でも速い)
+            img = ImageOps.exif_transpose(img).convert("L").resize((size + 1, size), Image.BILINEAR)
+            px = img.tobytes()
+    except Exception:
+        return None
+    bits = 0
+    for y in range(size):
+        row = px[y * (size + 1):(y + 1) * (size + 1)]
+        for x in range(size):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return bits
+
+def hash_similarity(a, b, size=HASH_SIZE):
+    """ 2つのハッシュの一致率 (0.0〜1.0) """
+    return 1 - bin(a ^ b).count("1") / (size * size)
+
+def find_duplicates(uploads, threshold=DEDUPE_THRESHOLD, max_workers=4):
+    """
+    アップロード済みファイルのリストから重複ページを探す。先に出てきた方を残す
+    戻り値: (残すファイルのリスト(入力順), [(落としたファイル, 残した方のファイル, 類似度)])
+    """
+    raws = [f.getvalue() for f in uploads]
+    if len(raws) < 2:
+        return list(uploads), []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(raws))) as pool:
+        hashes = list(pool.map(image_hash, raws))
+
+    kept, skipped = [], []
+    digests = {}   # SHA-256 -> 残した方
+    for f, data, h in zip(uploads, raws, hashes):
+        digest = hashlib.sha256(data).hexdigest()
+        if digest in digests:
+            skipped.append((f, digests[digest], 1.0))
+            continue
+        best, best_sim = None, 0.0
+        if h is not None:
+            for other, other_h in kept:
+                if other_h is None:
+                    continue
+                sim = hash_similarity(h, other_h)
+                if sim > best_sim:
+                    best, best_sim = other, sim
+        if best is not None and best_sim >= threshold:
+            skipped.append((f, best, best_sim))
+            continue
+        digests[digest] = f
+        kept.append((f, h))
+    return [f for f, _ in kept], skipped
+
+def format_bytes(n):
+    """ 1234567 -> '1.2 MB' """
+    for unit in ("B", "KB", "MB"):
+        if n < 1024 or unit == "MB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
@@ -0,0 +1,100 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------------------------------------------------------
+# バックグラウンドのジョブ (解析・作成をスクリプトの実行から切り離す)
+# ---------------------------------------------------------
+# 解析は数十秒かかる。スクリプトの中で待つと、その間は画面を操作できず、
+# ブラウザを再読み込みすると結果も失われる。
+# そこでプロセスで1つのワーカープールにジョブとして投げ、状態・結果・画面に出すメッセージは
+# ジョブ (このモジュール) 側に持たせる。画面は定期的にジョブを見に来て表示するだけ。
+# ジョブは owner (ブラウザのタブごとの ID。URL に載せてある) ごとに見分ける。
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+class Job:
+    """ 1件の処理。func(job, ...) の戻り値が result、例外が error になる """
+
+    def __init__(self, kind, label, owner=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.label = label
+        self.owner = owner
+        self.status = QUEUED
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.messages = []   # (種類, 本文, 詳細)  種類: caption / info / success / warning / error / details
+        self.progress = ""   # 実行中の進捗 (1行〜数行のマークダウン)
+
+    def log(self, kind, text, detail=None):
+        """ 画面に出すメッセージを足す (ワーカースレッドから呼ぶ) """
+        self.messages.append((kind, text, detail))
+
+    @property
+    def done(self):
+        return self.status in (DONE, FAILED)
+
+    @property
+    def seconds(self):
+        """ 実行にかかった秒数 (実行中なら今までの秒数、待ち中なら 0) """
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+
+class JobQueue:
+    """
+    プロセス全体のワーカープール
+    max_workers: 同時に実行するジョブ数 (それ以上は順番待ち)
+    max_jobs   : 覚えておくジョブ数。超えたら終わったものから古い順に忘れる
+    """
+
+    def __init__(self, max_workers=2, max_jobs=50):
+        self.max_jobs = max_jobs
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}   # ID -> Job (投入順)
+        self._lock = threading.Lock()
+
+    def submit(self, kind, label, func, *args, owner=None, **kwargs):
+        """ func(job, *args, **kwargs) をジョブとして投入し、すぐに Job を返す """
+        job = Job(kind, label, owner)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._forget_old()
+        self._pool.submit(self._run, job, func, args, kwargs)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        job.status, job.started = RUNNING, time.time()
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.status = DONE
+        except Exception as e:
+            job.error = e
+            job.log("error", f"処理中にエラーが発生しました: {e}")
+            job.status = FAILED
+        finally:
+            job.progress = ""
+            job.finished = time.time()
+
+    def _forget_old(self):
+        over = len(self._jobs) - self.max_jobs
+        for job_id in [j.id for j in self._jobs.values() if j.done][:max(over, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def jobs(self, owner=None):
+        """ 投入順のジョブのリスト (owner を渡すとその持ち主のものだけ) """
+        with self._lock:
+            return [j for j in self._jobs.values() if owner is None or j.owner == owner]
+
+    def pending(self, owner=None):
+        """ まだ終わっていないジョブの数 """
+        return sum(1 for j in self.jobs(owner) if not j.done)
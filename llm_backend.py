@@ -0,0 +1,332 @@
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import count
+
+# ---------------------------------------------------------
+# LLMバックエンド (プロンプト + 画像パーツ -> JSONテキスト)
+# ---------------------------------------------------------
+# request は [プロンプト文字列, {"mime_type", "data"}, ...] の形。
+# schema を渡すと、対応するバックエンドは応答をその JSON スキーマに沿わせる (response_schema.py)。
+#   GeminiBackend    : 本番 (google.generativeai)
+#   RecordingBackend : 本番を呼びつつ、リクエストと応答の組をディスクに記録する
+#   ReplayBackend    : 記録(または固定の応答)を、人工的な待ち時間付きで返す (オフライン計測用)
+#   ThrottledBackend : 本番の呼び出しをプロセス共通の RateLimiter に通し、一時的なエラーは間隔を空けて再試行する
+# 使うバックエンドは環境変数 LLM_BACKEND (gemini / record / replay) で選ぶ。
+
+RECORD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_records")
+
+# プロンプトの中で患者情報を埋め込む区間 (前回の記録・カルテの所見)。analysis.py がこの目印で囲む。
+# RecordingBackend はこの区間を保存せず、中身のハッシュだけを残す。
+# ※ 応答 (chunks) には読み取った氏名などがそのまま入るので、記録モードは試験用のデータだけで使うこと
+PATIENT_BEGIN = "＜患者情報ここから＞"
+PATIENT_END = "＜患者情報ここまで＞"
+PATIENT_BLOCK_RE = re.compile(re.escape(PATIENT_BEGIN) + "(.*?)" + re.escape(PATIENT_END), re.S)
+
+def redact_patient_blocks(text):
+    """ 患者情報の区間を、中身の sha256 に置き換える """
+    def replace(m):
+        digest = hashlib.sha256(m.group(1).encode("utf-8")).hexdigest()
+        return f"{PATIENT_BEGIN}[省略 sha256={digest}]{PATIENT_END}"
+    return PATIENT_BLOCK_RE.sub(replace, text)
+
+def request_key(request):
+    """ リクエスト内容 (プロンプトと画像のバイト列) から決まるキー """
+    h = hashlib.sha256()
+    for part in request:
+        if isinstance(part, str):
+            h.update(b"T")
+            h.update(hashlib.sha256(part.encode("utf-8")).digest())
+        else:
+            h.update(b"I")
+            h.update(part["mime_type"].encode("utf-8"))
+            h.update(hashlib.sha256(part["data"]).digest())
+    return h.hexdigest()
+
+
+class LLMBackend:
+    """ バックエンドの共通インターフェース """
+    name = "base"
+
+    def stream(self, request, schema=None):
+        """ 応答テキストを断片ごとに yield する """
+        raise NotImplementedError
+
+    def generate(self, request, schema=None):
+        """ 応答テキスト全体を返す """
+        return "".join(self.stream(request, schema))
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model_name, api_key=None):
+        import google.generativeai as genai
+        if api_key:
+            genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.model = genai.GenerativeModel(model_name)
+
+    def stream(self, request, schema=None):
+        config = None
+        if schema is not None:
+            config = {"response_mime_type": "application/json", "response_schema": schema}
+        usage = None
+        for chunk in self.model.generate_content(request, stream=True, generation_config=config):
+            usage = getattr(chunk, "usage_metadata", None) or usage
+            yield chunk_text(chunk)
+        # トークン数は最後の断片に累計で入っている
+        if usage is not None:
+            count(prompt_tokens=getattr(usage, "prompt_token_count", None),
+                  output_tokens=getattr(usage, "candidates_token_count", None))
+
+def chunk_text(chunk):
+    """ ストリーミングの断片のテキスト (終了通知などテキストが無い断片は空文字) """
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+class RecordingBackend(LLMBackend):
+    """ 別のバックエンドを呼び、リクエストと応答を1件1ファイルの JSON で保存する """
+    name = "record"
+
+    def __init__(self, inner, directory=RECORD_DIR):
+        self.inner = inner
+        self.directory = directory
+
+    def stream(self, request, schema=None):
+        start = time.perf_counter()
+        first = None
+        chunks = []
+        for text in self.inner.stream(request, schema):
+            if first is None:
+                first = time.perf_counter() - start
+            chunks.append(text)
+            yield text
+        self._save(request, chunks, first, time.perf_counter() - start)
+
+    def _save(self, request, chunks, first, elapsed):
+        os.makedirs(self.directory, exist_ok=True)
+        key = request_key(request)
+        record = {
+            "key": key,
+            "backend": self.inner.name,
+            "model": getattr(self.inner, "model_name", ""),
+            # 前回の記録・所見など患者情報の区間はハッシュに置き換える (request_key は元のプロンプトから作る)
+            "prompt": redact_patient_blocks("\n".join(p for p in request if isinstance(p, str))),
+            # 画像そのものは保存しない (患者情報のため)。サイズとハッシュだけ残す
+            "images": [{"mime_type": p["mime_type"], "bytes": len(p["data"]),
+                        "sha256": hashlib.sha256(p["data"]).hexdigest()}
+                       for p in request if not isinstance(p, str)],
+            "chunks": chunks,
+            "first_chunk_seconds": first,
+            "elapsed_seconds": elapsed,
+        }
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(record, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(self.directory, f"{key}.json"))
+
+
+class ReplayBackend(LLMBackend):
+    """
+    記録した応答を返す偽物のバックエンド
+    latency     : 最初の断片までの待ち秒数
+    chunk_delay : 断片ごとの待ち秒数
+    default     : 記録が無いリクエストに返す応答テキスト (None なら KeyError)
+    """
+    name = "replay"
+
+    def __init__(self, directory=RECORD_DIR, latency=0.0, chunk_delay=0.0, chunk_size=200, default=None):
+        self.directory = directory
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.default = default
+
+    def _chunks(self, request):
+        path = os.path.join(self.directory, f"{request_key(request)}.json") if self.directory else None
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)["chunks"]
+        if self.default is None:
+            raise KeyError(f"記録された応答がありません: {request_key(request)[:12]}")
+        text = self.default
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or [""]
+
+    def stream(self, request, schema=None):
+        chunks = self._chunks(request)
+        if self.latency:
+            time.sleep(self.latency)
+        for i, text in enumerate(chunks):
+            if i and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            yield text
+
+
+# ---------------------------------------------------------
+# 呼び出しの流量制限と再試行 (プロセス全体で共有)
+# ---------------------------------------------------------
+# 複数のセッションが同時に「作成開始」すると、セクション・ページごとの呼び出しが一度に飛んで
+# クォータ (429) に当たる。そこで本番の呼び出しはすべて1つの RateLimiter を通す。
+#   - トークンバケット: 1分あたり rpm 回 (burst 回までは続けて呼べる)
+#   - 同時に受信中の呼び出しは concurrency 本まで
+#   - 429 / 5xx / タイムアウトは、応答を1文字も受け取る前なら揺らぎ付きの指数バックオフで再試行
+# 待った秒数と再試行の回数はトレース (llm_wait_ms / llm_retries) と RateLimiter.stats に残る。
+# 設定は環境変数 LLM_RPM / LLM_BURST / LLM_CONCURRENCY / LLM_RETRIES。
+
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+                   "DeadlineExceeded", "GatewayTimeout", "BadGateway"}
+
+class RateLimiter:
+    """ 呼び出しの枠 (トークンバケット + 同時実行数) """
+
+    def __init__(self, rpm=120, burst=10, concurrency=8):
+        self.rate = rpm / 60.0
+        self.capacity = max(burst, 1)
+        self.concurrency = concurrency
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self.stats = {"calls": 0, "waited_calls": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                      "retries": 0, "in_flight": 0}
+
+    def _take_token(self):
+        """ トークンを1つ取る。足りなければ1つ溜まるまでの秒数を返す (取れたら 0) """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    @contextmanager
+    def slot(self):
+        """ 呼び出し1回分の枠を取る (空くまで待つ)。待った秒数を返す """
+        start = time.perf_counter()
+        self._slots.acquire()
+        try:
+            while True:
+                delay = self._take_token()
+                if not delay:
+                    break
+                time.sleep(delay)
+            waited = time.perf_counter() - start
+            with self._lock:
+                self.stats["calls"] += 1
+                self.stats["in_flight"] += 1
+                if waited >= 0.001:
+                    self.stats["waited_calls"] += 1
+                    self.stats["wait_seconds"] += waited
+                    self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+            try:
+                yield waited
+            finally:
+                with self._lock:
+                    self.stats["in_flight"] -= 1
+        finally:
+            self._slots.release()
+
+    def note_retry(self):
+        with self._lock:
+            self.stats["retries"] += 1
+
+    def summary(self):
+        """ 表示用の1行 """
+        stats = dict(self.stats)
+        return (f"呼び出し {stats['calls']}回 (同時 {stats['in_flight']}/{self.concurrency}) / "
+                f"待ち {stats['waited_calls']}回 計{stats['wait_seconds']:.1f}秒 (最大 {stats['max_wait_seconds']:.1f}秒) / "
+                f"再試行 {stats['retries']}回 / 上限 {self.rate * 60:.0f}回/分")
+
+_shared_limiter = None
+_shared_lock = threading.Lock()
+
+def shared_limiter():
+    """ プロセスで1つの RateLimiter (環境変数の設定で初回に作る) """
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = RateLimiter(
+                rpm=float(os.environ.get("LLM_RPM", "120")),
+                burst=int(os.environ.get("LLM_BURST", "10")),
+                concurrency=int(os.environ.get("LLM_CONCURRENCY", "8")),
+            )
+        return _shared_limiter
+
+def is_retryable(error):
+    """ 時間を置けば通る見込みのあるエラーか (クォータ超過・サーバー側の一時的な失敗・タイムアウト) """
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in RETRYABLE_CODES:
+        return True
+    return type(error).__name__ in RETRYABLE_NAMES
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """ attempt 回目 (0始まり) の再試行までの秒数。指数的に伸ばし、同時に失敗した呼び出しが揃わないよう揺らす """
+    return min(cap, base * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+class ThrottledBackend(LLMBackend):
+    """
+    別のバックエンドの呼び出しを RateLimiter に通す
+    応答を受け取り始めてからのエラーは (途中まで渡してしまっているので) 再試行せずにそのまま投げる
+    """
+
+    def __init__(self, inner, limiter=None, retries=3, base_delay=1.0, max_delay=30.0):
+        self.inner = inner
+        self.name = inner.name
+        self.model_name = getattr(inner, "model_name", "")
+        self.limiter = limiter or shared_limiter()
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def stream(self, request, schema=None):
+        for attempt in range(self.retries + 1):
+            received = False
+            try:
+                with self.limiter.slot() as waited:
+                    count(llm_wait_ms=round(waited * 1000, 1))
+                    for text in self.inner.stream(request, schema):
+                        received = True
+                        yield text
+                return
+            except Exception as e:
+                if received or attempt >= self.retries or not is_retryable(e):
+                    raise
+                self.limiter.note_retry()
+                count(llm_retries=1)
+                time.sleep(backoff_delay(attempt, self.base_delay, self.max_delay))
+
+
+def make_backend(model_name, api_key=None, mode=None):
+    """
+    環境変数 (LLM_BACKEND / LLM_RECORD_DIR / LLM_REPLAY_LATENCY / LLM_REPLAY_CHUNK_DELAY / LLM_RETRIES) に従って作る
+    本番を呼ぶもの (gemini / record) はプロセス共通の流量制限 (shared_limiter) を通す
+    """
+    mode = (mode or os.environ.get("LLM_BACKEND", "gemini")).lower()
+    directory = os.environ.get("LLM_RECORD_DIR", RECORD_DIR)
+    if mode == "replay":
+        return ReplayBackend(
+            directory,
+            latency=float(os.environ.get("LLM_REPLAY_LATENCY", "0")),
+            chunk_delay=float(os.environ.get("LLM_REPLAY_CHUNK_DELAY", "0")),
+        )
+    backend = GeminiBackend(model_name, api_key=api_key)
+    if mode == "record":
+        backend = RecordingBackend(backend, directory)
+    return ThrottledBackend(backend, retries=int(os.environ.get("LLM_RETRIES", "3")))
@@ -1,6 +1,19 @@
-import openpyxl
+import argparse
 import datetime
+import io
+import json
+import os
+import re
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from cell_registry import route_cells
+from cellref import normalize_address
+from template_cache import CompiledTemplate, get_compiled_template
+from template_map import TemplateMap
+from tracing import span
+from xlsx_patch import CompiledXlsx, LiveXlsx, fill_xlsx
 
 # ---------------------------------------------------------
 # 便利な関数たち
@@ -18,26 +31,32 @@ def calculate_age(born_date, today):
     except:
         return ""
 
-def safe_get_cell(ws, address):
+def safe_get_cell(ws, address, anchors=None):
     """
     【重要】最強のセル取得関数
     1. 範囲指定(A1:B2)なら左上(A1)を返す
     2. 結合セル(MergedCell)の右側や下側なら、自動的に左上の「親セル」を探して返す
+    anchors には build_anchor_index で作った {結合セル: 左上} の辞書を渡す (O(1)で引ける)
     """
     try:
-        # まず普通に取得してみる
-        target = ws[address]
-
-        # 1. もし「A1:B2」のような範囲(タプル)だったら、左上を取り出す
-        if isinstance(target, tuple):
-            target = target[0][0]
+        # 1. もし「A1:B2」のような範囲だったら、左上の番地だけにする
+        # (ws["A1:B2"] でセルのタプルを作らない)
+        coord = normalize_address(address)
+        if coord is None:
+            return None
 
-        # 2. もし「結合セルの従属セル(MergedCell)」だったら、親を探す
+        # 2. もし「結合セルの従属セル」だったら、親の番地に置き換える
         # (MergedCellには値を書き込めないため)
-        if "MergedCell" in str(type(target)):
+        if anchors is not None:
+            return ws[anchors.get(coord, coord)]
+
+        # 索引が無い場合は結合範囲を順に探す
+        from openpyxl.cell.cell import MergedCell
+        target = ws[coord]
+        if isinstance(target, MergedCell):
             for rng in ws.merged_cells.ranges:
                 # そのセルが結合範囲に含まれているか確認
-                if target.coordinate in rng:
+                if coord in rng:
                     # 結合範囲の左上（親）のセルを返す
                     return ws.cell(row=rng.min_row, column=rng.min_col)
         
@@ -48,16 +67,16 @@ def safe_get_cell(ws, address):
         # print(f"セル取得エラー {address}: {e}") # デバッグ用
         return None
 
-def mark_checkbox(ws, address):
+def mark_checkbox(ws, address, anchors=None):
     """ 指定されたセルの □ を ■ に変える """
-    cell = safe_get_cell(ws, address)
+    cell = safe_get_cell(ws, address, anchors)
     if cell and hasattr(cell, 'value') and isinstance(cell.value, str):
         if "□" in cell.value:
             cell.value = cell.value.replace("□", "■")
 
-def unmark_checkbox(ws, address):
+def unmark_checkbox(ws, address, anchors=None):
     """ 指定されたセルの ■ を □ に戻す """
-    cell = safe_get_cell(ws, address)
+    cell = safe_get_cell(ws, address, anchors)
     if cell and hasattr(cell, 'value') and isinstance(cell.value, str):
         if "■" in cell.value:
             cell.value = cell.value.replace("■", "□")
@@ -65,23 +84,13 @@ def unmark_checkbox(ws, address):
 # ---------------------------------------------------------
 # メイン処理
 # ---------------------------------------------------------
-def update_opinion_form(template_path, output_path, data):
-    # data構造: { "text_data": {...}, "check_cells": [...] }
-    
-    try:
-        wb = openpyxl.load_workbook(template_path)
-    except Exception as e:
-        return f"エラー: テンプレート読み込み失敗: {e}"
+# 書き込みエンジン
+#   "xml"      : テンプレートのシートXMLを直接書き換える (高速・既定)
+#   "openpyxl" : openpyxl のオブジェクトモデル経由 (参照実装)
+DEFAULT_ENGINE = "xml"
 
-    try:
-        ws_front = wb.worksheets[0]
-        ws_back = wb.worksheets[1] if len(wb.worksheets) > 1 else None
-    except:
-        return "エラー: シート取得失敗"
-
-    # --- 1. 固定情報・日付・年齢の処理 ---
-    today = datetime.date.today()
-    
+def build_text_data(data, today):
+    """ AIの text_data に固定情報・日付・年齢を足したものを返す """
     # 自動入力データの作成
     text_updates = {
         "DH3": to_wareki(today.year),
@@ -94,7 +103,6 @@ def update_opinion_form(template_path, output_path, data):
     }
     
     # 年齢計算
-    birth_year = data.get("text_data", {}).get("A14")
     dob_str = data.get("meta_birth_date")
     if dob_str:
         try:
@@ -106,35 +114,306 @@ def update_opinion_form(template_path, output_path, data):
     # データをマージ
     full_text_data = data.get("text_data", {})
     full_text_data.update(text_updates)
+    return full_text_data
 
-    # --- 2. テキスト書き込み ---
-    # 裏面のセル番地リスト
-    back_cells = ["BC8", "BX8", "A58", "X9", "Z17", "CT17", "Z19", "T23", "CR23", "AG50", "CT50", "AG51", "CT51", "AG52", "AA54"]
-    
-    for addr, val in full_text_data.items():
-        if val:
-            target_ws = ws_front
-            if addr in back_cells and ws_back:
-                target_ws = ws_back
-            
-            cell = safe_get_cell(target_ws, addr)
-            if cell:
-                # MergedCell対策済みのセルに書き込む
-                cell.value = val
-
-    # --- 3. チェックボックス書き込み ---
-    check_list = data.get("check_cells", [])
-    for addr in check_list:
-        # 表にあるかもしれないし、裏にあるかもしれないので両方トライ
-        mark_checkbox(ws_front, addr)
-        if ws_back:
-            mark_checkbox(ws_back, addr)
+def _fill_with_openpyxl(template_path, output_path, writes, checks):
+    try:
+        # 解析済みテンプレートのコピーを使う (毎回の load_workbook を避ける)
+        with span("template_load", engine="openpyxl"):
+            compiled = get_compiled_template(template_path)
+            wb = compiled.new_workbook()
+    except Exception as e:
+        return f"エラー: テンプレート読み込み失敗: {e}"
+
+    # --- テキスト & チェックボックス書き込み (シートは台帳で振り分け済み) ---
+    with span("write_cells", cells=sum(map(len, writes)) + sum(map(len, checks))):
+        for ws, anchors, sheet_writes, sheet_checks in zip(wb.worksheets, compiled.anchor_indexes, writes, checks):
+            for addr, val in sheet_writes.items():
+                cell = safe_get_cell(ws, addr, anchors)
+                if cell:
+                    # MergedCell対策済みのセルに書き込む
+                    cell.value = val
+            for addr in sheet_checks:
+                mark_checkbox(ws, addr, anchors)
+
+    try:
+        with span("save"):
+            wb.save(output_path)
+        return "成功"
+    except Exception as e:
+        return f"保存エラー: {e}"
+
+def _fill_with_xml(template_path, output_path, writes, checks):
+    try:
+        with span("template_load", engine="xml"):
+            compiled = get_compiled_template(template_path, kind=CompiledXlsx)
+    except Exception as e:
+        return f"エラー: テンプレート読み込み失敗: {e}"
 
     try:
-        wb.save(output_path)
+        fill_xlsx(compiled, writes, checks, output_path)
         return "成功"
     except Exception as e:
         return f"保存エラー: {e}"
 
+ENGINES = {"xml": _fill_with_xml, "openpyxl": _fill_with_openpyxl}
+
+def update_opinion_form(template_path, output_path, data, engine=DEFAULT_ENGINE):
+    # data構造: { "text_data": {...}, "check_cells": [...] }
+    # output_path にはファイルパスの他、BytesIO などのファイルオブジェクトも渡せる
+    fill = ENGINES.get(engine)
+    if fill is None:
+        return f"エラー: 不明なエンジン: {engine}"
+
+    writes, checks, unknown = _route(data, template_path)
+
+    # --- 3. 書き込み & 保存 ---
+    return _with_unknown(fill(template_path, output_path, writes, checks), unknown)
+
+def _route(data, template_path):
+    # --- 1. 固定情報・日付・年齢の処理 ---
+    full_text_data = build_text_data(data, datetime.date.today())
+
+    # --- 2. 台帳でシートを振り分け (未登録の番地・□ の無いセルはどちらにも書かない) ---
+    # □ の位置は番地マップ (template_map.py) を引くだけで、テンプレートは開き直さない
+    try:
+        tmap = get_compiled_template(template_path, kind=TemplateMap)
+    except Exception:
+        tmap = None   # テンプレートが読めないときは書き込み側でエラーにする
+    with span("route_cells") as sp:
+        writes, checks, unknown = route_cells(full_text_data, data.get("check_cells", []), template_map=tmap)
+        sp.set(texts=sum(map(len, writes)), checks=sum(map(len, checks)), unknown=len(unknown))
+    return writes, checks, unknown
+
+def _with_unknown(msg, unknown):
+    if msg == "成功" and unknown:
+        msg += f" (未登録・□ の無いセル番地を無視: {', '.join(map(str, unknown))})"
+    return msg
+
+def render_opinion_form(template_path, data, engine=DEFAULT_ENGINE):
+    """ ファイルに書かずにメモリ上で作成する。戻り値: (xlsxのbytes or None, メッセージ) """
+    buf = io.BytesIO()
+    msg = update_opinion_form(template_path, buf, data, engine=engine)
+    if not msg.startswith("成功"):
+        return None, msg
+    return buf.getvalue(), msg
+
+# ---------------------------------------------------------
+# 差分だけの再作成 (修正パネル用)
+# ---------------------------------------------------------
+# LiveForm をセッションに置いておき、修正のたびに前回との差分だけを反映して保存する。
+#   "xml"      : 中身が変わったシートだけ作り直す (xlsx_patch.LiveXlsx)
+#   "openpyxl" : ブックを持ち続け、変わったセルだけ書き換える (外した印は unmark_checkbox で □ に戻す)
+
+class _LiveWorkbook:
+    """ openpyxl のブックと、前回書き込んだ内容 """
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+        self.wb = compiled.new_workbook()
+        count = len(self.wb.worksheets)
+        self.writes = [{} for _ in range(count)]     # 前回の {左上の番地: 値}
+        self.checks = [set() for _ in range(count)]  # 前回印を付けた左上の番地
+        self.original = [{} for _ in range(count)]   # 書き換える前のテンプレートの値
+
+    def update(self, writes, checks):
+        changed = 0
+        with span("write_cells") as sp:
+            for i, (ws, anchors) in enumerate(zip(self.wb.worksheets, self.compiled.anchor_indexes)):
+                new_writes, new_checks = {}, set()
+                for addr, val in (writes[i] if i < len(writes) else {}).items():
+                    cell = safe_get_cell(ws, addr, anchors)
+                    if cell:
+                        new_writes[cell.coordinate] = val
+                for addr in (checks[i] if i < len(checks) else []):
+                    cell = safe_get_cell(ws, addr, anchors)
+                    if cell:
+                        new_checks.add(cell.coordinate)
+
+                old_writes, old_checks, original = self.writes[i], self.checks[i], self.original[i]
+                touched = set()
+                # 消えた記載はテンプレートの値に戻す
+                for coord in old_writes.keys() - new_writes.keys():
+                    ws[coord].value = original.pop(coord)
+                    touched.add(coord)
+                for coord, val in new_writes.items():
+                    if old_writes.get(coord) != val:
+                        original.setdefault(coord, ws[coord].value)
+                        ws[coord].value = val
+                        touched.add(coord)
+                # 外した印は □ に戻し、新しい印 (と書き直したセルの印) を付ける
+                for coord in old_checks - new_checks:
+                    unmark_checkbox(ws, coord)
+                for coord in new_checks:
+                    if coord not in old_checks or coord in touched:
+                        mark_checkbox(ws, coord)
+                changed += len(touched) + len(old_checks ^ new_checks)
+                self.writes[i], self.checks[i] = new_writes, new_checks
+            sp.set(cells_changed=changed)
+        return changed
+
+    def save(self, output):
+        with span("save"):
+            self.wb.save(output)
+
+
+class LiveForm:
+    """ 1人分の書類。render() のたびに前回からの差分だけを反映した xlsx を返す """
+
+    def __init__(self, template_path, engine=DEFAULT_ENGINE):
+        self.template_path = template_path
+        self.engine = engine
+        self._doc = None
+
+    def _document(self):
+        kind = CompiledXlsx if self.engine == "xml" else CompiledTemplate
+        with span("template_load", engine=self.engine):
+            compiled = get_compiled_template(self.template_path, kind=kind)
+        # テンプレートが作り直されたら最初から
+        if self._doc is None or self._doc.compiled is not compiled:
+            self._doc = LiveXlsx(compiled) if self.engine == "xml" else _LiveWorkbook(compiled)
+        return self._doc
+
+    def render(self, data):
+        """ 戻り値: (xlsxのbytes or None, メッセージ) """
+        if self.engine not in ENGINES:
+            return None, f"エラー: 不明なエンジン: {self.engine}"
+        try:
+            doc = self._document()
+        except Exception as e:
+            return None, f"エラー: テンプレート読み込み失敗: {e}"
+
+        writes, checks, unknown = _route(data, self.template_path)
+        try:
+            doc.update(writes, checks)
+            buf = io.BytesIO()
+            doc.save(buf)
+        except Exception as e:
+            # 途中で失敗した状態は信用できないので、次回は最初から
+            self._doc = None
+            return None, f"保存エラー: {e}"
+        return buf.getvalue(), _with_unknown("成功", unknown)
+
+# ---------------------------------------------------------
+# 一括作成 (コマンドライン)
+# ---------------------------------------------------------
+# 解析済みの JSON (text_data / check_cells / meta_birth_date) から1人1ファイルの xlsx を作る。
+#   python main.py 入力(フォルダ / .json / .jsonl を1つ以上) -o 出力フォルダ [-j 並列数]
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "主治医意見書_テンプレート.xlsx")
+
+def _safe_filename(name):
+    """ ファイル名に使えない文字を _ にする """
+    name = re.sub(r'[\\/:*?"<>|\s]+', "_", str(name)).strip("._")
+    return name or "noname"
+
+def load_batch_inputs(src):
+    """
+    入力を [(出力ファイル名の元, data), ...] にする (src はパス、またはパスのリスト)
+    - フォルダ: 中の *.json を1ファイル1人として読む
+    - .json   : 1ファイル1人
+    - .jsonl  : 1行1人。"id" があればそれを、無ければ 行番号_氏名 をファイル名にする
+    読めなかったもの (無い・JSON でない など) は data の代わりに例外を入れて返す
+    """
+    if not isinstance(src, (str, os.PathLike)):
+        return [item for path in src for item in load_batch_inputs(path)]
+
+    items = []
+    label = os.path.basename(os.path.normpath(src))
+    try:
+        if os.path.isdir(src):
+            for fname in sorted(os.listdir(src)):
+                if not fname.lower().endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(src, fname), encoding="utf-8") as f:
+                        items.append((os.path.splitext(fname)[0], json.load(f)))
+                except Exception as e:
+                    items.append((fname, e))
+            return items
+
+        if str(src).lower().endswith(".json"):
+            with open(src, encoding="utf-8") as f:
+                items.append((os.path.splitext(label)[0], json.load(f)))
+            return items
+
+        with open(src, encoding="utf-8") as f:
+            for no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                    name = data.get("id") or f"{no:04d}_{data.get('text_data', {}).get('A13', '')}"
+                    items.append((name, data))
+                except Exception as e:
+                    items.append((f"{label} {no}行目", e))
+    except (OSError, ValueError) as e:
+        # 入力そのものが無い・読めない・UTF-8 でない (それまでに読めた分は残す)
+        items.append((label, e))
+    return items
+
+def pool_chunksize(n_tasks, workers=None):
+    """ ProcessPoolExecutor.map の chunksize (1プロセスあたり4回ほどに分けて渡す) """
+    return max(1, n_tasks // ((workers or os.cpu_count() or 1) * 4))
+
+def _init_batch_worker(template_path, engine):
+    """ ワーカープロセスごとにテンプレートを1回だけコンパイルしておく """
+    kind = CompiledXlsx if engine == "xml" else CompiledTemplate
+    get_compiled_template(template_path, kind=kind)
+
+def _batch_one(args):
+    template_path, output_path, data, engine = args
+    start = time.perf_counter()
+    try:
+        msg = update_opinion_form(template_path, output_path, data, engine=engine)
+    except Exception as e:
+        msg = f"エラー: {e}"
+    return output_path, msg, time.perf_counter() - start
+
+def batch_fill(items, out_dir, template_path=DEFAULT_TEMPLATE, workers=None, engine=DEFAULT_ENGINE):
+    """ items を並列に xlsx 化する。戻り値: (成功件数, [(名前, エラー内容)], 経過秒) """
+    os.makedirs(out_dir, exist_ok=True)
+    failures, tasks, used = [], [], set()
+    for name, data in items:
+        if isinstance(data, Exception):
+            failures.append((name, f"入力読み込み失敗: {data}"))
+            continue
+        fname = _safe_filename(name)
+        while fname in used:
+            fname += "_"
+        used.add(fname)
+        tasks.append((template_path, os.path.join(out_dir, fname + ".xlsx"), data, engine))
+
+    ok = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(template_path, engine)) as pool:
+        for output_path, msg, _ in pool.map(_batch_one, tasks, chunksize=pool_chunksize(len(tasks), workers)):
+            if msg.startswith("成功"):
+                ok += 1
+            else:
+                failures.append((os.path.basename(output_path), msg))
+    return ok, failures, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="解析済みJSONから主治医意見書(xlsx)を一括作成する")
+    parser.add_argument("input", nargs="+", help="*.json を入れたフォルダ、.json ファイル、または .jsonl ファイル")
+    parser.add_argument("-o", "--out", default="output", help="出力フォルダ (既定: output)")
+    parser.add_argument("-t", "--template", default=DEFAULT_TEMPLATE, help="テンプレートxlsx")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="並列プロセス数 (既定: CPU数)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default=DEFAULT_ENGINE)
+    args = parser.parse_args(argv)
+
+    items = load_batch_inputs(args.input)
+    if not items:
+        print("入力がありません")
+        return 1
+    ok, failures, elapsed = batch_fill(items, args.out, args.template, args.workers, args.engine)
+
+    for name, msg in failures:
+        print(f"失敗: {name}: {msg}")
+    rate = ok / elapsed if elapsed > 0 else 0.0
+    print(f"完了: {ok}件成功 / {len(failures)}件失敗 ({elapsed:.2f}秒, {rate:.1f}件/秒) -> {args.out}")
+    return 1 if failures else 0
+
 if __name__ == "__main__":
-    print("main.pyのテスト実行です。Webアプリ(app.py)から実行してください。")
+    sys.exit(main())
@@ -0,0 +1,46 @@
+# ---------------------------------------------------------
+# 修正パネルの選択肢 (番地 -> 画面上の表示名)
+# ---------------------------------------------------------
+# app.py の修正パネルで使う固定の対応表。Streamlit は操作のたびにスクリプトを
+# 頭から実行し直すので、ここ (モジュール) に置いてプロセスで1回だけ作る。
+# 番地の正式な定義とシートは cell_registry.py 側にある。
+
+# ===== 表 =====
+STABILITY = {"AF34": "安定", "AR34": "不安定", "BF34": "不明"}
+DEPTS = {"CA25":"内科", "CM25":"精神科", "CY25":"外科", "DW25":"脳外", "AH26":"皮膚科", "AV26":"泌尿器", "BI26":"婦人科", "BU26":"眼科", "CG26":"耳鼻科", "CS26":"リハ科", "DE26":"歯科", "DP26":"その他"}
+J_OPTS = {"BJ53":"自立", "BV53":"J1", "CD53":"J2", "CM53":"A1", "CV53":"A2", "DD53":"B1", "DM53":"B2", "DU53":"C1", "ED53":"C2"}
+N_OPTS = {"BJ55":"自立", "BV55":"I", "CD55":"IIa", "CM55":"IIb", "CV55":"IIIa", "DD55":"IIIb", "DM55":"IV", "DU55":"M"}
+PROBLEMS = {"AB67":"幻視・幻聴", "AS67":"妄想", "BJ67":"昼夜逆転", "CA67":"暴言", "CR67":"暴行", "DI67":"介護抵抗", "DZ67":"徘徊", "AB69":"火の不始末", "AS69":"不潔行為", "BJ69":"異食", "CA69":"性的問題", "CR69":"その他"}
+
+# ===== 裏 =====
+LEVELS = ["軽", "中", "重"]
+PARALYSIS_PARTS = {
+    "右上肢": {"base":"V11", "lv":{"軽":"AK11", "中":"AZ11", "重":"BI11"}},
+    "左上肢": {"base":"CT11", "lv":{"軽":"DN11", "中":"DX11", "重":"EG11"}},
+    "右下肢": {"base":"V13", "lv":{"軽":"AK13", "中":"AZ13", "重":"BI13"}},
+    "左下肢": {"base":"CT13", "lv":{"軽":"DN13", "中":"DX13", "重":"EG13"}},
+    "その他": {"base":"V15", "lv":{"軽":"BU15", "中":"CF15", "重":"CP15"}}
+}
+SYMPTOMS = {
+    "筋力低下": {"base":"I17", "part":"Z17", "lv":{"軽":"AZ17", "中":"BH17", "重":"BP17"}},
+    "関節拘縮": {"base":"CC17", "part":"CT17", "lv":{"軽":"DP17", "中":"DY17", "重":"EG17"}},
+    "関節痛": {"base":"I19", "part":"Z19", "lv":{"軽":"AZ19", "中":"BH19", "重":"BP19"}}
+}
+# 失調の部位はテンプレート上 上肢/下肢/体幹 × 右/左 のチェック欄 (AP21〜DF21)
+ATAXIA = {"AP21":"上肢 右", "AZ21":"上肢 左", "BT21":"下肢 右", "CC21":"下肢 左", "CW21":"体幹 右", "DF21":"体幹 左"}
+PRESSURE_SORE = {"AT23": "軽", "BC23": "中", "BK23": "重"}
+ADLS = {
+    "屋外歩行": {"AT27":"自立", "BO27":"介助あれば可", "CX27":"していない"},
+    "車いす": {"AT29":"不使用", "BO29":"自操", "CX29":"介助"},
+    "歩行補助具": {"AT31":"不使用", "BO31":"屋外", "CX31":"屋内"},
+    "食事": {"AT34":"自立", "CX34":"全面介助"},
+    "栄養": {"AT36":"良好", "CX36":"不良"}
+}
+MANAGEMENT = {"血圧":{"on":"AB50","off":"O50","txt":"AG50"}, "移動":{"on":"CO50","off":"CB50","txt":"CT50"}, "摂食":{"on":"AB51","off":"O51","txt":"AG51"}, "運動":{"on":"CO51","off":"CB51","txt":"CT51"}, "嚥下":{"on":"AB52","off":"O52","txt":"AG52"}}
+RISKS = {"H39":"尿失禁", "BI39":"褥瘡", "CQ39":"閉じこもり", "DG39":"意欲低下", "DW39":"徘徊", "H40":"低栄養", "V40":"嚥下低下", "AU40":"脱水", "BG40":"易感染", "BW40":"疼痛"}
+SERVICES = {"H46":"訪問診療", "Y46":"訪問看護", "AP46":"訪問歯科", "CA46":"訪問薬剤", "CY46":"訪問リハ", "H47":"短期入所", "AP47":"訪問衛生", "CA47":"訪問栄養", "CY47":"通所リハ"}
+
+
+def option_for(options, label):
+    """ 表示名 -> 番地 (options は {番地: 表示名}) """
+    return next(k for k, v in options.items() if v == label)
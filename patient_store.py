@@ -0,0 +1,132 @@
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+
+# ---------------------------------------------------------
+# 患者ごとの作成記録 (SQLite)
+# ---------------------------------------------------------
+# 作成した意見書の text_data / check_cells を、患者 (氏名 + 生年月日) ごと・日付ごとに残す。
+# 更新のときは過去の意見書の写真 (画像1・2) を読み直させる代わりに、前回の記録をテキストで渡せる。
+# 同じ患者の同じ日の記録は上書き (その日の最後に作成・反映した内容が残る)。
+# 保存先は環境変数 PATIENT_DB (既定: .patients/patients.sqlite3)。患者情報なのでリポジトリには入れない。
+
+DB_PATH = os.environ.get("PATIENT_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".patients", "patients.sqlite3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id          INTEGER PRIMARY KEY,
+    name_key    TEXT NOT NULL,      -- 照合用の氏名 (空白を除き NFKC で正規化)
+    birth_key   TEXT NOT NULL,      -- 照合用の生年月日 (例: 昭和35-03-21)
+    name        TEXT NOT NULL,      -- 表示用の氏名
+    birth       TEXT NOT NULL,      -- 表示用の生年月日
+    record_date TEXT NOT NULL,      -- 記録した日 (YYYY-MM-DD)
+    saved_at    TEXT NOT NULL,
+    data        TEXT NOT NULL,      -- {"text_data", "check_cells"} の JSON
+    UNIQUE (name_key, birth_key, record_date)   -- 患者の検索・最新の記録もこの索引で引く
+);
+"""
+
+BIRTH_CELLS = ("A14", "I14", "R14", "AC14")   # 元号 / 年 / 月 / 日
+
+def name_key(name):
+    """ 氏名の照合用キー (全角/半角・空白の違いを無視する) """
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", name or ""))
+
+def birth_key(era, year, month, day):
+    """ 生年月日の照合用キー。数字は2桁にそろえる ('昭和', '35', '3', '21' -> '昭和35-03-21') """
+    def num(v):
+        v = unicodedata.normalize("NFKC", str(v or "")).strip()
+        return v.zfill(2) if v.isdigit() else v
+    return f"{unicodedata.normalize('NFKC', era or '').strip()}{num(year)}-{num(month)}-{num(day)}"
+
+def patient_of(data):
+    """ 解析結果から (氏名, 生年月日の表示, 照合キー) を取り出す。氏名が無ければ None """
+    text = (data or {}).get("text_data") or {}
+    name = (text.get("A13") or "").strip()
+    if not name_key(name):
+        return None
+    parts = [text.get(a, "") for a in BIRTH_CELLS]
+    birth = "/".join(str(p) for p in parts if p)
+    return name, birth, (name_key(name), birth_key(*parts))
+
+
+class PatientStore:
+    """ 作成記録の保存と検索 (スレッドごとに接続を持つ。ジョブのワーカーからも使える) """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, data, date=None):
+        """
+        text_data / check_cells を保存する (同じ患者・同じ日なら上書き)
+        戻り値: (氏名, 生年月日, 日付)  氏名が無い結果は保存せず None
+        """
+        who = patient_of(data)
+        if who is None:
+            return None
+        name, birth, (nkey, bkey) = who
+        date = date or datetime.date.today().isoformat()
+        payload = json.dumps({"text_data": data.get("text_data") or {}, "check_cells": list(data.get("check_cells") or [])},
+                             ensure_ascii=False)
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO records (name_key, birth_key, name, birth, record_date, saved_at, data) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (name_key, birth_key, record_date) DO UPDATE SET "
+                "name = excluded.name, birth = excluded.birth, saved_at = excluded.saved_at, data = excluded.data",
+                (nkey, bkey, name, birth, date, datetime.datetime.now().isoformat(timespec="seconds"), payload),
+            )
+        return name, birth, date
+
+    def search(self, name_prefix, limit=20):
+        """ 氏名の前方一致で患者を探す。戻り値: [(氏名, 生年月日, 照合キー, 最新の日付, 記録数), ...] """
+        prefix = name_key(name_prefix)
+        if not prefix:
+            return []
+        # LIKE ではなく範囲で引く (索引がそのまま使える)
+        # SQLite は UTF-8 のバイト順で比べるので、上限は最大の文字 U+10FFFF (𠮷 など U+FFFF より上の漢字も入る)
+        rows = self._conn().execute(
+            "SELECT name_key, birth_key, MAX(record_date), COUNT(*) FROM records "
+            "WHERE name_key >= ? AND name_key < ? GROUP BY name_key, birth_key ORDER BY name_key LIMIT ?",
+            (prefix, prefix + "\U0010ffff", limit),
+        ).fetchall()
+        results = []
+        for nkey, bkey, latest, n in rows:
+            name, birth = self._conn().execute(
+                "SELECT name, birth FROM records WHERE name_key = ? AND birth_key = ? AND record_date = ?",
+                (nkey, bkey, latest),
+            ).fetchone()
+            results.append((name, birth, (nkey, bkey), latest, n))
+        return results
+
+    def history(self, key):
+        """ その患者の記録の日付 (新しい順) """
+        return [r[0] for r in self._conn().execute(
+            "SELECT record_date FROM records WHERE name_key = ? AND birth_key = ? ORDER BY record_date DESC", key)]
+
+    def load(self, key, date=None):
+        """ その患者の記録 (date を省くと最新)。戻り値: (日付, {"text_data", "check_cells"}) or None """
+        if date is None:
+            row = self._conn().execute(
+                "SELECT record_date, data FROM records WHERE name_key = ? AND birth_key = ? ORDER BY record_date DESC LIMIT 1",
+                key).fetchone()
+        else:
+            row = self._conn().execute(
+                "SELECT record_date, data FROM records WHERE name_key = ? AND birth_key = ? AND record_date = ?",
+                (*key, date)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
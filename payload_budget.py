@@ -0,0 +1,72 @@
+import io
+import math
+
+# ---------------------------------------------------------
+# 送信量の見積もり (リクエストを投げる前に)
+# ---------------------------------------------------------
+# カルテを何十枚も積むと、1回の generate_content が API の上限を超えたり、極端に遅くなったりする。
+# 送る前にバイト数とおおよそのトークン数を見積もり、上限を超えるなら analysis.reduce_evidence で
+# ③④をページごとに要約してから解析する (map-reduce)。
+# トークン数は目安:
+#   テキスト : ASCII は4文字で1トークン、それ以外 (日本語) は1文字1トークン
+#   画像     : 768px 四方のタイルごとに 258 トークン (両辺 384px 以下なら 258 トークン)
+# 画像はリクエストの JSON に base64 で入るので、バイト数は 4/3 倍で数える。
+
+TILE = 768
+TOKENS_PER_TILE = 258
+MAX_REQUEST_BYTES = 20 * 1024 * 1024   # インラインで送れるリクエストの上限
+
+DEFAULT_BUDGET = {
+    "bytes": 15 * 1024 * 1024,   # 上限に余裕を持たせる
+    "tokens": 40000,             # これを超えると1回の呼び出しが目に見えて遅くなる
+}
+
+def text_tokens(text):
+    """ テキストのおおよそのトークン数 """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+def image_tokens(data):
+    """ 画像1枚のおおよそのトークン数 (サイズが読めなければタイル1枚分) """
+    from PIL import Image   # 起動を軽くするため、画像を扱うときに読み込む
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:   # ヘッダーだけ読む
+            w, h = img.size
+    except Exception:
+        return TOKENS_PER_TILE
+    if w <= TILE // 2 and h <= TILE // 2:
+        return TOKENS_PER_TILE
+    return math.ceil(w / TILE) * math.ceil(h / TILE) * TOKENS_PER_TILE
+
+def estimate_request(request):
+    """ 1リクエストの見積もり: {"bytes", "tokens", "images"} """
+    texts = [p for p in request if isinstance(p, str)]
+    images = [p for p in request if not isinstance(p, str)]
+    return {
+        "bytes": sum(len(t.encode("utf-8")) for t in texts) + sum(4 * math.ceil(len(p["data"]) / 3) for p in images),
+        "tokens": sum(text_tokens(t) for t in texts) + sum(image_tokens(p["data"]) for p in images),
+        "images": len(images),
+    }
+
+def estimate_requests(requests):
+    """ 並列に投げる全リクエストの見積もり。上限と比べるのは1リクエストあたりの最大 ("bytes" / "tokens") """
+    estimates = [estimate_request(req) for req in requests]
+    return {
+        "bytes": max((e["bytes"] for e in estimates), default=0),
+        "tokens": max((e["tokens"] for e in estimates), default=0),
+        "total_bytes": sum(e["bytes"] for e in estimates),
+        "total_tokens": sum(e["tokens"] for e in estimates),
+        "requests": len(estimates),
+    }
+
+def over_budget(estimate, budget=None):
+    """ 上限を超えた項目のリスト (空なら収まっている) """
+    budget = dict(DEFAULT_BUDGET, **(budget or {}))
+    limit_bytes = min(budget["bytes"], MAX_REQUEST_BYTES)
+    over = []
+    if estimate["bytes"] > limit_bytes:
+        over.append("bytes")
+    if budget["tokens"] and estimate["tokens"] > budget["tokens"]:
+        over.append("tokens")
+    return over
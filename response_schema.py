@@ -0,0 +1,94 @@
+from cell_registry import CELLS, CHECKBOX, TEXT, lookup
+from cellref import normalize_address
+
+# ---------------------------------------------------------
+# 応答のスキーマ・検証・修復
+# ---------------------------------------------------------
+# 1. build_schema      : Gemini の response_schema。text_data のキーと check_cells の値を台帳の番地に限る
+# 2. validate_result   : 受け取った JSON を台帳と照らして整える (番地の表記ゆれを直し、未登録・重複を落とす)
+# 3. salvage           : JSON が途中で壊れていても、それまでに閉じた項目から結果を組み立て直す
+# どれも「全部やり直し」を減らすためのもので、直せないときだけ呼び出し元がそのセクションを再実行する。
+
+ROOT_KEYS = ("text_data", "check_cells", "change_log")
+
+def build_schema(cells=None):
+    """ response_schema (dict, OpenAPI 形式)。cells を渡すとその番地だけに絞る (空なら台帳の全番地) """
+    defs = [c for a, c in CELLS.items() if not cells or a in cells]
+    text = [c.address for c in defs if c.kind == TEXT]
+    checks = [c.address for c in defs if c.kind == CHECKBOX]
+    # Gemini は中身の無い object / enum を受け付けないので、担当の無い欄は項目ごと出さない
+    properties = {}
+    if text:
+        properties["text_data"] = {"type": "object", "properties": {a: {"type": "string"} for a in text}}
+    if checks:
+        properties["check_cells"] = {"type": "array", "items": {"type": "string", "enum": checks}}
+    properties["change_log"] = {"type": "array", "items": {"type": "string"}}
+    return {"type": "object", "properties": properties, "required": list(properties)}
+
+def _cell(address, kind):
+    """ 表記ゆれ ($A$13 / a13 / A13:C14) を直して台帳の番地を返す (種類違い・未登録なら None) """
+    cell = lookup(normalize_address(address))
+    return cell.address if cell and cell.kind == kind else None
+
+def validate_result(result):
+    """
+    台帳と照らして整えた結果と、直した内容のリストを返す
+    - text_data : 未登録・チェック欄の番地と空の値を落とし、値は文字列にする
+    - check_cells: 未登録・記載欄の番地と重複を落とし、排他グループで2つ目以降に付いた印を落とす
+    - change_log: 文字列のリストにする
+    """
+    if not isinstance(result, dict):
+        raise ValueError(f"JSONの形が不正です: {type(result).__name__}")
+    issues = []
+
+    text_data = {}
+    raw_text = result.get("text_data") or {}
+    if not isinstance(raw_text, dict):
+        issues.append("text_data が辞書ではないため無視")
+        raw_text = {}
+    for addr, val in raw_text.items():
+        key = _cell(addr, TEXT)
+        if key is None:
+            issues.append(f"記載欄ではない番地を除外: {addr}")
+        elif val is not None and val != "":
+            text_data[key] = val if isinstance(val, str) else str(val)
+
+    check_cells, seen, groups = [], set(), {}
+    raw_checks = result.get("check_cells") or []
+    if not isinstance(raw_checks, list):
+        issues.append("check_cells がリストではないため無視")
+        raw_checks = []
+    for addr in raw_checks:
+        key = _cell(addr, CHECKBOX)
+        if key is None:
+            issues.append(f"チェック欄ではない番地を除外: {addr}")
+            continue
+        if key in seen:
+            continue
+        group = CELLS[key].group
+        if group and group in groups:
+            issues.append(f"「{group}」は1つだけ選ぶ欄のため {key} を除外 ({groups[group]} を採用)")
+            continue
+        seen.add(key)
+        if group:
+            groups[group] = key
+        check_cells.append(key)
+
+    change_log = result.get("change_log") or []
+    if isinstance(change_log, str):
+        change_log = [change_log]
+    change_log = [str(x) for x in change_log] if isinstance(change_log, list) else []
+
+    clean = {k: v for k, v in result.items() if k not in ROOT_KEYS}
+    clean.update(text_data=text_data, check_cells=check_cells, change_log=change_log)
+    return clean, issues
+
+def salvage(items):
+    """ StreamingJsonParser が出した (ルートのキー, 番地, 値) の列から結果を組み立てる """
+    result = {"text_data": {}, "check_cells": [], "change_log": []}
+    for root, key, value in items:
+        if root == "text_data" and key is not None:
+            result["text_data"][key] = value
+        elif root in ("check_cells", "change_log") and key is None:
+            result[root].append(value)
+    return result
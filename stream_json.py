@@ -0,0 +1,101 @@
+import json
+
+# ---------------------------------------------------------
+# ストリーミング出力用の逐次JSONパーサー
+# ---------------------------------------------------------
+# モデルの出力を届いた断片ごとに feed() し、
+#   text_data   の "番地": "値" が1つ閉じるたびに
+#   check_cells の "番地"       が1つ閉じるたびに
+# on_item(ルートのキー, 番地 or None, 値) を呼ぶ。
+# 括弧の対応違いや読めない要素は、その時点で ValueError を出す (最後まで待たない)。
+
+class StreamingJsonParser:
+
+    def __init__(self, on_item=None):
+        self.on_item = on_item
+        self.buf = []           # ルートの { 以降の全文字
+        self.root_done = False
+        self._stack = []        # 開いている { / [
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._root_key = None       # ルート直下で今読んでいるキー
+        self._container_key = None  # 2階層目のコンテナが属するルートのキー
+        self._member_start = None   # 2階層目の要素の開始位置
+        self.items = 0
+
+    # ---- 外部API ----
+    def feed(self, chunk):
+        for ch in chunk:
+            if self.root_done:
+                return
+            if not self._stack and not self.buf:
+                # ルートの { が来るまでは ```json や前置きの文章を読み飛ばす
+                if ch == "{":
+                    self.buf.append(ch)
+                    self._stack.append("{")
+                continue
+            self._consume(ch)
+
+    def finish(self):
+        """ 全文を JSON として返す (途中で切れていれば ValueError) """
+        if not self.buf:
+            raise ValueError("JSONが見つかりません")
+        if not self.root_done:
+            raise ValueError("JSONが途中で終わっています")
+        return json.loads("".join(self.buf))
+
+    # ---- 内部 ----
+    def _consume(self, ch):
+        pos = len(self.buf)
+        self.buf.append(ch)
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if len(self._stack) == 1:
+                    self._last_string = json.loads("".join(self.buf[self._string_start:pos + 1]))
+            return
+
+        depth = len(self._stack)
+        if ch == '"':
+            self._in_string = True
+            self._string_start = pos
+        elif ch in "{[":
+            self._stack.append(ch)
+            if depth == 1:
+                self._container_key = self._root_key
+                self._member_start = pos + 1
+        elif ch in "}]":
+            opener = self._stack.pop() if self._stack else None
+            if (opener, ch) not in (("{", "}"), ("[", "]")):
+                raise ValueError(f"括弧の対応が不正です: 位置 {pos} の '{ch}'")
+            if depth == 2:
+                self._emit(pos, opener)
+            if not self._stack:
+                self.root_done = True
+        elif ch == ":" and depth == 1:
+            self._root_key = self._last_string
+        elif ch == "," and depth == 2:
+            self._emit(pos, self._stack[-1])
+            self._member_start = pos + 1
+
+    def _emit(self, end, container):
+        text = "".join(self.buf[self._member_start:end]).strip()
+        if not text:
+            return
+        try:
+            if container == "{":
+                (key, value), = json.loads("{" + text + "}").items()
+            else:
+                key, value = None, json.loads(text)
+        except ValueError as e:
+            raise ValueError(f"{self._container_key} の要素が読めません: {text[:40]} ({e})")
+        self.items += 1
+        if self.on_item:
+            self.on_item(self._container_key, key, value)
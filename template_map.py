@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import re
+import sys
+import zipfile
+import xml.etree.ElementTree as ET
+
+from cell_registry import CELLS, CHECKBOX, SHEET_NAMES, TEXT
+from cellref import build_anchor_index, resolve_anchor, split_address
+from template_cache import TemplateSource
+from xlsx_patch import MERGE_RE, NS_MAIN, CompiledXlsx
+
+# ---------------------------------------------------------
+# テンプレートの番地マップ (□ のセル・結合範囲)
+# ---------------------------------------------------------
+# 台帳 (cell_registry) や修正パネルの番地は手で打ったもので、テンプレートとの照合が無い。
+# DP23 のつもりで DC23 と書いても mark_checkbox は黙って何もしない。
+# そこでテンプレートを1回だけ走査し、シートごとに
+#   - □ を含むセル (結合範囲の左上) とその文字列
+#   - 結合範囲 (左上の索引はここから作る)
+# を小さな JSON (テンプレート名.map.json) に書き出しておく。
+# アプリや書き込みはこれを読むだけで、ブックを開き直さない。
+# テンプレートの sha256 を持たせてあり、テンプレートが差し替わっていたら作り直す。
+#   python template_map.py              # マップを書き出し、台帳・プロンプト・修正パネルの番地を照合する
+#   python template_map.py --check      # 書き出さずに照合だけ (問題があれば終了コード 1)
+
+MAP_VERSION = 1
+# 照合するソースの番地 ("AF34" のような文字列リテラル / プロンプト中の番地)
+SOURCE_FILES = ("app.py", "panel_options.py")
+QUOTED_ADDR_RE = re.compile(r"[\"']([A-Z]{1,3}[1-9]\d{0,2})[\"']")
+PROMPT_ADDR_RE = re.compile(r"(?<![A-Za-z0-9])([A-Z]{1,3}[1-9]\d{0,2})(?![A-Za-z0-9])")
+# 1・2行目は表題の行で番地は無い。A1 / J1 / C2 は自立度の表記なので番地とはみなさない
+MIN_ROW = 3
+
+def map_path(template_path):
+    """ テンプレートに対応するマップのパス (同じフォルダの「名前.map.json」) """
+    return os.path.splitext(template_path)[0] + ".map.json"
+
+def scan_template(template_path):
+    """ テンプレートを走査してマップ (dict) を作る """
+    compiled = CompiledXlsx(template_path)
+    with zipfile.ZipFile(template_path) as zf:
+        wb_xml = ET.fromstring(zf.read("xl/workbook.xml"))
+    titles = [sh.get("name") for sh in wb_xml.iter(f"{{{NS_MAIN}}}sheet")]
+    sheets = []
+    for idx, sheet in enumerate(compiled.sheets):
+        boxes = {}
+        for addr in sheet.cells:
+            # 結合範囲の従属セルは書き込み先にならないので、左上だけを見る
+            if addr in sheet.anchors:
+                continue
+            text = compiled.cell_text(sheet, addr)
+            if text and "□" in text:
+                boxes[addr] = text.strip()
+        sheets.append({"name": titles[idx], "part": sheet.name, "boxes": dict(sorted(boxes.items(), key=lambda kv: _order(kv[0]))),
+                       "merges": MERGE_RE.findall(sheet.xml)})
+    return {"version": MAP_VERSION, "template": os.path.basename(template_path), "sha256": compiled.digest, "sheets": sheets}
+
+def _order(address):
+    """ 行 -> 列の順に並べるためのキー """
+    col, row = split_address(address)
+    return row, col
+
+def write_map(data, path):
+    """ マップを書き出す (1行に1シートの、差分が読みやすい程度の JSON) """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write('{"version": %d, "template": %s, "sha256": "%s", "sheets": [\n'
+                % (data["version"], json.dumps(data["template"], ensure_ascii=False), data["sha256"]))
+        f.write(",\n".join(json.dumps(s, ensure_ascii=False, separators=(",", ":")) for s in data["sheets"]))
+        f.write("\n]}\n")
+    os.replace(tmp, path)
+
+
+class TemplateMap(TemplateSource):
+    """
+    テンプレートの番地マップ (get_compiled_template(path, kind=TemplateMap) でプロセスで1つ)
+    マップのファイルがテンプレートと合っていればそれを読み、無い・古いときだけ走査して書き直す
+    data を渡すとファイルは読み書きしない (走査した直後の照合用)
+    """
+
+    def __init__(self, path, data=None):
+        super().__init__(path)
+        self.rescanned = False
+        data = data or self._read(map_path(path))
+        if data is None:
+            data = scan_template(path)
+            self.rescanned = True
+            try:
+                write_map(data, map_path(path))
+            except OSError:
+                pass   # 書けない場所でもこのプロセスでは使える
+        self.sheet_names = [s["name"] for s in data["sheets"]]
+        self.boxes = [s["boxes"] for s in data["sheets"]]
+        self.anchors = [build_anchor_index(s["merges"]) for s in data["sheets"]]
+
+    def _read(self, path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != MAP_VERSION or data.get("sha256") != self.digest:
+            return None
+        return data
+
+    def anchor(self, sheet, address):
+        """ 範囲指定・結合セルを左上の番地に正規化する (書き込みと同じ規則) """
+        return resolve_anchor(self.anchors[sheet], address)
+
+    def box_text(self, sheet, address):
+        """ その番地が指す □ のセルの文字列 (□ のセルでなければ None) """
+        if sheet >= len(self.boxes):
+            return None
+        return self.boxes[sheet].get(self.anchor(sheet, address))
+
+    def check_registry(self, cells=None):
+        """
+        台帳をテンプレートと照合する。戻り値: 問題のリスト (空なら OK)
+        - チェック欄なのに □ のセルを指していない / 記載欄なのに □ のセルを指している
+        - 2つの番地が同じセル (結合範囲) を指している
+        """
+        problems, seen = [], {}
+        for addr, cell in (cells or CELLS).items():
+            where = f"{addr} ({SHEET_NAMES[cell.sheet]} {cell.label})"
+            if cell.sheet >= len(self.boxes):
+                problems.append(f"{where}: テンプレートにシートがありません")
+                continue
+            anchor = self.anchor(cell.sheet, addr)
+            box = self.box_text(cell.sheet, addr)
+            if cell.kind == CHECKBOX and box is None:
+                near = self.boxes_in_row(cell.sheet, split_address(anchor)[1])
+                problems.append(f"{where}: □ のセルではありません" + (f" (同じ行の □: {', '.join(near)})" if near else ""))
+            elif cell.kind == TEXT and box is not None:
+                problems.append(f"{where}: 記載欄ですが □ のセルです ({box})")
+            other = seen.setdefault((cell.sheet, anchor), addr)
+            if other != addr:
+                problems.append(f"{where}: {other} と同じセル ({anchor}) を指しています")
+        return problems
+
+    def boxes_in_row(self, sheet, row):
+        """ その行の □ のセル ("番地 文字列" のリスト) """
+        return [f"{a} {t}" for a, t in self.boxes[sheet].items() if split_address(a)[1] == row]
+
+    def unregistered(self, cells=None):
+        """ 台帳に無い □ のセル [(シート, 番地, 文字列), ...] """
+        used = {(c.sheet, self.anchor(c.sheet, a)) for a, c in (cells or CELLS).items() if c.kind == CHECKBOX}
+        return [(idx, a, t) for idx, boxes in enumerate(self.boxes) for a, t in boxes.items() if (idx, a) not in used]
+
+
+def check_addresses(texts, cells=None):
+    """
+    手で書いた番地 (プロンプト・修正パネル) が台帳にあるかを見る
+    texts: {出どころ: (文字列, 正規表現)}  戻り値: 問題のリスト
+    """
+    cells = cells or CELLS
+    problems = []
+    for origin, (text, pattern) in texts.items():
+        for addr in sorted(set(pattern.findall(text)), key=_order):
+            if split_address(addr)[1] >= MIN_ROW and addr not in cells:
+                problems.append(f"{origin}: 台帳に無い番地 {addr}")
+    return problems
+
+def source_texts(base_dir=None):
+    """ 照合するプロンプトとソース {出どころ: (文字列, 正規表現)} """
+    from analysis import IMAGE_LOGIC_RULES, STRICT_MEDICAL_RULES
+
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    texts = {"STRICT_MEDICAL_RULES": (STRICT_MEDICAL_RULES, PROMPT_ADDR_RE),
+             "IMAGE_LOGIC_RULES": (IMAGE_LOGIC_RULES, PROMPT_ADDR_RE)}
+    for name in SOURCE_FILES:
+        with open(os.path.join(base_dir, name), encoding="utf-8") as f:
+            texts[name] = (f.read(), QUOTED_ADDR_RE)
+    return texts
+
+def main(argv=None):
+    from main import DEFAULT_TEMPLATE
+
+    parser = argparse.ArgumentParser(description="テンプレートの □ / 結合範囲のマップを作り、番地を照合する")
+    parser.add_argument("-t", "--template", default=DEFAULT_TEMPLATE, help="テンプレートxlsx")
+    parser.add_argument("--check", action="store_true", help="マップを書き出さずに照合だけする")
+    args = parser.parse_args(argv)
+
+    data = scan_template(args.template)
+    if not args.check:
+        write_map(data, map_path(args.template))
+        print(f"書き出し: {map_path(args.template)}")
+    for s in data["sheets"]:
+        print(f"{s['name']}: □ {len(s['boxes'])}個 / 結合範囲 {len(s['merges'])}個")
+
+    tmap = TemplateMap(args.template, data=data)
+    problems = tmap.check_registry() + check_addresses(source_texts())
+    for idx, addr, text in tmap.unregistered():
+        print(f"参考: 台帳に無い □: {SHEET_NAMES.get(idx, idx)}!{addr} {' '.join(text.split())}")
+    for p in problems:
+        print(f"問題: {p}")
+    print("照合: OK" if not problems else f"照合: {len(problems)}件の問題")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
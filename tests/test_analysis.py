@@ -0,0 +1,48 @@
+import json
+import threading
+
+from analysis import build_requests, reduce_evidence, run_analysis
+from llm_backend import LLMBackend
+
+# ---------------------------------------------------------
+# 失敗したセクション・ページだけのやり直し
+# ---------------------------------------------------------
+
+class FlakyBackend(LLMBackend):
+    """ 同じリクエストの1回目だけ失敗し、2回目から response を返す """
+    name = "flaky"
+
+    def __init__(self, response):
+        self.response = response
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def stream(self, request, schema=None):
+        key = request[0] + str(len(request))
+        with self.lock:
+            self.calls[key] = self.calls.get(key, 0) + 1
+            first = self.calls[key] == 1
+        if first:
+            raise ConnectionError("一時的なエラー")
+        yield self.response
+
+def test_run_analysis_retries_only_failed_sections():
+    backend = FlakyBackend(json.dumps({"text_data": {"A13": "山田 太郎"}, "check_cells": ["CB16"], "change_log": []}))
+    manual = {"doctor": "医師", "diagnosis": "右変形性股関節症", "last_visit": "令和8年1月20日"}
+    sections, requests = build_requests([], manual, True)
+    result, outcomes = run_analysis(backend, sections, requests, retries=1)
+    assert result["text_data"]["A13"] == "山田 太郎"
+    assert all(err is None for _, err, _ in outcomes)
+    assert all(res["repairs"][0].startswith("1回目が失敗したため再実行しました") for res, _, _ in outcomes)
+    assert set(backend.calls.values()) == {2}
+
+def test_reduce_evidence_retries_failed_pages():
+    backend = FlakyBackend(json.dumps({"findings": ["歩行器で屋内移動"]}))
+    pages = [(f"カルテ {i}枚目", {"mime_type": "image/png", "data": bytes([i])}) for i in range(3)]
+    notes, outcomes = reduce_evidence(backend, pages, retries=1)
+    assert all(err is None for _, err, _ in outcomes)
+    assert notes.count("歩行器で屋内移動") == 3
+
+    notes, outcomes = reduce_evidence(FlakyBackend("{}"), pages, retries=0)
+    assert all(err is not None for _, err, _ in outcomes)
+    assert notes.count("読み取れませんでした") == 3
@@ -0,0 +1,17 @@
+import json
+
+from main import load_batch_inputs
+
+# ---------------------------------------------------------
+# 一括作成の入力の読み込み
+# ---------------------------------------------------------
+
+def test_unreadable_inputs_are_reported_and_the_rest_still_load(tmp_path):
+    (tmp_path / "ok.json").write_text(json.dumps({"text_data": {"A13": "山田 花子"}}), encoding="utf-8")
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+    (tmp_path / "batch.jsonl").write_text('{"id": "x1"}\nnot json\n', encoding="utf-8")
+    paths = [str(tmp_path / name) for name in ("missing.jsonl", "broken.json", "ok.json", "batch.jsonl")]
+
+    items = load_batch_inputs(paths)
+    assert [name for name, _ in items] == ["missing.jsonl", "broken.json", "ok", "x1", "batch.jsonl 2行目"]
+    assert [isinstance(data, Exception) for _, data in items] == [True, True, False, False, True]
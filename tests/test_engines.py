@@ -0,0 +1,50 @@
+import io
+import types
+import zipfile
+import xml.etree.ElementTree as ET
+
+from cell_registry import CELLS, CHECKBOX, TEXT
+from main import DEFAULT_TEMPLATE, update_opinion_form
+from xlsx_patch import COMPARE_SAMPLE, NS_MAIN, SheetXml, _patch_sheet, _SharedStringWriter, compare_engines
+
+# ---------------------------------------------------------
+# XML版と openpyxl版が同じ xlsx を作ること
+# ---------------------------------------------------------
+
+def full_registry_payload():
+    """ 台帳の全記載欄に値を入れ、全チェック欄に印を付けたデータ """
+    return {
+        "text_data": {a: f"{c.label} <テスト> & {a}" for a, c in CELLS.items() if c.kind == TEXT},
+        "check_cells": [a for a, c in CELLS.items() if c.kind == CHECKBOX],
+        "meta_birth_date": "1935-03-21",
+    }
+
+def test_engines_agree_on_sample():
+    assert compare_engines(DEFAULT_TEMPLATE, COMPARE_SAMPLE) == []
+
+def test_engines_agree_on_every_registry_cell():
+    assert compare_engines(DEFAULT_TEMPLATE, full_registry_payload()) == []
+
+def test_xml_engine_drops_calc_chain():
+    buf = io.BytesIO()
+    assert update_opinion_form(DEFAULT_TEMPLATE, buf, dict(COMPARE_SAMPLE), engine="xml").startswith("成功")
+    with zipfile.ZipFile(buf) as zf:
+        assert "xl/calcChain.xml" not in zf.namelist()
+        assert b"calcChain" not in zf.read("[Content_Types].xml")
+        assert b"calcChain" not in zf.read("xl/_rels/workbook.xml.rels")
+        assert b'fullCalcOnLoad="1"' in zf.read("xl/workbook.xml")
+
+def test_patch_fills_empty_row_once():
+    # テンプレートには <row .../> が無いので、小さなシートXMLで確かめる
+    xml = (f'<worksheet xmlns="{NS_MAIN}"><sheetData>'
+           '<row r="1" spans="1:3"/><row r="3"/><row r="4"><c r="B4"><v>1</v></c></row>'
+           '</sheetData></worksheet>')
+    sst = _SharedStringWriter(types.SimpleNamespace(shared_strings=[]))
+    out = _patch_sheet(SheetXml("sheet1.xml", xml), {"C1": "右", "A1": "左", "B3": 2, "A2": "新", "A5": "末"}, sst)
+
+    rows = list(ET.fromstring(out).iter(f"{{{NS_MAIN}}}row"))
+    assert [r.get("r") for r in rows] == ["1", "2", "3", "4", "5"]
+    assert rows[0].get("spans") == "1:3"
+    assert [c.get("r") for c in rows[0]] == ["A1", "C1"]
+    assert [c.get("r") for c in rows[2]] == ["B3"]
+    assert sst.added == ["右", "左", "新", "末"]
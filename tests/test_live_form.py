@@ -0,0 +1,40 @@
+import copy
+
+import pytest
+
+from main import DEFAULT_TEMPLATE, LiveForm, render_opinion_form
+from xlsx_patch import COMPARE_SAMPLE, diff_workbooks
+
+# ---------------------------------------------------------
+# 差分だけの再作成 (LiveForm) が、最初から作ったものと同じになること
+# ---------------------------------------------------------
+
+def edited(data):
+    """ 修正パネルでの修正: 印の付け替え・記載欄の削除・値の変更 """
+    data = copy.deepcopy(data)
+    checks = data["check_cells"]
+    checks[checks.index("CB16")] = "CS16"      # 同意する -> 同意しない
+    checks.remove("AM39")
+    checks.append("H39")
+    del data["text_data"]["A58"]               # 記載欄を消す
+    data["text_data"]["A13"] = "山田 次郎"      # 値を変える
+    data["text_data"]["G29"] = "腰部脊柱管狭窄症"  # 新しく書く
+    return data
+
+@pytest.mark.parametrize("engine", ["xml", "openpyxl"])
+def test_incremental_render_matches_fresh_fill(engine):
+    live = LiveForm(DEFAULT_TEMPLATE, engine)
+    first, msg = live.render(copy.deepcopy(COMPARE_SAMPLE))
+    assert first, msg
+
+    data = edited(COMPARE_SAMPLE)
+    incremental, msg = live.render(copy.deepcopy(data))
+    assert incremental, msg
+    fresh, msg = render_opinion_form(DEFAULT_TEMPLATE, copy.deepcopy(data), engine="openpyxl")
+    assert fresh, msg
+    assert diff_workbooks(fresh, incremental) == []
+
+    # 元に戻したときも最初のものと同じになる
+    reverted, msg = live.render(copy.deepcopy(COMPARE_SAMPLE))
+    assert reverted, msg
+    assert diff_workbooks(first, reverted) == []
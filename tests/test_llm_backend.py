@@ -0,0 +1,28 @@
+import json
+
+from analysis import build_requests
+from llm_backend import LLMBackend, RecordingBackend, ReplayBackend
+
+# ---------------------------------------------------------
+# 記録モードに患者情報を残さないこと
+# ---------------------------------------------------------
+
+class FixedBackend(LLMBackend):
+    name = "fixed"
+
+    def stream(self, request, schema=None):
+        yield "{}"
+
+def test_recording_redacts_prior_record_and_evidence_notes(tmp_path):
+    prior = {"text_data": {"A13": "山田 花子", "BM13": "桐生市相生町9-9", "CX14": "1234"}, "check_cells": ["CB16"]}
+    manual = {"doctor": "医師", "diagnosis": "右変形性股関節症", "last_visit": "令和8年1月20日"}
+    _, requests = build_requests([], manual, False, evidence_notes="- 1枚目: 田中 一郎 0277-11-2222", prior=prior)
+
+    RecordingBackend(FixedBackend(), str(tmp_path)).generate(requests[0])
+    [path] = tmp_path.glob("*.json")
+    prompt = json.loads(path.read_text(encoding="utf-8"))["prompt"]
+    for secret in ("山田 花子", "桐生市相生町9-9", "田中 一郎", "0277-11-2222"):
+        assert secret not in prompt
+    assert prompt.count("省略 sha256=") == 2
+    # 再生はリクエスト全体から作ったキーで引くので、そのまま使える
+    assert ReplayBackend(str(tmp_path)).generate(requests[0]) == "{}"
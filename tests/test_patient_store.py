@@ -0,0 +1,15 @@
+from patient_store import PatientStore
+
+# ---------------------------------------------------------
+# 患者の記録の検索
+# ---------------------------------------------------------
+
+def record(name):
+    return {"text_data": {"A13": name, "A14": "昭和", "I14": "35", "R14": "3", "AC14": "21"}, "check_cells": ["CB16"]}
+
+def test_prefix_search_includes_supplementary_kanji(tmp_path):
+    store = PatientStore(str(tmp_path / "patients.sqlite3"))
+    for name in ("山田 花子", "山𠮷 花子", "川上 一郎"):
+        store.save(record(name))
+    assert [hit[0] for hit in store.search("山")] == ["山田 花子", "山𠮷 花子"]
+    assert [hit[0] for hit in store.search("山𠮷")] == ["山𠮷 花子"]
@@ -0,0 +1,32 @@
+import copy
+import datetime
+import io
+
+import pytest
+
+from cell_registry import CELLS, CHECKBOX, TEXT
+from main import DEFAULT_TEMPLATE, render_opinion_form
+from xlsx_import import AUTO_FILLED, read_form
+
+# ---------------------------------------------------------
+# 作成した xlsx を読み戻すと元のデータになること
+# ---------------------------------------------------------
+
+def registry_payload():
+    """ 自動で入る欄以外の全記載欄と、全チェック欄 (年齢は計算で入るので meta_birth_date は付けない) """
+    return {
+        "text_data": {a: f"{c.label} <テスト> & {a}" for a, c in CELLS.items() if c.kind == TEXT and a not in AUTO_FILLED},
+        "check_cells": [a for a, c in CELLS.items() if c.kind == CHECKBOX],
+    }
+
+@pytest.mark.parametrize("engine", ["xml", "openpyxl"])
+def test_render_then_read_round_trips(engine):
+    payload = registry_payload()
+    xlsx, msg = render_opinion_form(DEFAULT_TEMPLATE, copy.deepcopy(payload), engine=engine)
+    assert xlsx, msg
+
+    data, notes = read_form(io.BytesIO(xlsx))
+    assert data["text_data"] == payload["text_data"]
+    assert sorted(data["check_cells"]) == sorted(payload["check_cells"])
+    assert data["meta_record_date"] == datetime.date.today().isoformat()
+    assert notes == []
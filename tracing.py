@@ -0,0 +1,203 @@
+import contextvars
+import cProfile
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# ---------------------------------------------------------
+# 処理時間の計測 (トレース)
+# ---------------------------------------------------------
+# 「遅い」と言われたときに、どの段階 (画像読み込み・プロンプト作成・Gemini・JSON解析・
+# テンプレート読み込み・セル書き込み・保存) が遅かったのかを後から見られるようにする。
+#   with trace("analyze") as tr:        # 1回の操作 = 1トレース。終わると JSONL に1行追記
+#       with span("build_prompt", chars=123) as sp:
+#           ...
+#           sp.set(requests=4)          # 後から分かった値 (サイズ・件数など) を足す
+#       count(prompt_tokens=100)        # トレース全体の合計値 (トークン数など)
+# トレースの外で span() / count() を呼んでも何もしない (一括作成CLIなど)。
+# スレッドプールで動かす処理は contextvars.copy_context() 経由で submit するとトレースが引き継がれる。
+#
+# 環境変数
+#   TRACE_LOG     : JSONL の保存先 (既定 .traces/trace.jsonl。"off" で保存しない)
+#   TRACE_PROFILE : トレース名 (analyze / export など。"1" なら何でも) を指定すると、
+#                   最初に該当した1回だけ cProfile を掛けて .prof を TRACE_LOG と同じフォルダに保存する
+#                   (計測されるのは trace() を呼んだスレッドのみ)
+
+TRACE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".traces")
+LOG_PATH = os.environ.get("TRACE_LOG", os.path.join(TRACE_DIR, "trace.jsonl"))
+MAX_LOG_BYTES = 5 * 1024 * 1024  # 超えたら .1 に退避して新しく始める
+
+_current = contextvars.ContextVar("trace", default=None)
+_log_lock = threading.Lock()
+_profile_lock = threading.Lock()
+_profiled = False
+
+
+class Span:
+    """ 1つの段階の計測結果 """
+
+    def __init__(self, name, offset, attrs):
+        self.name = name
+        self.offset = offset      # トレース開始からの秒数
+        self.seconds = None
+        self.attrs = dict(attrs)
+        self.thread = threading.current_thread().name
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {"name": self.name, "start_ms": round(self.offset * 1000, 1),
+                "ms": round((self.seconds or 0) * 1000, 1), "thread": self.thread, **self.attrs}
+
+
+class Trace:
+    """ 1回の操作 (解析・エクセル反映など) の全段階 """
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.attrs = dict(attrs)
+        self.spans = []
+        self.counters = {}
+        self.error = None
+        self.seconds = None
+        self.profile_path = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        sp = Span(name, time.perf_counter() - self._started, attrs)
+        start = time.perf_counter()
+        try:
+            yield sp
+        except BaseException as e:
+            sp.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            sp.seconds = time.perf_counter() - start
+            with self._lock:
+                self.spans.append(sp)
+
+    def count(self, **values):
+        with self._lock:
+            for key, val in values.items():
+                if val is not None:
+                    self.counters[key] = self.counters.get(key, 0) + val
+
+    def stage_totals(self):
+        """ 段階名ごとの合計ミリ秒 (並列の段階は単純に足すので壁時計より長くなりうる) """
+        totals = {}
+        for sp in self.spans:
+            totals[sp.name] = totals.get(sp.name, 0) + (sp.seconds or 0) * 1000
+        return {k: round(v, 1) for k, v in totals.items()}
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.offset)
+            return {
+                "id": self.id,
+                "name": self.name,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "ms": round((self.seconds or 0) * 1000, 1),
+                "error": self.error,
+                **self.attrs,
+                "counters": dict(self.counters),
+                "stages": self.stage_totals(),
+                "spans": [sp.to_dict() for sp in spans],
+                "profile": self.profile_path,
+            }
+
+
+class _NullSpan:
+    """ トレースの外で使われたときのダミー """
+    def set(self, **attrs):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+
+def current_trace():
+    return _current.get()
+
+@contextmanager
+def span(name, **attrs):
+    """ 現在のトレースに段階を1つ記録する (トレースの外では何もしない) """
+    tr = _current.get()
+    if tr is None:
+        yield _NULL_SPAN
+        return
+    with tr.span(name, **attrs) as sp:
+        yield sp
+
+def count(**values):
+    """ 現在のトレースの合計値に足す (トークン数・バイト数など) """
+    tr = _current.get()
+    if tr is not None:
+        tr.count(**values)
+
+@contextmanager
+def trace(name, log_path=None, **attrs):
+    """ 1回の操作をトレースし、終わったら JSONL に書き出す """
+    tr = Trace(name, **attrs)
+    token = _current.set(tr)
+    profiler = _start_profile(name)
+    try:
+        yield tr
+    except BaseException as e:
+        tr.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        tr.seconds = time.perf_counter() - tr._started
+        _current.reset(token)
+        if profiler:
+            tr.profile_path = _finish_profile(profiler, tr, log_path or LOG_PATH)
+        write_log(tr, log_path or LOG_PATH)
+
+def write_log(tr, log_path=LOG_PATH):
+    """ トレースを JSONL に1行追記する (書けなくても本処理は止めない) """
+    if not log_path or log_path.lower() == "off":
+        return
+    line = json.dumps(tr.to_dict(), ensure_ascii=False, default=str)
+    with _log_lock:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            if os.path.exists(log_path) and os.path.getsize(log_path) > MAX_LOG_BYTES:
+                os.replace(log_path, log_path + ".1")
+            with open(log_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError:
+            pass
+
+# ---- cProfile (TRACE_PROFILE) ----
+def _start_profile(name):
+    global _profiled
+    target = os.environ.get("TRACE_PROFILE", "")
+    if not target or target not in ("1", name):
+        return None
+    with _profile_lock:
+        if _profiled:
+            return None
+        _profiled = True
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 他のプロファイラが動いている
+        return None
+    return profiler
+
+def _finish_profile(profiler, tr, log_path):
+    profiler.disable()
+    directory = os.path.dirname(os.path.abspath(log_path)) if log_path and log_path.lower() != "off" else TRACE_DIR
+    path = os.path.join(directory, f"{tr.name}_{tr.id}.prof")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(path)
+    except OSError:
+        return None
+    return path
@@ -0,0 +1,54 @@
+import threading
+import time
+
+# ---------------------------------------------------------
+# バックグラウンドの暖機 (起動直後の待ち時間を隠す)
+# ---------------------------------------------------------
+# Gemini SDK の import やテンプレートのコンパイルは初回だけ重い。
+# ログイン画面を出すまではやらずに、ログイン後に別スレッドで先に済ませておく。
+# 途中で本処理が同じものを必要とした場合は、各キャッシュのロックで待ち合わせになるだけで二重には走らない。
+
+class Warmup:
+    """ (名前, 関数) のリストを1本のデーモンスレッドで順に実行し、かかった秒数を覚える """
+
+    def __init__(self, tasks):
+        self.tasks = list(tasks)
+        self.results = {}   # 名前 -> (秒数, 例外 or None)
+        self.done = threading.Event()
+        self.started_at = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self.started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for name, func in self.tasks:
+                start = time.perf_counter()
+                try:
+                    func()
+                    self.results[name] = (time.perf_counter() - start, None)
+                except Exception as e:
+                    # 暖機の失敗は本処理のときにもう一度起きるので、ここでは記録だけ
+                    self.results[name] = (time.perf_counter() - start, e)
+        finally:
+            self.done.set()
+
+    def summary(self):
+        """ 表示用の1行 """
+        if not self.results and not self.done.is_set():
+            return "暖機中..."
+        parts = [f"{name}: {sec * 1000:.0f}ms" + (f" (失敗: {err})" if err else "")
+                 for name, (sec, err) in self.results.items()]
+        return ("完了 " if self.done.is_set() else "暖機中 ") + " / ".join(parts)
+
+
+def import_module(name):
+    """ モジュールを import するだけのタスクを作る """
+    def run():
+        __import__(name)
+    return run
@@ -0,0 +1,190 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from cell_registry import CELLS, CHECKBOX, SHEET_NAMES, TEXT
+from cellref import build_anchor_index, resolve_anchor
+from main import DEFAULT_TEMPLATE, build_text_data, pool_chunksize
+from template_cache import get_compiled_template
+from xlsx_patch import MERGE_RE, CompiledXlsx, cell_text, read_cells, read_shared_strings, sheet_paths
+
+# ---------------------------------------------------------
+# 作成済みの xlsx -> JSON (update_opinion_form の逆)
+# ---------------------------------------------------------
+# テンプレートから作った意見書の xlsx を読み、{"text_data", "check_cells"} に戻す。
+# 過去の意見書を写真に撮って Gemini に読ませる代わりに、手元の xlsx から更新の元データを作れる。
+#   - 台帳 (cell_registry) の番地を結合セルの左上に直して読む (書き込みと同じ規則)
+#   - 記載欄: テンプレートと違う値が入っていれば取り込む
+#   - チェック欄: テンプレートで □ だったセルが ■ になっていれば取り込む
+#   - 毎回自動で入る欄 (記入日・医療機関) は取り込まない。記入日は meta_record_date (YYYY-MM-DD) にする
+# zip からはシート2枚と共有文字列だけを読み、中身のあるセルだけを正規表現で拾う (openpyxl は使わない)。
+# 結合範囲がテンプレートと同じなら、左上の索引もテンプレートのものを使い回す。
+#   python xlsx_import.py 過去の意見書/ -o imported.jsonl           # フォルダ内の *.xlsx をまとめて JSONL に
+#   python xlsx_import.py 過去の意見書/ --store                      # 患者の記録 (patient_store) にも入れる
+
+AUTO_FILLED = frozenset(build_text_data({"text_data": {}}, datetime.date.today()))
+RECORD_DATE_CELLS = ("DH3", "DR3", "EA3")   # 記入日 (令和 年 / 月 / 日)
+
+class FormReader:
+    """ テンプレートの □ / 記載欄の元の値を覚えておき、作成済みの xlsx を読む """
+
+    def __init__(self, template_path=DEFAULT_TEMPLATE):
+        compiled = get_compiled_template(template_path, kind=CompiledXlsx)
+        self.merges = [MERGE_RE.findall(sheet.xml) for sheet in compiled.sheets]
+        self.anchors = [sheet.anchors for sheet in compiled.sheets]
+        # 番地 -> テンプレートでの中身 (取り込むかどうかの比較用)
+        self.baseline = {}
+        for addr, cell in CELLS.items():
+            sheet = compiled.sheets[cell.sheet]
+            self.baseline[addr] = compiled.cell_text(sheet, sheet.anchor(addr))
+
+    def read(self, src):
+        """
+        src (パス or ファイルオブジェクト) を読む
+        戻り値: ({"text_data", "check_cells", "meta_record_date"?}, 気になった点のリスト)
+        """
+        with zipfile.ZipFile(src) as zf:
+            names = set(zf.namelist())
+            parts = {n: zf.read(n) for n in ("xl/workbook.xml", "xl/_rels/workbook.xml.rels")}
+            xmls = [zf.read(p).decode("utf-8") for p in sheet_paths(parts)[:2]]
+            sst = read_shared_strings(zf.read("xl/sharedStrings.xml").decode("utf-8")) if "xl/sharedStrings.xml" in names else []
+        if len(xmls) < 2:
+            raise ValueError("表・裏の2枚のシートがありません")
+        # シートごとの (中身のあるセル, 結合セルの索引)
+        sheets = [(read_cells(xml), self._anchors(idx, xml)) for idx, xml in enumerate(xmls)]
+
+        text_data, check_cells, record, notes = {}, [], {}, []
+        used = set()   # 台帳の番地が指すセル (シート, 左上の番地)
+        for addr, cell in CELLS.items():
+            cells, anchors = sheets[cell.sheet]
+            anchor = resolve_anchor(anchors, addr)
+            used.add((cell.sheet, anchor))
+            value = cell_text(cells, anchor, sst, numbers=True)
+            base = self.baseline[addr]
+            if cell.kind == CHECKBOX:
+                if value and "■" in value and base and "□" in base:
+                    check_cells.append(addr)
+            elif cell.kind == TEXT and value not in (None, "") and value != base:
+                if addr in RECORD_DATE_CELLS:
+                    record[addr] = value
+                elif addr not in AUTO_FILLED:
+                    text_data[addr] = value
+
+        # 台帳に無いセルに付いた ■ (手で付けた印など) は取り込まずに知らせる
+        for idx, (cells, _) in enumerate(sheets):
+            for addr in cells:
+                if (idx, addr) in used:
+                    continue
+                value = cell_text(cells, addr, sst)
+                if value and "■" in value:
+                    notes.append(f"台帳に無いセルの ■ を無視: {SHEET_NAMES[idx]}!{addr} ({value.strip()[:20]})")
+
+        data = {"text_data": text_data, "check_cells": check_cells}
+        date = record_date(record)
+        if date:
+            data["meta_record_date"] = date
+        return data, notes
+
+    def _anchors(self, idx, xml):
+        """ 結合セルの索引。結合範囲がテンプレートと同じならテンプレートのものを使い回す """
+        merges = MERGE_RE.findall(xml)
+        return self.anchors[idx] if merges == self.merges[idx] else build_anchor_index(merges)
+
+def record_date(record):
+    """ 記入日 {DH3: 令和の年, DR3: 月, EA3: 日} -> 'YYYY-MM-DD' (読めなければ None) """
+    try:
+        year, month, day = (int(float(record[a])) for a in RECORD_DATE_CELLS)
+        return datetime.date(year + 2018 if year < 1000 else year, month, day).isoformat()
+    except (KeyError, ValueError, TypeError):
+        return None
+
+_readers = {}
+
+def read_form(src, template_path=DEFAULT_TEMPLATE):
+    """ 1件読む (テンプレートごとの FormReader はプロセスで1つ) """
+    reader = _readers.get(template_path)
+    if reader is None:
+        reader = _readers[template_path] = FormReader(template_path)
+    return reader.read(src)
+
+# ---------------------------------------------------------
+# フォルダごとの一括取り込み
+# ---------------------------------------------------------
+def _import_one(args):
+    path, template_path = args
+    try:
+        data, notes = read_form(path, template_path)
+        return path, data, notes
+    except Exception as e:
+        return path, e, []
+
+def find_forms(src):
+    """ src (xlsx ファイル or フォルダ) の下にある *.xlsx (Excel の一時ファイル ~$ は除く) """
+    if os.path.isfile(src):
+        return [src]
+    found = []
+    for root, _, files in os.walk(src):
+        found.extend(os.path.join(root, f) for f in files if f.lower().endswith(".xlsx") and not f.startswith("~$"))
+    return sorted(found)
+
+def import_forms(paths, template_path=DEFAULT_TEMPLATE, workers=None):
+    """ 複数の xlsx を読む。戻り値: [(パス, data or 例外, 気になった点), ...] (paths と同じ順) """
+    args = [(p, template_path) for p in paths]
+    if len(args) < 8 or workers == 1:
+        return [_import_one(a) for a in args]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_import_one, args, chunksize=pool_chunksize(len(args), workers)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="作成済みの主治医意見書(xlsx)を JSON に戻す")
+    parser.add_argument("input", help="xlsx ファイル、または xlsx を入れたフォルダ")
+    parser.add_argument("-o", "--out", default=None, help="出力する .jsonl (main.py の一括作成の入力と同じ形式)")
+    parser.add_argument("-t", "--template", default=DEFAULT_TEMPLATE, help="テンプレートxlsx")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="並列プロセス数 (既定: CPU数)")
+    parser.add_argument("--store", action="store_true", help="患者の記録 (patient_store) にも保存する")
+    args = parser.parse_args(argv)
+
+    paths = find_forms(args.input)
+    if not paths:
+        print("xlsx がありません")
+        return 1
+    start = time.perf_counter()
+    results = import_forms(paths, args.template, args.workers)
+    elapsed = time.perf_counter() - start
+
+    store = None
+    if args.store:
+        from patient_store import PatientStore
+        store = PatientStore()
+    out = open(args.out, "w", encoding="utf-8") if args.out else None
+    ok, failed, stored = 0, 0, 0
+    try:
+        for path, data, notes in results:
+            name = os.path.relpath(path, args.input) if os.path.isdir(args.input) else os.path.basename(path)
+            if isinstance(data, Exception):
+                failed += 1
+                print(f"失敗: {name}: {data}")
+                continue
+            ok += 1
+            for note in notes:
+                print(f"注意: {name}: {note}")
+            if out:
+                out.write(json.dumps({"id": os.path.splitext(name)[0], **data}, ensure_ascii=False) + "\n")
+            if store and store.save(data, date=data.get("meta_record_date")):
+                stored += 1
+    finally:
+        if out:
+            out.close()
+
+    rate = len(paths) / elapsed if elapsed > 0 else 0.0
+    print(f"完了: {ok}件成功 / {failed}件失敗 ({elapsed:.2f}秒, {rate:.1f}件/秒)"
+          + (f" -> {args.out}" if args.out else "") + (f" / 患者の記録に {stored}件保存" if store else ""))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,506 @@
+import io
+import os
+import posixpath
+import re
+import struct
+import threading
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+
+from cellref import build_anchor_index, col_to_index, resolve_anchor, split_address
+from template_cache import TemplateSource
+from tracing import span
+
+# ---------------------------------------------------------
+# XML直接書き換えエンジン
+# ---------------------------------------------------------
+# openpyxl でブック全体を読み込み・保存する代わりに、テンプレートの zip を
+# そのまま流用し、2枚のシートXMLの該当 <c> 要素と sharedStrings だけを書き換える。
+# それ以外のパーツ(スタイル・図形・印刷設定など)は中身をそのままコピーする。
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+CELL_RE = re.compile(r'<c r="([A-Z]+)(\d+)"([^>]*?)(/>|>(.*?)</c>)', re.S)
+# 中身のある <c> だけ (空の <c .../> は読み飛ばす)
+FILLED_CELL_RE = re.compile(r'<c r="([A-Z]+\d+)"([^>]*?)(?<!/)>(.*?)</c>', re.S)
+ROW_RE = re.compile(r'<row r="(\d+)"[^>]*?(/>|>)')
+T_ATTR_RE = re.compile(r'\s+t="[^"]*"')
+V_RE = re.compile(r"<v>(.*?)</v>", re.S)
+IS_T_RE = re.compile(r"<t(?:\s[^>]*)?>(.*?)</t>", re.S)
+MERGE_RE = re.compile(r'<mergeCell ref="([A-Z]+\d+:[A-Z]+\d+)"')
+# XML 1.0 で使えない制御文字
+ILLEGAL_XML_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def _unescape(text):
+    return text.replace("&lt;", "<").replace("&gt;", ">").replace("&quot;", '"').replace("&apos;", "'").replace("&amp;", "&")
+
+def _si_text(si):
+    """ 共有文字列 <si> の表示テキスト (<t> と リッチテキスト <r> のみ。rPh は除く) """
+    parts = []
+    for child in si:
+        if child.tag == f"{{{NS_MAIN}}}t":
+            parts.append(child.text or "")
+        elif child.tag == f"{{{NS_MAIN}}}r":
+            parts.extend(t.text or "" for t in child.iter(f"{{{NS_MAIN}}}t"))
+    return "".join(parts)
+
+
+class SheetXml:
+    """ 1枚のシートXMLと、セル・行・結合範囲の位置情報 """
+
+    def __init__(self, name, xml):
+        self.name = name
+        self.xml = xml
+
+        # セル番地 -> (属性文字列, 中身)  (cell_text で読む)
+        self.cells = {}
+        # セル番地 -> (開始位置, 終了位置)  (書き換える位置)
+        self.spans = {}
+        # 行番号 -> [(列番号, 開始位置)] (列順)
+        self.row_cells = {}
+        for m in CELL_RE.finditer(xml):
+            col, row = m.group(1), int(m.group(2))
+            address = m.group(1) + m.group(2)
+            self.cells[address] = (m.group(3), m.group(5) or "")
+            self.spans[address] = (m.start(), m.end())
+            self.row_cells.setdefault(row, []).append((col_to_index(col), m.start()))
+
+        # 行番号 -> (開始タグ開始, 開始タグ終了, </row>位置 or None(空行))
+        self.rows = {}
+        for m in ROW_RE.finditer(xml):
+            if m.group(2) == "/>":
+                self.rows[int(m.group(1))] = (m.start(), m.end(), None)
+            else:
+                self.rows[int(m.group(1))] = (m.start(), m.end(), xml.index("</row>", m.end()))
+        self.sheet_data_end = xml.find("</sheetData>")
+
+        # 結合セル -> 左上セル の索引
+        self.anchors = build_anchor_index(MERGE_RE.findall(xml))
+
+    def anchor(self, address):
+        """ 範囲指定・結合セルを左上の番地に正規化する (safe_get_cell と同じ規則) """
+        return resolve_anchor(self.anchors, address)
+
+
+class CompiledXlsx(TemplateSource):
+    """ テンプレートの zip を解析済みの状態で保持する """
+
+    def __init__(self, path):
+        super().__init__(path)
+        with zipfile.ZipFile(path) as zf:
+            self.entries = [(info, zf.read(info.filename)) for info in zf.infolist()]
+        parts = {info.filename: data for info, data in self.entries}
+        self.sheet_paths = sheet_paths(parts)
+
+        # 数式セルは開くときに計算し直させる (下の _recalc_on_load)
+        parts = _recalc_on_load(parts, self.sheet_paths[:2])
+        self.entries = [(info, parts[info.filename]) for info, _ in self.entries if info.filename in parts]
+        self.infos = [info for info, _ in self.entries]
+        self._deflated = {}
+        self._deflate_lock = threading.Lock()
+
+        # 書き換え対象は表・裏の2枚
+        self.sheets = [SheetXml(p, parts[p].decode("utf-8")) for p in self.sheet_paths[:2]]
+
+        # 共有文字列 (表示テキストのみ。ふりがな rPh は除く)
+        self.sst_path = "xl/sharedStrings.xml"
+        self.sst_xml = parts[self.sst_path].decode("utf-8")
+        self.shared_strings = read_shared_strings(self.sst_xml)
+
+    def deflated(self, filename):
+        """ テンプレートのパーツを圧縮したもの (初回だけ圧縮し、以降は使い回す) """
+        hit = self._deflated.get(filename)
+        if hit is None:
+            with self._deflate_lock:
+                hit = self._deflated.get(filename)
+                if hit is None:
+                    info, data = next((i, d) for i, d in self.entries if i.filename == filename)
+                    hit = self._deflated[filename] = _deflate(data, info.compress_type)
+        return hit
+
+    def cell_text(self, sheet, address):
+        """ セルの現在の文字列 (文字列以外・空なら None) """
+        return cell_text(sheet.cells, address, self.shared_strings)
+
+
+# ---------------------------------------------------------
+# 数式の再計算
+# ---------------------------------------------------------
+# テンプレートの数式セル (表 CV9 の年齢、裏 CZ4 の氏名、EQ列の入力チェックなど) には
+# 空欄のときの計算結果が <v> で残っている。書き込んだ後もそれを出すと Excel は古い値を表示する。
+# openpyxl版と同じく、書き換えるシートの数式セルから <v> を外し、calcChain を捨て、
+# calcPr に fullCalcOnLoad="1" を付けて開くときに全部計算させる。
+CALC_PR_RE = re.compile(r"<calcPr\b([^>]*?)(/?>)")
+FULL_CALC_RE = re.compile(r'\s+fullCalcOnLoad="[^"]*"')
+# calcPr が無いときに前に入れる要素 (スキーマの順番で calcPr より後ろのもの)
+AFTER_CALC_PR_RE = re.compile(r"<(?:oleSize|customWorkbookViews|pivotCaches|smartTagPr|smartTagTypes|webPublishing"
+                              r"|fileRecoveryPr|webPublishObjects|extLst)\b|</workbook>")
+FORMULA_V_RE = re.compile(r"(<f\b(?:[^>]*/>|[^>]*(?<!/)>[^<]*</f>))(?:<v>[^<]*</v>|<v/>)")
+CALC_CHAIN_REL_RE = re.compile(r'<Relationship\b[^>]*Type="[^"]*/calcChain"[^>]*/>')
+REL_TARGET_RE = re.compile(r'Target="([^"]*)"')
+
+def _full_calc_on_load(wb_xml):
+    """ workbook.xml の calcPr に fullCalcOnLoad="1" を付ける """
+    m = CALC_PR_RE.search(wb_xml)
+    if m:
+        attrs = FULL_CALC_RE.sub("", m.group(1))
+        return wb_xml[:m.start()] + f'<calcPr{attrs} fullCalcOnLoad="1"{m.group(2)}' + wb_xml[m.end():]
+    m = AFTER_CALC_PR_RE.search(wb_xml)
+    return wb_xml[:m.start()] + '<calcPr fullCalcOnLoad="1"/>' + wb_xml[m.start():]
+
+def _recalc_on_load(parts, patched_sheets):
+    """ 開くときに数式を計算し直させるよう書き換えた parts (新しい dict) を返す """
+    parts = dict(parts)
+    parts["xl/workbook.xml"] = _full_calc_on_load(parts["xl/workbook.xml"].decode("utf-8")).encode("utf-8")
+    for path in patched_sheets:
+        parts[path] = FORMULA_V_RE.sub(r"\1", parts[path].decode("utf-8")).encode("utf-8")
+
+    # calcChain はパーツ・リレーション・Content_Types の3か所から外す
+    rels_path = "xl/_rels/workbook.xml.rels"
+    rels = parts[rels_path].decode("utf-8")
+    for rel in CALC_CHAIN_REL_RE.findall(rels):
+        target = REL_TARGET_RE.search(rel).group(1)
+        chain = target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+        parts.pop(chain, None)
+        types = parts["[Content_Types].xml"].decode("utf-8")
+        types = re.sub(rf'<Override\b[^>]*PartName="/{re.escape(chain)}"[^>]*/>', "", types)
+        parts["[Content_Types].xml"] = types.encode("utf-8")
+    parts[rels_path] = CALC_CHAIN_REL_RE.sub("", rels).encode("utf-8")
+    return parts
+
+
+def sheet_paths(parts):
+    """ workbook.xml のシート順の実ファイル名 (parts は {zip内のパス: bytes}。workbook.xml と rels だけあればよい) """
+    rels = ET.fromstring(parts["xl/_rels/workbook.xml.rels"])
+    targets = {r.get("Id"): r.get("Target") for r in rels.iter(f"{{{NS_PKG_REL}}}Relationship")}
+    wb_xml = ET.fromstring(parts["xl/workbook.xml"])
+    paths = []
+    for sh in wb_xml.iter(f"{{{NS_MAIN}}}sheet"):
+        target = targets[sh.get(f"{{{NS_REL}}}id")]
+        if target.startswith("/"):
+            paths.append(target.lstrip("/"))
+        else:
+            paths.append(posixpath.normpath(posixpath.join("xl", target)))
+    return paths
+
+def read_shared_strings(sst_xml):
+    """ 共有文字列の表示テキストのリスト """
+    return [_si_text(si) for si in ET.fromstring(sst_xml).iter(f"{{{NS_MAIN}}}si")]
+
+def read_cells(xml):
+    """ シートXMLの中身のあるセル {番地: (属性文字列, 中身)} (読むだけのとき。位置は持たない) """
+    return {m.group(1): (m.group(2), m.group(3)) for m in FILLED_CELL_RE.finditer(xml)}
+
+def cell_text(cells, address, shared_strings, numbers=False):
+    """
+    セルの文字列 (空なら None)。numbers=True なら数値・真偽値のセルも文字列にして返す
+    cells は {番地: (属性文字列, 中身)} (SheetXml.cells / read_cells の戻り値)
+    """
+    hit = cells.get(address)
+    if not hit:
+        return None
+    attrs, inner = hit
+    t = re.search(r'\bt="([^"]*)"', attrs)
+    t = t.group(1) if t else "n"
+    if t == "s":
+        v = V_RE.search(inner)
+        return shared_strings[int(v.group(1))] if v else None
+    if t == "inlineStr":
+        return "".join(_unescape(x) for x in IS_T_RE.findall(inner))
+    if t == "str" or (numbers and t in ("n", "b")):
+        v = V_RE.search(inner)
+        return _unescape(v.group(1)) if v else None
+    return None
+
+
+class _SharedStringWriter:
+    """ 追加分の共有文字列を貯めておき、最後に sst の末尾へ追記する """
+
+    def __init__(self, compiled):
+        self.base = len(compiled.shared_strings)
+        self.added = []
+        self.index = {}
+
+    def add(self, text):
+        if text not in self.index:
+            self.index[text] = self.base + len(self.added)
+            self.added.append(text)
+        return self.index[text]
+
+    def render(self, sst_xml):
+        if not self.added:
+            return sst_xml
+        items = "".join(f'<si><t xml:space="preserve">{escape(t)}</t></si>' for t in self.added)
+        total = self.base + len(self.added)
+        head_end = sst_xml.index(">", sst_xml.index("<sst")) + 1
+        head = sst_xml[:head_end]
+        head = re.sub(r'uniqueCount="\d+"', f'uniqueCount="{total}"', head)
+        head = re.sub(r'\scount="(\d+)"', lambda m: f' count="{int(m.group(1)) + len(self.added)}"', head)
+        body = sst_xml[head_end:]
+        return head + body.replace("</sst>", items + "</sst>")
+
+
+def _cell_xml(address, attrs, value, sst):
+    """ 値を書き込んだ <c> 要素を作る (スタイル等の属性は元のまま) """
+    attrs = T_ATTR_RE.sub("", attrs)
+    if isinstance(value, bool):
+        return f'<c r="{address}"{attrs} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{address}"{attrs}><v>{value}</v></c>'
+    text = ILLEGAL_XML_RE.sub("", str(value))
+    return f'<c r="{address}"{attrs} t="s"><v>{sst.add(text)}</v></c>'
+
+def _patch_sheet(sheet, writes, sst):
+    """ {番地: 値} を1枚のシートXMLに適用した文字列を返す """
+    edits = []      # (位置, 終了位置, 並び順キー, 置換文字列)
+    new_rows = {}   # 行が存在しない場合の新規セル {行: [(列, xml)]}
+    empty_rows = {} # <row .../> (セルの無い行) に入れるセル {行: [(列, xml)]}
+    for address, value in writes.items():
+        col, row = split_address(address)
+        span = sheet.spans.get(address)
+        if span:
+            start, end = span
+            attrs = sheet.cells[address][0]
+            edits.append((start, end, col, _cell_xml(address, attrs, value, sst)))
+            continue
+
+        cell_xml = _cell_xml(address, "", value, sst)
+        row_pos = sheet.rows.get(row)
+        if row_pos is None:
+            new_rows.setdefault(row, []).append((col, cell_xml))
+            continue
+        open_start, open_end, close = row_pos
+        if close is None:
+            empty_rows.setdefault(row, []).append((col, cell_xml))
+            continue
+        pos = next((s for c, s in sheet.row_cells.get(row, []) if c > col), close)
+        edits.append((pos, pos, col, cell_xml))
+
+    for row, cells in sorted(new_rows.items()):
+        cells_xml = "".join(x for _, x in sorted(cells))
+        pos = next((sheet.rows[r][0] for r in sorted(sheet.rows) if r > row), sheet.sheet_data_end)
+        edits.append((pos, pos, 0, f'<row r="{row}">{cells_xml}</row>'))
+    # 同じ行の新しいセルはまとめて1回で入れる (セルごとに行を開くと <row> が重複する)
+    # 新しい行の挿入と同じ位置になることがあるので、挿入より後に並べる
+    for row, cells in empty_rows.items():
+        open_start, open_end, _ = sheet.rows[row]
+        tag = sheet.xml[open_start:open_end - 2].rstrip() + ">"
+        cells_xml = "".join(x for _, x in sorted(cells))
+        edits.append((open_start, open_end, 0, f"{tag}{cells_xml}</row>"))
+
+    if not edits:
+        return sheet.xml
+    edits.sort(key=lambda e: (e[0], e[2]))
+    out, cursor = [], 0
+    for start, end, _, text in edits:
+        out.append(sheet.xml[cursor:start])
+        out.append(text)
+        cursor = max(cursor, end)
+    out.append(sheet.xml[cursor:])
+    return "".join(out)
+
+
+def fill_xlsx(compiled, sheet_writes, sheet_checks, output):
+    """
+    テンプレートに値を書き込んだ xlsx を output (パス or ファイルオブジェクト) に出力する
+    sheet_writes: [{番地: 値}, ...] (シート順)
+    sheet_checks: [[番地, ...], ...] (シート順。□ を ■ にする)
+    """
+    doc = LiveXlsx(compiled)
+    doc.update(sheet_writes, sheet_checks)
+    doc.save(output)
+
+def _sheet_writes(compiled, sheet, writes_in, checks_in):
+    """ 1枚分の {左上の番地: 書き込む値} (チェック欄は □ を ■ にした文字列) """
+    writes = {}
+    for addr, val in writes_in.items():
+        anchor = sheet.anchor(addr)
+        if anchor:
+            writes[anchor] = val
+    for addr in checks_in:
+        anchor = sheet.anchor(addr)
+        if not anchor:
+            continue
+        text = writes.get(anchor)
+        if text is None:
+            text = compiled.cell_text(sheet, anchor)
+        if isinstance(text, str) and "□" in text:
+            writes[anchor] = text.replace("□", "■")
+    return writes
+
+
+class LiveXlsx:
+    """
+    1件の書類の書き込み状態 (セッションに置いて使い回す)
+    update() のたびに前回と中身が変わったシートだけを作り直して圧縮し、
+    変わっていないパーツは圧縮済みのバイト列をそのまま zip に詰める。
+    共有文字列は追記のみ (前回までの番号を保つため、使わなくなった文字列も残す)。
+    """
+
+    def __init__(self, compiled):
+        self.compiled = compiled
+        self.sst = _SharedStringWriter(compiled)
+        self.sheet_writes = [None] * len(compiled.sheets)  # 前回の {番地: 値}
+        self.parts = {}                                    # 書き換えたパーツ -> _deflate の結果
+        self._sst_added = 0
+
+    def update(self, sheet_writes, sheet_checks):
+        """ 新しい書き込み内容を反映する。戻り値: 作り直したシートの数 """
+        changed = 0
+        with span("write_cells") as sp:
+            for i, sheet in enumerate(self.compiled.sheets):
+                writes = _sheet_writes(
+                    self.compiled, sheet,
+                    sheet_writes[i] if i < len(sheet_writes) else {},
+                    sheet_checks[i] if i < len(sheet_checks) else [],
+                )
+                if writes == self.sheet_writes[i]:
+                    continue
+                self.sheet_writes[i] = writes
+                changed += 1
+                if writes:
+                    xml = _patch_sheet(sheet, writes, self.sst).encode("utf-8")
+                    self.parts[sheet.name] = _deflate(xml, level=PATCH_LEVEL)
+                else:
+                    # 何も書かないシートはテンプレートのまま
+                    self.parts.pop(sheet.name, None)
+            if len(self.sst.added) != self._sst_added:
+                self._sst_added = len(self.sst.added)
+                xml = self.sst.render(self.compiled.sst_xml).encode("utf-8")
+                self.parts[self.compiled.sst_path] = _deflate(xml, level=PATCH_LEVEL)
+            sp.set(sheets_changed=changed)
+        return changed
+
+    def save(self, output):
+        with span("save"):
+            _write_zip(output, self.compiled, self.parts)
+
+
+# ---------------------------------------------------------
+# zip の書き出し (圧縮済みのパーツをそのまま使う)
+# ---------------------------------------------------------
+# zipfile は圧縮前のデータしか受け取らないので、ローカルヘッダーと中央ディレクトリを自前で書く。
+# テンプレートのパーツは最初に1回だけ圧縮して CompiledXlsx に覚えておく。
+# 書き換えたパーツは作成のたびに圧縮するので、速さ優先の圧縮レベルにする (サイズは2割ほど大きくなる)。
+PATCH_LEVEL = zlib.Z_BEST_SPEED
+
+def _deflate(data, compress_type=zipfile.ZIP_DEFLATED, level=zlib.Z_DEFAULT_COMPRESSION):
+    """ (crc32, 元のサイズ, 圧縮後のバイト列, 圧縮方式) """
+    if compress_type == zipfile.ZIP_DEFLATED:
+        co = zlib.compressobj(level, zlib.DEFLATED, -15)
+        body = co.compress(data) + co.flush()
+    else:
+        compress_type, body = zipfile.ZIP_STORED, data
+    return zlib.crc32(data), len(data), body, compress_type
+
+def _dos_datetime(date_time):
+    y, mo, d, h, mi, sec = date_time
+    return (h << 11) | (mi << 5) | (sec // 2), ((y - 1980) << 9) | (mo << 5) | d
+
+def _write_zip(output, compiled, parts):
+    """ テンプレートのパーツ順に、parts にあるものは差し替えて zip を書く """
+    if isinstance(output, (str, bytes, os.PathLike)):
+        with open(output, "wb") as f:
+            return _write_zip(f, compiled, parts)
+
+    offset, central = 0, []
+    for info in compiled.infos:
+        crc, size, body, method = parts.get(info.filename) or compiled.deflated(info.filename)
+        name = info.filename.encode("utf-8")
+        flags = 0x800 if not info.filename.isascii() else 0
+        dos_time, dos_date = _dos_datetime(info.date_time)
+        header = struct.pack("<IHHHHHIIIHH", 0x04034B50, 20, flags, method, dos_time, dos_date,
+                             crc, len(body), size, len(name), 0)
+        output.write(header)
+        output.write(name)
+        output.write(body)
+        central.append(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014B50, 20, 20, flags, method, dos_time, dos_date,
+                                   crc, len(body), size, len(name), 0, 0, 0, 0, info.external_attr, offset) + name)
+        offset += len(header) + len(name) + len(body)
+
+    directory = b"".join(central)
+    output.write(directory)
+    output.write(struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, len(central), len(central), len(directory), offset, 0))
+
+
+# ---------------------------------------------------------
+# エンジン比較 (python xlsx_patch.py)
+# ---------------------------------------------------------
+def compare_engines(template_path, data):
+    """ openpyxl版とXML版で同じデータを書き込み、表・裏の全セル値の差分を返す """
+    import copy
+    from main import update_opinion_form
+
+    books = {}
+    for engine in ("openpyxl", "xml"):
+        buf = io.BytesIO()
+        msg = update_opinion_form(template_path, buf, copy.deepcopy(data), engine=engine)
+        if not msg.startswith("成功"):
+            raise RuntimeError(f"{engine}: {msg}")
+        books[engine] = buf.getvalue()
+    return diff_workbooks(books["openpyxl"], books["xml"])
+
+def diff_workbooks(xlsx_a, xlsx_b):
+    """
+    2つの xlsx (bytes) を比べ、[(シート名, 番地, a の値, b の値), ...] を返す
+    - 表・裏の全セル値 (数式は式そのもの)
+    - 数式セルに残っている計算結果 (番地に「(計算結果)」を付けて返す)
+    - workbook.xml の calcPr (シート名 "workbook"・番地 "calcPr" で返す)
+    """
+    import openpyxl
+
+    books = [(openpyxl.load_workbook(io.BytesIO(x)), openpyxl.load_workbook(io.BytesIO(x), data_only=True))
+             for x in (xlsx_a, xlsx_b)]
+    diffs = []
+    calc = [_calc_pr(x) for x in (xlsx_a, xlsx_b)]
+    if calc[0] != calc[1]:
+        diffs.append(("workbook", "calcPr", calc[0], calc[1]))
+    (wb_a, cached_a), (wb_b, cached_b) = books
+    for ws_a, ws_b, cv_a, cv_b in zip(wb_a.worksheets[:2], wb_b.worksheets[:2], cached_a.worksheets, cached_b.worksheets):
+        rows = max(ws_a.max_row, ws_b.max_row)
+        cols = max(ws_a.max_column, ws_b.max_column)
+        for r in range(1, rows + 1):
+            for c in range(1, cols + 1):
+                # openpyxl は保存時に空文字セルを落とすので "" と None は同一視する
+                a, b = ws_a.cell(r, c).value, ws_b.cell(r, c).value
+                coord = ws_a.cell(r, c).coordinate
+                if (a if a != "" else None) != (b if b != "" else None):
+                    diffs.append((ws_a.title, coord, a, b))
+                elif ws_a.cell(r, c).data_type == "f":
+                    a, b = cv_a.cell(r, c).value, cv_b.cell(r, c).value
+                    if a != b:
+                        diffs.append((ws_a.title, f"{coord}(計算結果)", a, b))
+    return diffs
+
+def _calc_pr(xlsx):
+    """ workbook.xml の calcPr の属性 {名前: 値} (calcId は保存したアプリの版なので除く) """
+    with zipfile.ZipFile(io.BytesIO(xlsx)) as zf:
+        m = CALC_PR_RE.search(zf.read("xl/workbook.xml").decode("utf-8"))
+    if not m:
+        return {}
+    attrs = dict(re.findall(r'(\w+)="([^"]*)"', m.group(1)))
+    attrs.pop("calcId", None)
+    return attrs
+
+# 比較に使う見本 (結合セルの右側・範囲外・未登録の番地、XMLのエスケープが要る文字を含む)
+COMPARE_SAMPLE = {
+    "text_data": {"A13": "山田 太郎", "O12": "やまだ たろう", "A38": "右変形性股関節症 <経過観察> & 内服",
+                  "BC8": "158", "BX8": "52", "A58": "特記事項", "AG50": "降圧剤内服中",
+                  "O13": "結合セルの右側", "EZ200": "範囲外"},
+    "check_cells": ["CB16", "DP23", "AH25", "CA25", "AF34", "CM53", "CD55", "V39", "AM39",
+                    "BU39", "BV43", "CY46", "CY47", "AB50", "AG8", "ZZ1"],
+    "meta_birth_date": "1948-05-02",
+}
+
+if __name__ == "__main__":
+    import sys
+
+    diffs = compare_engines("主治医意見書_テンプレート.xlsx", COMPARE_SAMPLE)
+    for d in diffs:
+        print(d)
+    print("一致" if not diffs else f"差分 {len(diffs)} 件")
+    sys.exit(1 if diffs else 0)